@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import instrumentation
+
+# Whisper と Resemblyzer が前提とするサンプリングレート
+SAMPLE_RATE = 16000
+# 並列デコード (decode_audio_parallel) の既定のffmpegプロセス数 (1 なら従来どおり1プロセスで全体をデコード)
+DEFAULT_DECODE_WORKERS = 1
+# 並列デコードで1つのffmpegに割り当てる区間の最短の長さ (秒)。プロセス起動のコストに見合わない短い分割はしない
+MIN_DECODE_RANGE_SEC = 30.0
+# 区間の開始位置 (とその手前の重ねる分) をそろえる単位 (秒)。40ms は 8k/11.025k/22.05k/44.1k/48kHz などどの
+# サンプリングレートでも元のサンプルと16kHzのサンプルの両方の境界になるので、シーク先からリサンプラーを始めても
+# 1プロセスで全体をデコードした場合と同じ位相で16kHzのサンプルが並ぶ
+DECODE_ALIGN_SEC = 0.04
+# 各区間は前後にこの秒数 (DECODE_ALIGN_SEC の倍数) だけ隣の区間と重ねてデコードし、重ねた分は捨てる
+# (シーク直後はMP3デコーダーとリサンプラーの状態が整わず、区間の終わりではリサンプラーの出力が途切れ、境界付近の波形がずれるため)
+DECODE_MARGIN_SEC = 0.48
+# ffmpegのstdoutを読み込む単位 (バイト)
+READ_CHUNK_BYTES = 1 << 20
+
+
+def ffmpeg_available():
+    """ffmpeg が PATH 上にあるかどうか (モデルを読み込む前に確認して、すぐにエラー終了するため)"""
+    return shutil.which("ffmpeg") is not None
+
+
+def ffmpeg_decode_command(audio_path, extra_args=()):
+    """音声を16kHzモノラルの生PCM (s16le) としてstdoutに出力するffmpegコマンドを返す"""
+    return [
+        "ffmpeg", "-nostdin", "-i", audio_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-ac", "1",
+        "-loglevel", "error", *extra_args, "pipe:1"
+    ]
+
+
+def probe_duration(audio_path):
+    """ffprobeで音声ファイルの長さ (秒) を取得する。ffprobe が無い・長さが読めない場合は None"""
+    if shutil.which("ffprobe") is None:
+        return None
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", audio_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8", errors="replace")
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def pcm16_to_float32(data):
+    """s16le のバイト列を -1.0~1.0 の float32 配列に変換する"""
+    if len(data) % 2:
+        data = data[:-1]
+    return np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio(audio_path):
+    """
+    ffmpegで音声ファイルをデコードし、16kHzモノラルの float32 配列を返す。
+    一時WAVを経由せず、ffmpegのstdoutを直接読み込む。
+    """
+    process = subprocess.run(ffmpeg_decode_command(audio_path), capture_output=True)
+    if process.returncode != 0:
+        stderr_text = process.stderr.decode("utf-8", errors="replace")
+        print(f"ffmpeg stderr: {stderr_text}")
+        raise RuntimeError(f"ffmpeg decoding failed with code {process.returncode}")
+    return pcm16_to_float32(process.stdout)
+
+
+def split_decode_ranges(total_duration, workers=DEFAULT_DECODE_WORKERS):
+    """
+    音声全体を最大 workers 個の時間区間に分ける (各区間は MIN_DECODE_RANGE_SEC 秒以上)。
+    最後の区間は長さを指定せず末尾までとする (ffprobe の長さが実際より短い場合も取りこぼさない)。
+    戻り値: [(開始秒, 長さ秒 または None), ...] (長さが分からない場合は [(0.0, None)])
+    """
+    if not total_duration or total_duration <= 0 or workers <= 1:
+        return [(0.0, None)]
+    n_ranges = max(1, min(workers, int(total_duration // MIN_DECODE_RANGE_SEC)))
+    # 区間の境界は DECODE_ALIGN_SEC の倍数にそろえる (16kHzのサンプル単位でもあるので、隣り合う区間のバッファ上の位置もずれない)
+    step = round(DECODE_ALIGN_SEC * SAMPLE_RATE)
+    bounds = [round(total_duration * i / n_ranges * SAMPLE_RATE / step) * step / SAMPLE_RATE for i in range(n_ranges)]
+    return [(start, bounds[i + 1] - start if i + 1 < n_ranges else None) for i, start in enumerate(bounds)]
+
+
+def _read_progress(stream, on_time, errors):
+    """
+    ffmpegの -progress 出力 (key=value の行) から out_time_us を読み、処理済みの秒数を on_time に渡す。
+    key=value でない行 (エラーメッセージ) は errors に集める。
+    """
+    for line in stream:
+        key, separator, value = line.rstrip().partition(b"=")
+        if not separator:
+            if line.strip():
+                errors.append(line.decode("utf-8", errors="replace").rstrip())
+        elif key in (b"out_time_us", b"out_time_ms") and value.isdigit(): # 古いffmpegは out_time_ms (単位はどちらもマイクロ秒)
+            on_time(int(value) / 1_000_000)
+
+
+def decode_audio_parallel(audio_path, total_duration=None, workers=DEFAULT_DECODE_WORKERS, on_progress=None):
+    """
+    音声を時間区間に分け、区間ごとのffmpeg (-ss / -t) を並列に実行して16kHzモノラルの float32 配列にデコードする。
+    各プロセスの出力は、長さ (total_duration、ffprobe で1回だけ調べたもの) から確保した1つの配列の
+    その区間の位置に直接書き込み、区間ごとの配列を後から連結することはしない。
+    区間の開始位置とシーク先は DECODE_ALIGN_SEC の倍数なので、結果は decode_audio と同じになる
+    (DECODE_ALIGN_SEC の倍数にならない特殊なサンプリングレートや、AAC (m4a) のようにシーク後のデコード結果が
+    途中から始めた場合と一致しない形式では、波形がわずかに異なることがある)。
+    長さが分からない場合や workers が 1 の場合は、1つのffmpegで全体をデコードする (decode_audio と同じ結果)。
+    その場合も長さが分かっていれば配列に直接書き込み、分からなければ s16le のまま受け取って最後に1回だけ変換する
+    (どちらもメモリ使用量は decode_audio 以下)。
+    on_progress を指定すると、全プロセス合計の処理済みの秒数 (重ねてデコードした分は除く) を引数に呼び出す
+    (-progress の key=value 出力から読む)。
+    """
+    ranges = split_decode_ranges(total_duration, workers)
+    offsets = [round(start * SAMPLE_RATE) for start, _ in ranges]
+    # 最後の区間は長さを指定しないので1秒分の余裕を取り、それを超えた分は別に受け取って末尾に足す
+    # (長さが分からなければ全体を別に受け取る)
+    capacity = round(total_duration * SAMPLE_RATE) + SAMPLE_RATE if total_duration and total_duration > 0 else 0
+    limits = offsets[1:] + [capacity]
+    buffer = np.zeros(capacity, dtype=np.float32)
+    written = [0] * len(ranges)
+    overflow = bytearray()
+    processed = [0.0] * len(ranges)
+    lock = threading.Lock()
+
+    def report(i, seconds):
+        # 手前に重ねた分を除き、区間の長さを超えた分 (後ろに重ねた分) も数えない
+        start, duration = ranges[i]
+        seconds = max(0.0, seconds - min(DECODE_MARGIN_SEC, start))
+        if duration is not None:
+            seconds = min(seconds, duration)
+        with lock:
+            processed[i] = seconds
+            if on_progress is not None:
+                on_progress(sum(processed))
+
+    def decode_range(i):
+        start, duration = ranges[i]
+        preroll = min(DECODE_MARGIN_SEC, start)
+        input_args = ["-ss", f"{start - preroll:.6f}"] if start > 0 else []
+        if duration is not None:
+            input_args += ["-t", f"{preroll + duration + DECODE_MARGIN_SEC:.6f}"]
+        cmd = ffmpeg_decode_command(audio_path, extra_args=["-progress", "pipe:2", "-nostats"])
+        cmd[2:2] = input_args # -ss / -t は入力側 (-i の前) に付けてシークさせる
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors = []
+        progress_thread = threading.Thread(target=_read_progress, args=(process.stderr, lambda t: report(i, t), errors), daemon=True)
+        progress_thread.start()
+
+        position = offsets[i]
+        skip = round(preroll * SAMPLE_RATE) # 手前からデコードした分のサンプル数
+        pending = b""
+        for chunk in iter(lambda: process.stdout.read(READ_CHUNK_BYTES), b""):
+            data = pending + chunk
+            usable = len(data) - len(data) % 2
+            pending = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype=np.int16)
+            if skip:
+                dropped = min(skip, len(samples))
+                samples = samples[dropped:]
+                skip -= dropped
+                data = data[2 * dropped:]
+                usable -= 2 * dropped
+            # 自分の区間に収まる分はバッファに直接書き、次の区間に食い込む分は捨てる (最後の区間だけは末尾に足す)
+            fit = max(0, min(len(samples), limits[i] - position))
+            buffer[position:position + fit] = samples[:fit].astype(np.float32) / 32768.0
+            position += fit
+            if fit < len(samples) and i == len(ranges) - 1:
+                overflow.extend(data[2 * fit:usable])
+        process.wait()
+        progress_thread.join()
+        if process.returncode != 0:
+            stderr_text = "\n".join(errors)
+            print(f"ffmpeg stderr: {stderr_text}")
+            raise RuntimeError(f"ffmpeg decoding failed with code {process.returncode}")
+        written[i] = position - offsets[i]
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        for future in [executor.submit(decode_range, i) for i in range(len(ranges))]:
+            future.result()
+
+    # 実際の長さは、出力のあった最後の区間の終わり (ffprobe の長さが実際より長くても余分な無音を付けない)
+    end = max((offsets[i] + written[i] for i in range(len(ranges)) if written[i]), default=0)
+    if not overflow:
+        return buffer[:end]
+    if not end:
+        # 全体を別に受け取った場合は、連結せずにそのまま変換する (bytearray はコピーせずに読める)
+        return pcm16_to_float32(overflow)
+    return np.concatenate([buffer[:end], pcm16_to_float32(overflow)])
+
+
+class AudioBuffer:
+    """
+    音声ファイルを最初に必要になった時点で一度だけデコードし、
+    Whisper と Resemblyzer の両方で同じ配列を共有するためのホルダー。
+    キャッシュで全ステージが賄える場合はデコード自体が行われない。
+    workers が 2 以上なら、長さを ffprobe で調べて decode_audio_parallel で区間ごとに並列にデコードする。
+    """
+
+    def __init__(self, path, samples=None, workers=DEFAULT_DECODE_WORKERS):
+        self.path = path
+        self._samples = samples
+        self.workers = workers
+        # 複数スレッドから同時に参照されても一度しかデコードしないようにする
+        self._lock = threading.Lock()
+
+    @property
+    def samples(self):
+        with self._lock:
+            if self._samples is None:
+                print(f"Decoding {self.path} to 16kHz mono in memory...")
+                with instrumentation.stage("decode"):
+                    if self.workers > 1:
+                        self._samples = decode_audio_parallel(self.path, probe_duration(self.path), workers=self.workers)
+                    else:
+                        self._samples = decode_audio(self.path)
+                instrumentation.set_audio_duration(len(self._samples) / SAMPLE_RATE)
+                print(f"Decoded {len(self._samples) / SAMPLE_RATE:.2f}s of audio.")
+        return self._samples
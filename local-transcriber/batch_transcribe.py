@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio_io import ffmpeg_available
+from vad import DEFAULT_PAD_SEC
+from model_manager import set_torch_threads, add_whisper_arguments, DEFAULT_WHISPER_MODEL, DEFAULT_COMPUTE_TYPE
+from speaker_embedding import DEFAULT_EMBEDDING_BATCH_SIZE
+from result_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_MB
+from clustering import add_clustering_arguments, clustering_options_from_args
+from speaker_registry import DEFAULT_REGISTRY_DIR, DEFAULT_MATCH_THRESHOLD
+from checkpoint import default_checkpoint_dir, DEFAULT_CHECKPOINT_EVERY
+from instrumentation import default_metrics_path
+from transcript_writers import parse_formats, OUTPUT_FORMATS, DEFAULT_FORMATS
+from speaker_turns import DEFAULT_MIN_TURN_SEC, DEFAULT_TURN_SMOOTHING
+from summarize import add_summary_arguments, summary_options_from_args
+
+
+def find_audio_files(input_path):
+    """ディレクトリなら直下の *.mp3 を、それ以外はglobパターンとして一致するファイルを返す"""
+    if os.path.isdir(input_path):
+        pattern = os.path.join(input_path, "*.mp3")
+    else:
+        pattern = input_path
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+def batch_output_paths(audio_files, use_openai=False, out_dir="out"):
+    """
+    各ファイルの出力先を返す。入力ファイルに共通するディレクトリからの相対パスを out_dir の下に再現するので、
+    'recordings/**/*.mp3' のように別のディレクトリにある同じ名前のファイルでも出力先 (とチェックポイント・計測結果) が重ならない。
+    """
+    from transcription import default_output_path
+
+    common_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in audio_files])
+    return [
+        default_output_path(path, use_openai=use_openai,
+                            out_dir=os.path.normpath(os.path.join(out_dir, os.path.relpath(os.path.dirname(os.path.abspath(path)), common_dir))))
+        for path in audio_files
+    ]
+
+
+def find_duplicate_outputs(audio_files, output_files):
+    """出力先が同じになる入力ファイルの組 ({出力先: [入力ファイル, ...]}) を返す (拡張子だけが違うファイルなど)"""
+    inputs_by_output = {}
+    for audio_file, output_file in zip(audio_files, output_files):
+        inputs_by_output.setdefault(os.path.normcase(os.path.abspath(output_file)), []).append(audio_file)
+    return {output: inputs for output, inputs in inputs_by_output.items() if len(inputs) > 1}
+
+
+def init_worker(use_openai, torch_threads, no_cache, cache_dir, cache_max_mb, registry_dir=None,
+                match_threshold=DEFAULT_MATCH_THRESHOLD, whisper_model_name=DEFAULT_WHISPER_MODEL,
+                compute_type=DEFAULT_COMPUTE_TYPE):
+    """
+    ワーカープロセスの初期化。モデルはここで一度だけ読み込み、以降のジョブで使い回す。
+    """
+    import transcription
+
+    # ワーカー数 × スレッド数がコア数を超えないようにして、コア数に対してほぼ線形にスケールさせる
+    set_torch_threads(torch_threads)
+    transcription.whisper_model_name = whisper_model_name
+    transcription.whisper_compute_type = compute_type
+    if not no_cache:
+        transcription.result_cache = transcription.ResultCache(cache_dir=cache_dir, max_mb=cache_max_mb)
+    if registry_dir:
+        transcription.speaker_registry = transcription.SpeakerRegistry(registry_dir)
+        transcription.match_threshold = match_threshold
+    transcription.initialize_local_models(require_whisper=not use_openai, require_encoder=True)
+
+
+def run_job(mp3_file, output_file, options):
+    """1ファイル分のジョブを実行し、マニフェスト用の状態を返す"""
+    import transcription
+
+    started = time.time()
+    options = dict(options)
+    if options.pop('checkpoint', False):
+        # チェックポイントは出力ファイルごとに別のディレクトリに保存する
+        options['checkpoint_dir'] = default_checkpoint_dir(output_file)
+    if options.pop('metrics', False):
+        options['metrics_file'] = default_metrics_path(output_file)
+    try:
+        status = transcription.process_audio_file(mp3_file, output_file, **options)
+    except Exception as e:
+        status = {'status': 'error', 'message': str(e)}
+    status.update({
+        'audio_file': mp3_file,
+        'output_file': output_file,
+        'elapsed_sec': round(time.time() - started, 3),
+        'worker_pid': os.getpid(),
+    })
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe every recording in a directory (or matching a glob) with a pool of worker processes.")
+    parser.add_argument("input", help="Directory containing MP3 files, or a glob pattern such as 'recordings/**/*.mp3'.")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="Number of worker processes. Each worker loads its own models (default: 1).")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads per worker (default: CPU count / workers).")
+    parser.add_argument("--out-dir", default="out", help="Directory for transcripts and the manifest (default: ./out).")
+    parser.add_argument("--manifest", default=None, help="Path of the per-file status manifest (JSON Lines). Defaults to '[out-dir]/batch_manifest.jsonl'.")
+    parser.add_argument("--skip-existing", action="store_true", help="Skip files whose transcript already exists in the output directory.")
+    parser.add_argument("--use-openai", action="store_true", help="Use OpenAI API for transcription, then local diarization.")
+    parser.add_argument("--openai-chunked", action="store_true", help="With --use-openai, split each file at silences and upload the chunks concurrently.")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help=f"Comma-separated output formats written for each file: {', '.join(OUTPUT_FORMATS)} (default: {','.join(DEFAULT_FORMATS)}).")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming windowed pipeline for each file (local Whisper only).")
+    parser.add_argument("--speaker-turns", action="store_true", help="Detect speaker changes on a whole-audio sliding-window embedding timeline and split segments that span a speaker turn (not supported with --stream).")
+    parser.add_argument("--min-turn-sec", type=float, default=DEFAULT_MIN_TURN_SEC, help=f"Shortest speaker turn kept inside a segment for --speaker-turns (default: {DEFAULT_MIN_TURN_SEC}).")
+    parser.add_argument("--turn-smoothing", type=int, default=DEFAULT_TURN_SMOOTHING, help=f"Number of windows in the majority vote over window labels for --speaker-turns (default: {DEFAULT_TURN_SMOOTHING}).")
+    parser.add_argument("--embedding-batch-size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE, help=f"Number of partial-utterance windows per VoiceEncoder forward pass (default: {DEFAULT_EMBEDDING_BATCH_SIZE}).")
+    add_whisper_arguments(parser)
+    parser.add_argument("--vad", action="store_true", help="Send only the speech regions found by a lightweight energy/spectral VAD to local Whisper.")
+    parser.add_argument("--vad-pad-sec", type=float, default=DEFAULT_PAD_SEC, help=f"Padding added before and after each speech region for --vad (default: {DEFAULT_PAD_SEC}).")
+    add_clustering_arguments(parser)
+    parser.add_argument("--speaker-registry", nargs="?", const=DEFAULT_REGISTRY_DIR, default=None, help=f"Name clusters that match enrolled speakers instead of writing Speaker_N (default registry: {DEFAULT_REGISTRY_DIR}).")
+    parser.add_argument("--match-threshold", type=float, default=DEFAULT_MATCH_THRESHOLD, help=f"Minimum cosine similarity for --speaker-registry matches (default: {DEFAULT_MATCH_THRESHOLD}).")
+    add_summary_arguments(parser)
+    parser.add_argument("--no-metrics", action="store_true", help="Do not write the per-stage metrics JSON ('[transcript].metrics.json') next to each transcript. The manifest still records wall time, CPU time, peak RSS and RTF per file.")
+    parser.add_argument("--resume", action="store_true", help="Resume interrupted files from their checkpoints ('[transcript].checkpoint' in the output directory).")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY, help=f"Save a checkpoint after this many segments during speaker embedding (default: {DEFAULT_CHECKPOINT_EVERY}).")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not write checkpoints.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the on-disk result cache.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"Directory of the result cache (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum size of the result cache in MB (default: {DEFAULT_CACHE_MAX_MB}).")
+    args = parser.parse_args()
+
+    if args.stream and args.use_openai:
+        print("Error: --stream is only supported with local Whisper transcription.")
+        sys.exit(1)
+    if args.stream and args.speaker_turns:
+        print("Error: --speaker-turns is not supported with --stream.")
+        sys.exit(1)
+    if args.workers < 1:
+        print("Error: --workers must be >= 1.")
+        sys.exit(1)
+    try:
+        formats = parse_formats(args.formats)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not ffmpeg_available():
+        print("Error: ffmpeg is required but not found. Please install ffmpeg and ensure it's in your system's PATH.")
+        sys.exit(1)
+
+    audio_files = find_audio_files(args.input)
+    if not audio_files:
+        print(f"Error: no audio files found for {args.input}.")
+        sys.exit(1)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.out_dir, "batch_manifest.jsonl")
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    # 出力先を決めて、既存の結果があればスキップする。同じ出力先になるファイルがあれば互いに上書きしてしまうので始める前に止める
+    output_files = batch_output_paths(audio_files, use_openai=args.use_openai, out_dir=args.out_dir)
+    duplicates = find_duplicate_outputs(audio_files, output_files)
+    if duplicates:
+        for output_file, inputs in duplicates.items():
+            print(f"Error: {', '.join(inputs)} would be written to the same transcript {output_file}.")
+        print("Rename or move these files, or process them in separate runs with different --out-dir.")
+        sys.exit(1)
+    jobs = []
+    for mp3_file, output_file in zip(audio_files, output_files):
+        if args.skip_existing and os.path.exists(output_file):
+            print(f"Skipping {mp3_file}: {output_file} already exists.")
+            continue
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        jobs.append((mp3_file, output_file))
+
+    options = {
+        'use_openai': args.use_openai,
+        'openai_chunked': args.openai_chunked,
+        'stream': args.stream,
+        'embedding_batch_size': args.embedding_batch_size,
+        'clustering_options': clustering_options_from_args(args),
+        'vad_options': {'pad_sec': args.vad_pad_sec} if args.vad else None,
+        'checkpoint': not args.no_checkpoint,
+        'metrics': not args.no_metrics,
+        'resume': args.resume,
+        'checkpoint_every': args.checkpoint_every,
+        'formats': formats,
+        'turn_options': {'min_turn_sec': args.min_turn_sec, 'smoothing': args.turn_smoothing} if args.speaker_turns else None,
+        'summary_options': summary_options_from_args(args),
+    }
+    print(f"Transcribing {len(jobs)} files with {args.workers} workers ({torch_threads} torch threads each)...")
+
+    started = time.time()
+    counts = {}
+    # torchを読み込んだプロセスをforkすると不安定になるため spawn を使う
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(args.use_openai, torch_threads, args.no_cache, args.cache_dir, args.cache_max_mb,
+                  args.speaker_registry, args.match_threshold, args.whisper_model, args.compute_type),
+    ) as executor, open(manifest_path, "a", encoding="utf8") as manifest:
+        futures = {executor.submit(run_job, mp3_file, output_file, options): mp3_file for mp3_file, output_file in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            mp3_file = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                # ワーカープロセス自体が落ちた場合など
+                status = {'status': 'error', 'message': str(e), 'audio_file': mp3_file}
+            counts[status['status']] = counts.get(status['status'], 0) + 1
+            # 途中で止まっても完了分が残るよう、1件ごとに追記してflushする
+            manifest.write(json.dumps(status, ensure_ascii=False) + "\n")
+            manifest.flush()
+            print(f"[{done}/{len(jobs)}] {status['status']}: {mp3_file} ({status.get('elapsed_sec', 0):.1f}s)")
+
+    summary = ", ".join(f"{key}={value}" for key, value in sorted(counts.items()))
+    print(f"Batch finished in {time.time() - started:.1f}s ({summary}). Manifest: {manifest_path}")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from clustering import cluster_embeddings, CLUSTERING_METHODS
+
+
+def make_synthetic_embeddings(n_points, n_speakers, noise=0.03, dim=256, seed=0):
+    """
+    Resemblyzer風の合成埋め込み (L2正規化済み、非負) を作る。
+    話者ごとの中心ベクトルにノイズを加えて正規化する。戻り値: (埋め込み, 正解ラベル)
+    """
+    rng = np.random.default_rng(seed)
+    centers = np.abs(rng.normal(size=(n_speakers, dim)))
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = rng.integers(0, n_speakers, size=n_points)
+    points = centers[labels] + rng.normal(scale=noise, size=(n_points, dim))
+    points = np.maximum(points, 0.0) # ReLU出力と同様に非負にする
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return points.astype(np.float32), labels
+
+
+def run_benchmark(sizes, methods, n_speakers, max_dbscan_points, seed=0):
+    """各点数・各手法について実行時間、ピークメモリ (tracemalloc)、正解とのARIを測る"""
+    results = []
+    for n_points in sizes:
+        embeddings, truth = make_synthetic_embeddings(n_points, n_speakers, seed=seed)
+        for method in methods:
+            if method == "dbscan" and n_points > max_dbscan_points:
+                print(f"{method:>13} n={n_points:>6}: skipped (> --max-dbscan-points)")
+                continue
+            tracemalloc.start()
+            started = time.perf_counter()
+            labels = cluster_embeddings(embeddings, method=method)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result = {
+                'method': method,
+                'n_points': n_points,
+                'seconds': round(elapsed, 4),
+                'peak_mb': round(peak / (1024 * 1024), 2),
+                'n_clusters': int(len(set(labels.tolist()) - {-1})),
+                'ari': round(float(adjusted_rand_score(truth, labels)), 4),
+            }
+            results.append(result)
+            print(f"{method:>13} n={n_points:>6}: {result['seconds']:8.3f}s  peak {result['peak_mb']:8.1f} MB  "
+                  f"clusters {result['n_clusters']:>4}  ARI {result['ari']:.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark speaker clustering backends on synthetic Resemblyzer-like embeddings.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000, 20000, 40000], help="Numbers of segments to benchmark.")
+    parser.add_argument("--methods", nargs="+", default=list(CLUSTERING_METHODS), choices=CLUSTERING_METHODS, help="Clustering methods to compare.")
+    parser.add_argument("--speakers", type=int, default=6, help="Number of synthetic speakers (default: 6).")
+    parser.add_argument("--max-dbscan-points", type=int, default=20000, help="Skip DBSCAN above this many points to avoid exhausting memory (default: 20000).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0).")
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.methods, args.speakers, args.max_dbscan_points, seed=args.seed)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.json}")
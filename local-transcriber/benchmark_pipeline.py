@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from audio_io import decode_audio, ffmpeg_available, SAMPLE_RATE
+from benchmark_clustering import make_synthetic_embeddings
+from clustering import CLUSTERING_METHODS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# transcription.py (通常 / --stream) と transcription_progess.py のパイプライン
+PIPELINES = ("local", "stream", "progess")
+# ベースラインと比べる指標: {名前: (良い方向, 相対しきい値に加えて無視する絶対差)}
+COMPARED_METRICS = {
+    'wall_sec': ("lower", 0.05),
+    'peak_rss_mb': ("lower", 20.0),
+    'peak_mb': ("lower", 5.0),
+    'ari': ("higher", 0.02),
+}
+DEFAULT_THRESHOLD = 0.15
+
+
+def environment_info(torch_threads=None):
+    """ベンチマーク結果と一緒に保存する実行環境 (ライブラリのバージョン、CPU数など)"""
+    from importlib import metadata
+    versions = {}
+    for package in ("numpy", "scipy", "scikit-learn", "torch", "openai-whisper", "resemblyzer"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch_threads,
+        'packages': versions,
+    }
+
+
+def make_synthetic_long_audio(audio_files, duration_sec, path, seed=0):
+    """
+    同梱の録音をシードで決まる順番に並べて繰り返し、duration_sec 秒の長い音声 (16kHz モノラル WAV) を作る。
+    実際の話し声なので、無音や話者の切り替わりを含んだ長時間録音の代わりになる。
+    """
+    rng = np.random.default_rng(seed)
+    clips = [decode_audio(audio_file) for audio_file in audio_files]
+    total = int(duration_sec * SAMPLE_RATE)
+    pieces = []
+    filled = 0
+    while filled < total:
+        for index in rng.permutation(len(clips)):
+            piece = clips[index][:total - filled]
+            pieces.append(piece)
+            filled += len(piece)
+            if filled >= total:
+                break
+    samples = np.concatenate(pieces)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+    return path
+
+
+def set_seeds(seed):
+    """乱数のシードを固定する (Whisper の温度フォールバック時のサンプリングも再現できるように torch も固定する)"""
+    random.seed(seed)
+    np.random.seed(seed)
+    import torch
+    torch.manual_seed(seed)
+
+
+def run_pipeline_case(pipeline, audio_path, output_dir, whisper_model_name, compute_type, torch_threads, seed):
+    """
+    1つのパイプラインを1つの音声で実行し、instrumentation のレポートを返す。
+    最大常駐メモリを比べられるよう、ケースごとに新しいプロセスで呼ぶ。モデルの読み込み時間は 'load_sec' として別に測る。
+    """
+    import instrumentation
+    import transcription
+    import transcription_progess
+    from model_manager import set_torch_threads
+
+    set_torch_threads(torch_threads)
+    set_seeds(seed)
+    output_file = os.path.join(output_dir, f"{pipeline}_{os.path.basename(audio_path)}.txt")
+    started = time.perf_counter()
+    transcription.whisper_model_name = transcription_progess.whisper_model_name = whisper_model_name
+    transcription.whisper_compute_type = transcription_progess.whisper_compute_type = compute_type
+    transcription.initialize_local_models(require_whisper=True, require_encoder=True)
+    load_sec = time.perf_counter() - started
+
+    profiler = instrumentation.PipelineProfiler(audio_path)
+    with instrumentation.profiling(profiler):
+        if pipeline == "progess":
+            with instrumentation.stage("decode"):
+                audio = transcription_progess.decode_mp3_with_progress(audio_path)
+            instrumentation.set_audio_duration(len(audio) / SAMPLE_RATE)
+            transcription_progess.transcribe_with_speaker_diarization(audio, output_path=output_file)
+        else:
+            status = transcription.run_pipeline(audio_path, output_file, stream=(pipeline == "stream"))
+            if status['status'] != 'ok':
+                raise RuntimeError(f"{pipeline} pipeline failed on {audio_path}: {status['message']}")
+    profiler.finish()
+    report = profiler.report()
+    report['load_sec'] = round(load_sec, 3)
+    return report
+
+
+def _median(values):
+    values = [value for value in values if value is not None]
+    return round(float(np.median(values)), 4) if values else None
+
+
+def run_pipeline_benchmarks(audio_files, pipelines, whisper_model_name, compute_type, torch_threads, repeat=1, seed=0):
+    """各パイプライン × 各音声を repeat 回実行し、ステージごとの値の中央値を結果の一覧で返す"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for pipeline in pipelines:
+            for audio_path in audio_files:
+                reports = []
+                for _ in range(repeat):
+                    # torchを読み込んだプロセスをforkすると不安定になるため spawn を使う
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        reports.append(executor.submit(
+                            run_pipeline_case, pipeline, audio_path, output_dir,
+                            whisper_model_name, compute_type, torch_threads, seed
+                        ).result())
+                prefix = f"pipeline/{pipeline}/{os.path.basename(audio_path)}"
+                audio_sec = reports[0]['audio_sec']
+                results.append({
+                    'name': f"{prefix}/load", 'audio_sec': audio_sec,
+                    'wall_sec': _median([report['load_sec'] for report in reports]),
+                })
+                stage_names = [stats['stage'] for stats in reports[0]['stages']]
+                for stage_name in stage_names:
+                    runs = [next(s for s in report['stages'] if s['stage'] == stage_name) for report in reports]
+                    result = {'name': f"{prefix}/{stage_name}", 'audio_sec': audio_sec}
+                    for key in ('wall_sec', 'cpu_sec', 'peak_rss_mb', 'rtf', 'segments', 'segments_per_sec'):
+                        result[key] = _median([run[key] for run in runs])
+                    results.append(result)
+                totals = [report['total'] for report in reports]
+                total = {'name': f"{prefix}/total", 'audio_sec': audio_sec}
+                for key in ('wall_sec', 'cpu_sec', 'peak_rss_mb', 'rtf'):
+                    total[key] = _median([run[key] for run in totals])
+                results.append(total)
+                print(f"{prefix}: {total['wall_sec']:.2f}s for {audio_sec}s of audio (RTF {total['rtf']}), "
+                      f"peak RSS {total['peak_rss_mb']} MB")
+    return results
+
+
+def _measure(func, repeat):
+    """
+    func を repeat 回実行した時間の中央値と、別に1回 tracemalloc 付きで実行したときのピークメモリと戻り値を返す。
+    tracemalloc は実行を大きく遅くするので、時間の計測とは分けている。
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        value = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(float(np.median(timings)), 4), round(peak / (1024 * 1024), 2), value
+
+
+def run_micro_benchmarks(sizes, methods, n_speakers, repeat=3, seed=0):
+    """
+    合成埋め込みでクラスタリングと話者分離の後段 (ウィンドウ埋め込みの割り当て、ラベル付け・整形、登録話者の照合) を測る。
+    モデルを使わないので、sklearn / scipy / numpy の更新による差を切り分けられる。
+    """
+    from sklearn.metrics import adjusted_rand_score
+    import transcription
+    from clustering import cluster_embeddings
+    from speaker_embedding import pool_window_embeddings
+    from speaker_registry import SpeakerRegistry
+    from segment_table import SegmentTable
+    from transcript_writers import (TextTranscriptWriter, SrtTranscriptWriter, VttTranscriptWriter, JsonTranscriptWriter,
+                                    JsonlTranscriptWriter, write_segments)
+
+    results = []
+    for n_points in sizes:
+        embeddings, truth = make_synthetic_embeddings(n_points, n_speakers, seed=seed)
+        for method in methods:
+            seconds, peak_mb, labels = _measure(lambda: cluster_embeddings(embeddings, method=method), repeat)
+            results.append({
+                'name': f"micro/cluster/{method}/{n_points}", 'wall_sec': seconds, 'peak_mb': peak_mb,
+                'segments_per_sec': round(n_points / max(seconds, 1e-9), 1),
+                'ari': round(float(adjusted_rand_score(truth, labels)), 4),
+            })
+
+        # 2秒ごとのセグメントと、その上を0.5秒ずつずれる1.6秒のウィンドウ埋め込みを割り当てる
+        spans = [(i * 2.0, i * 2.0 + 2.0) for i in range(n_points)]
+        window_starts = np.arange(0.0, n_points * 2.0 - 1.6, 0.5)
+        window_segments = np.minimum((window_starts + 0.8) // 2.0, n_points - 1).astype(int)
+        windows = {
+            'embeddings': embeddings[window_segments],
+            'starts': window_starts,
+            'ends': window_starts + 1.6,
+        }
+        seconds, peak_mb, _ = _measure(lambda: pool_window_embeddings(windows, spans), repeat)
+        results.append({
+            'name': f"micro/pool_windows/{n_points}", 'wall_sec': seconds, 'peak_mb': peak_mb,
+            'segments_per_sec': round(n_points / max(seconds, 1e-9), 1),
+        })
+
+        segments = SegmentTable(
+            [start for start, _ in spans], [end for _, end in spans], [f"segment {i}" for i in range(n_points)]
+        )
+        def label_and_write():
+            # ラベル付けと、全形式への書き出し (出力は /dev/null に1件ずつ捨てる)
+            labeled = transcription.label_speakers(segments, embeddings)
+            with open(os.devnull, "w", encoding="utf8") as devnull:
+                writers = [TextTranscriptWriter(devnull), SrtTranscriptWriter(devnull), VttTranscriptWriter(devnull),
+                           JsonTranscriptWriter(devnull), JsonlTranscriptWriter(devnull)]
+                for writer in writers:
+                    write_segments(writer, labeled)
+                    writer.close()
+
+        seconds, peak_mb, _ = _measure(label_and_write, repeat)
+        results.append({
+            'name': f"micro/diarize_format/{n_points}", 'wall_sec': seconds, 'peak_mb': peak_mb,
+            'segments_per_sec': round(n_points / max(seconds, 1e-9), 1),
+        })
+        # キャッシュ・チェックポイントと同じ npz 用の配列への変換と復元
+        seconds, peak_mb, _ = _measure(lambda: SegmentTable.from_arrays(segments.to_arrays()), repeat)
+        results.append({
+            'name': f"micro/segment_table_roundtrip/{n_points}", 'wall_sec': seconds, 'peak_mb': peak_mb,
+            'segments_per_sec': round(n_points / max(seconds, 1e-9), 1),
+        })
+
+    with tempfile.TemporaryDirectory() as registry_dir:
+        registry = SpeakerRegistry(registry_dir)
+        enrolled, _ = make_synthetic_embeddings(5000, 500, seed=seed)
+        registry.enroll("speaker", enrolled)
+        centroids, _ = make_synthetic_embeddings(n_speakers, n_speakers, seed=seed + 1)
+        seconds, peak_mb, _ = _measure(lambda: registry.identify(centroids), repeat)
+        results.append({'name': f"micro/registry_identify/5000x{n_speakers}", 'wall_sec': seconds, 'peak_mb': peak_mb})
+
+    for result in results:
+        print(f"{result['name']:>40}: {result['wall_sec']:8.4f}s  peak {result['peak_mb']:8.2f} MB"
+              + (f"  ARI {result['ari']:.3f}" if 'ari' in result else ""))
+    return results
+
+
+def compare_with_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    同じ名前の結果をベースラインと比べ、threshold (相対) を超えて悪化した指標を返す。
+    時間やメモリのように小さい値の揺れで誤検出しないよう、指標ごとの絶対差より小さい変化は無視する。
+    戻り値: [{'name', 'metric', 'baseline', 'current', 'change'}, ...]
+    """
+    baseline_results = {result['name']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        previous = baseline_results.get(result['name'])
+        if previous is None:
+            continue
+        for metric, (direction, min_delta) in COMPARED_METRICS.items():
+            current_value, baseline_value = result.get(metric), previous.get(metric)
+            if current_value is None or baseline_value is None:
+                continue
+            delta = current_value - baseline_value if direction == "lower" else baseline_value - current_value
+            change = delta / baseline_value if baseline_value else 0.0
+            if delta > min_delta and (metric == 'ari' or change > threshold):
+                regressions.append({
+                    'name': result['name'], 'metric': metric,
+                    'baseline': baseline_value, 'current': current_value, 'change': round(change, 4),
+                })
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible benchmark of the transcription pipelines and the diarization/clustering back end, with a JSON baseline and a regression check.")
+    parser.add_argument("--audio-files", nargs="+", default=sorted(glob.glob(os.path.join(DATA_DIR, "*.mp3"))), help="Recordings for the pipeline benchmarks (default: the bundled data/*.mp3).")
+    parser.add_argument("--synthetic-minutes", type=float, nargs="*", default=[10.0], help="Lengths in minutes of synthetic long recordings built by tiling the audio files in a seeded order (default: 10). Pass no value to skip.")
+    parser.add_argument("--pipelines", nargs="*", choices=PIPELINES, default=list(PIPELINES), help="Pipelines to benchmark: transcription.py ('local'), transcription.py --stream ('stream') and transcription_progess.py ('progess'). Pass no value to run only the micro-benchmarks.")
+    parser.add_argument("--pipeline-repeat", type=int, default=1, help="Runs per pipeline and recording; the median is reported (default: 1).")
+    parser.add_argument("--whisper-model", default="tiny", help="Whisper model used for the pipeline benchmarks (default: tiny). A path to a checkpoint file also works.")
+    parser.add_argument("--compute-type", default="float32", help="Compute type of the Whisper model (default: float32).")
+    parser.add_argument("--torch-threads", type=int, default=1, help="Torch intra-op threads; fixed by default so results are comparable across machines (default: 1).")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000], help="Numbers of synthetic segments for the micro-benchmarks (default: 1000 10000).")
+    parser.add_argument("--methods", nargs="+", choices=CLUSTERING_METHODS, default=list(CLUSTERING_METHODS), help="Clustering methods for the micro-benchmarks.")
+    parser.add_argument("--speakers", type=int, default=6, help="Number of synthetic speakers (default: 6).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per micro-benchmark; the median time is reported (default: 3).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for synthetic data, clustering and Whisper sampling (default: 0).")
+    parser.add_argument("--json", default=os.path.join("out", "benchmark.json"), help="Where to write the results (default: out/benchmark.json).")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON written by an earlier run. Exits with status 1 if a metric regressed by more than --threshold.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Relative slowdown (or memory growth) that counts as a regression (default: {DEFAULT_THRESHOLD}). ARI drops are checked in absolute terms.")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite --baseline with the results of this run instead of comparing.")
+    args = parser.parse_args()
+
+    if args.pipelines and not ffmpeg_available():
+        print("Error: ffmpeg is required for the pipeline benchmarks but not found.")
+        sys.exit(1)
+    for path in args.audio_files:
+        if not os.path.exists(path):
+            print(f"Error: {path} not found.")
+            sys.exit(1)
+    if args.update_baseline and not args.baseline:
+        print("Error: --update-baseline requires --baseline.")
+        sys.exit(1)
+    # ベースラインは実行するマシンで作るもの (他の環境の値とは比べられない) なのでリポジトリには含めない。
+    # 無いまま比較しようとした場合は、ベンチマークを実行する前に作り方を示して止める
+    if args.baseline and not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"Error: baseline {args.baseline} not found. Create it on this machine first (before the change you want to measure):")
+        print(f"  python {os.path.relpath(__file__)} --baseline {args.baseline} --update-baseline")
+        sys.exit(1)
+
+    results = []
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        if args.pipelines:
+            audio_files = list(args.audio_files)
+            for minutes in args.synthetic_minutes:
+                path = os.path.join(synthetic_dir, f"synthetic_{minutes:g}min.wav")
+                print(f"Building {minutes:g} minutes of synthetic audio from {len(args.audio_files)} recordings...")
+                audio_files.append(make_synthetic_long_audio(args.audio_files, minutes * 60, path, seed=args.seed))
+            results += run_pipeline_benchmarks(
+                audio_files, args.pipelines, args.whisper_model, args.compute_type, args.torch_threads,
+                repeat=args.pipeline_repeat, seed=args.seed
+            )
+    results += run_micro_benchmarks(args.sizes, args.methods, args.speakers, repeat=args.repeat, seed=args.seed)
+
+    report = {
+        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': environment_info(args.torch_threads),
+        'config': {
+            'whisper_model': args.whisper_model, 'compute_type': args.compute_type, 'seed': args.seed,
+            'synthetic_minutes': args.synthetic_minutes, 'sizes': args.sizes, 'speakers': args.speakers,
+        },
+        'results': results,
+    }
+    if os.path.dirname(args.json):
+        os.makedirs(os.path.dirname(args.json), exist_ok=True)
+    with open(args.json, "w", encoding="utf8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {args.json}")
+
+    if not args.baseline:
+        print("No baseline given, so nothing was compared. Save these results as a baseline with --baseline PATH --update-baseline, "
+              "then pass --baseline PATH after a change to check it for regressions.")
+    elif args.update_baseline:
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf8") as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('packages') != report['environment']['packages']:
+            print("Note: package versions differ from the baseline.")
+        if baseline.get('config') != report['config']:
+            print("Warning: benchmark options differ from the baseline; results may not be comparable.")
+        regressions = compare_with_baseline(results, baseline, threshold=args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change'] * 100:+.1f}%)")
+        if regressions:
+            print(f"{len(regressions)} regressions over the {args.threshold * 100:.0f}% threshold.")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (threshold {args.threshold * 100:.0f}%).")
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+import time
+import unicodedata
+
+import numpy as np
+
+from audio_io import decode_audio, ffmpeg_available, SAMPLE_RATE
+from model_manager import get_whisper_model, set_torch_threads, COMPUTE_TYPES
+
+DEFAULT_AUDIO_FILES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "Interview.mp3"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample.mp3"),
+]
+DEFAULT_CONFIGS = ["large:float32", "medium:int8", "small:float32", "small:int8", "base:int8"]
+
+
+def edit_distance(reference, hypothesis):
+    """2つの系列の編集距離 (置換・挿入・削除) を1行ずつベクトル化して求める"""
+    reference = list(reference)
+    hypothesis = list(hypothesis)
+    if not reference:
+        return len(hypothesis)
+    if not hypothesis:
+        return len(reference)
+    vocabulary = {token: i for i, token in enumerate(set(reference) | set(hypothesis))}
+    hyp_ids = np.array([vocabulary[token] for token in hypothesis])
+    offsets = np.arange(len(hypothesis) + 1)
+    previous = offsets.copy()
+    for i, token in enumerate(reference, start=1):
+        cost = (hyp_ids != vocabulary[token]).astype(np.int64)
+        current = np.empty_like(previous)
+        current[0] = i
+        current[1:] = np.minimum(previous[1:] + 1, previous[:-1] + cost)
+        # 挿入 (左隣 + 1) の連鎖は「値 - 位置」の累積最小値で一度に求まる
+        current = np.minimum.accumulate(current - offsets) + offsets
+        previous = current
+    return int(previous[-1])
+
+
+def normalize_text(text):
+    """比較用に全角/半角をそろえ、句読点を除いて小文字にする"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if not unicodedata.category(ch).startswith("P"))
+
+
+def error_rates(reference, hypothesis):
+    """WER (空白区切りの単語単位) と CER (空白を除いた文字単位) を返す。日本語は CER の方が意味を持つ"""
+    reference = normalize_text(reference)
+    hypothesis = normalize_text(hypothesis)
+    ref_words, hyp_words = reference.split(), hypothesis.split()
+    ref_chars, hyp_chars = "".join(ref_words), "".join(hyp_words)
+    wer = edit_distance(ref_words, hyp_words) / max(len(ref_words), 1)
+    cer = edit_distance(ref_chars, hyp_chars) / max(len(ref_chars), 1)
+    return wer, cer
+
+
+def run_benchmark(audio_files, configs, torch_threads=None, reference_dir=None):
+    """
+    各 "モデル:計算精度" の組み合わせで各音声を文字起こしし、処理時間・RTF・誤り率を測る。
+    誤り率の基準は reference_dir/[音声ファイル名].txt があればそれ、無ければ最初の組み合わせの出力とする。
+    """
+    threads = set_torch_threads(torch_threads)
+    print(f"Using {threads} torch threads.")
+    audios = {path: decode_audio(path) for path in audio_files}
+    references = {}
+    if reference_dir:
+        for path in audio_files:
+            ref_path = os.path.join(reference_dir, os.path.splitext(os.path.basename(path))[0] + ".txt")
+            with open(ref_path, "r", encoding="utf8") as f:
+                references[path] = f.read()
+
+    results = []
+    baseline_seconds = {}
+    for config in configs:
+        model_name, _, compute_type = config.partition(":")
+        compute_type = compute_type or "float32"
+        started = time.perf_counter()
+        model = get_whisper_model(model_name, compute_type=compute_type)
+        load_sec = time.perf_counter() - started
+        for path, samples in audios.items():
+            audio_sec = len(samples) / SAMPLE_RATE
+            started = time.perf_counter()
+            # 比較のため温度は0に固定する (再試行による揺れを無くす)
+            text = model.transcribe(samples, temperature=0.0)["text"]
+            elapsed = time.perf_counter() - started
+            baseline_seconds.setdefault(path, elapsed)
+            if path not in references:
+                references[path] = text
+            wer, cer = error_rates(references[path], text)
+            result = {
+                'config': f"{model_name}:{compute_type}",
+                'audio_file': os.path.basename(path),
+                'audio_sec': round(audio_sec, 2),
+                'load_sec': round(load_sec, 2),
+                'seconds': round(elapsed, 2),
+                'rtf': round(elapsed / audio_sec, 4),
+                'speedup': round(baseline_seconds[path] / elapsed, 2),
+                'wer': round(wer, 4),
+                'cer': round(cer, 4),
+                'text': text,
+            }
+            results.append(result)
+            print(f"{result['config']:>16} {result['audio_file']:>16}: {elapsed:7.1f}s  RTF {result['rtf']:.3f}  "
+                  f"x{result['speedup']:.2f}  WER {wer:.3f}  CER {cer:.3f}")
+    return results
+
+
+def format_markdown_table(results):
+    """結果を README にそのまま貼れる Markdown の表にする"""
+    lines = [
+        "| 設定 | 音声 | 音声長 (秒) | 処理時間 (秒) | RTF | 速度比 | WER | CER |",
+        "| --- | --- | ---: | ---: | ---: | ---: | ---: | ---: |",
+    ]
+    for result in results:
+        lines.append(f"| `{result['config']}` | {result['audio_file']} | {result['audio_sec']:.1f} | {result['seconds']:.1f} | "
+                     f"{result['rtf']:.3f} | x{result['speedup']:.2f} | {result['wer']:.3f} | {result['cer']:.3f} |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare speed (RTF) and accuracy (WER/CER) of local Whisper model sizes and compute types.")
+    parser.add_argument("audio_files", nargs="*", default=DEFAULT_AUDIO_FILES, help="Audio files to transcribe (default: the bundled data/Interview.mp3 and data/sample.mp3).")
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS, help=f"'model:compute_type' pairs to compare; the first one is the speed baseline and, without --reference-dir, the accuracy reference (compute types: {', '.join(COMPUTE_TYPES)}; default: {' '.join(DEFAULT_CONFIGS)}).")
+    parser.add_argument("--reference-dir", default=None, help="Directory with a reference transcript '<audio name>.txt' per file. Defaults to the output of the first config.")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Number of torch intra-op threads (default: torch's choice).")
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    parser.add_argument("--markdown", action="store_true", help="Also print the results as a Markdown table for the README.")
+    args = parser.parse_args()
+
+    for path in args.audio_files:
+        if not os.path.exists(path):
+            print(f"Error: {path} not found.")
+            sys.exit(1)
+    if not ffmpeg_available():
+        print("Error: ffmpeg is required but not found.")
+        sys.exit(1)
+
+    results = run_benchmark(args.audio_files, args.configs, torch_threads=args.torch_threads, reference_dir=args.reference_dir)
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.json}")
+    if args.markdown:
+        print()
+        print(format_markdown_table(results))
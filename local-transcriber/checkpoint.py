@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# 埋め込みの計算中に何セグメントごとにチェックポイントを書くか
+DEFAULT_CHECKPOINT_EVERY = 256
+CHECKPOINT_VERSION = 3
+# arrays.npz に保存する、state.json と対応付けるための識別子の名前
+ARRAYS_ID_KEY = "checkpoint_arrays_id"
+
+
+def default_checkpoint_dir(output_file):
+    """出力ファイルに対応するチェックポイントの保存先 ([出力ファイル].checkpoint/) を返す"""
+    return output_file + ".checkpoint"
+
+
+class PipelineCheckpoint:
+    """
+    長時間のジョブが途中で止まっても再開できるよう、パイプラインの途中状態をディスクに保存する。
+
+    state.json: 入力音声のパスとハッシュ、処理パラメータ、完了したステージ、ストリーミングの再開位置など
+    arrays.npz: 文字起こし済みセグメントの表 (SegmentTable.to_arrays) と、それまでに計算した話者埋め込み
+
+    入力音声のハッシュかパラメータが違うチェックポイントは使わない。書き込みは一時ファイル経由で置き換えるので、
+    書き込み途中に止まっても直前のチェックポイントが残る。2つのファイルは別々に置き換えるため、配列を保存するたびに
+    新しい識別子を両方に書き、読み込むときに一致しなければ (片方だけ書き換わった後に止まった場合) 配列は使わない。
+    """
+
+    def __init__(self, directory, audio_path, audio_digest, params):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "state.json")
+        self.arrays_path = os.path.join(directory, "arrays.npz")
+        self.state = {
+            'version': CHECKPOINT_VERSION,
+            'audio_path': os.path.abspath(audio_path),
+            'audio_digest': audio_digest,
+            'params': params,
+        }
+
+    def _write_atomic(self, path, write_func):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_func(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self):
+        """
+        保存済みのチェックポイントを読み込み、この実行で使えるなら state を返す (使えなければ None)。
+        """
+        try:
+            with open(self.state_path, "r", encoding="utf8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            print(f"No usable checkpoint found in {self.directory}; starting from the beginning.")
+            return None
+        if saved.get('version') != CHECKPOINT_VERSION:
+            print(f"Checkpoint in {self.directory} was written by an older version; starting from the beginning.")
+            return None
+        if saved.get('audio_digest') != self.state['audio_digest']:
+            print(f"Checkpoint in {self.directory} belongs to a different audio file; starting from the beginning.")
+            return None
+        if saved.get('params') != json.loads(json.dumps(self.state['params'])):
+            print(f"Checkpoint in {self.directory} was written with different options; starting from the beginning.")
+            return None
+        self.state = saved
+        print(f"Resuming from checkpoint in {self.directory} (stage: {saved.get('stage')}).")
+        return saved
+
+    def save(self, arrays=None, **fields):
+        """state に fields を反映して保存する。arrays があれば埋め込みなどの配列も保存する (配列が先、state.json が後)"""
+        if arrays is not None:
+            arrays_id = os.urandom(8).hex()
+            self._write_atomic(self.arrays_path, lambda f: np.savez(f, **arrays, **{ARRAYS_ID_KEY: np.array(arrays_id)}))
+            self.state['arrays_id'] = arrays_id
+        self.state.update(fields)
+        data = json.dumps(self.state, ensure_ascii=False).encode("utf-8")
+        self._write_atomic(self.state_path, lambda f: f.write(data))
+
+    def load_arrays(self):
+        """保存済みの配列を {名前: 配列} で返す (無いか、state.json と対応していなければ None)"""
+        try:
+            with np.load(self.arrays_path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        arrays_id = arrays.pop(ARRAYS_ID_KEY, None)
+        if arrays_id is None or str(arrays_id) != self.state.get('arrays_id'):
+            print(f"Checkpoint arrays in {self.directory} do not match its state (interrupted while saving); redoing that stage.")
+            return None
+        return arrays
+
+    def clear(self):
+        """ジョブが完了したらチェックポイントを削除する"""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+CLUSTERING_METHODS = ("agglomerative", "spectral", "online", "dbscan")
+DEFAULT_CLUSTERING_METHOD = "agglomerative"
+# Resemblyzerの埋め込み (L2正規化済み) 同士のコサイン距離がこれ未満なら同じ話者とみなす
+DEFAULT_COSINE_THRESHOLD = 0.3
+DEFAULT_EPS = 0.5
+DEFAULT_MIN_SAMPLES = 1
+# これより多い点はミニバッチk-meansで代表点に圧縮してから階層/スペクトラルクラスタリングを行う
+DEFAULT_MAX_POINTS = 500
+MAX_ESTIMATED_SPEAKERS = 20
+# スペクトラルクラスタリングで各点について残す近傍の割合 (親和度行列の枝刈り)
+DEFAULT_PRUNING_RATIO = 0.1
+# これより点が少ないとeigengapによる話者数推定が不安定なので、話者数が未指定なら階層クラスタリングを使う
+MIN_SPECTRAL_POINTS = 30
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _relabel_by_first_appearance(labels):
+    """ラベルを出現順に 0, 1, 2, ... に振り直す (ノイズの -1 はそのまま)"""
+    mapping = {}
+    relabeled = np.empty_like(labels)
+    for i, label in enumerate(labels):
+        if label == -1:
+            relabeled[i] = -1
+            continue
+        if label not in mapping:
+            mapping[label] = len(mapping)
+        relabeled[i] = mapping[label]
+    return relabeled
+
+
+def _compress(embeddings, max_points, random_state=0):
+    """
+    点が多い場合はミニバッチk-meansで max_points 個の代表点 (正規化済みの重心) に圧縮する。
+    戻り値: (代表点, 各点がどの代表点に属するか)
+    """
+    if len(embeddings) <= max_points:
+        return embeddings, np.arange(len(embeddings))
+    from sklearn.cluster import MiniBatchKMeans
+    kmeans = MiniBatchKMeans(n_clusters=max_points, random_state=random_state, batch_size=4096, n_init=1)
+    assignment = kmeans.fit_predict(embeddings)
+    # 空の代表点を除き、メンバーの平均から重心を求め直す
+    used, assignment = np.unique(assignment, return_inverse=True)
+    centroids = np.zeros((len(used), embeddings.shape[1]), dtype=np.float64)
+    np.add.at(centroids, assignment, embeddings)
+    return _normalize(centroids), assignment
+
+
+def prune_affinity(affinity, ratio=DEFAULT_PRUNING_RATIO):
+    """
+    各行で類似度の高い上位 ratio の近傍だけを残して対称化する。
+    話者が違っても埋め込み同士のコサイン類似度はある程度高いため、枝刈りしないとeigengapが1話者に偏る。
+    """
+    n = len(affinity)
+    k = min(n, max(10, int(np.ceil(n * ratio))))
+    neighbors = np.argpartition(-affinity, k - 1, axis=1)[:, :k]
+    rows = np.arange(n)[:, None]
+    pruned = np.zeros_like(affinity)
+    pruned[rows, neighbors] = affinity[rows, neighbors]
+    return (pruned + pruned.T) / 2
+
+
+def estimate_num_speakers(affinity, max_speakers=MAX_ESTIMATED_SPEAKERS):
+    """正規化ラプラシアンの固有値のギャップ (eigengap) から話者数を推定する"""
+    from scipy.linalg import eigh
+    degree = affinity.sum(axis=1)
+    inv_sqrt = 1.0 / np.sqrt(np.maximum(degree, 1e-12))
+    laplacian = np.eye(len(affinity)) - inv_sqrt[:, None] * affinity * inv_sqrt[None, :]
+    n_eigen = min(max_speakers + 1, len(affinity))
+    eigenvalues = eigh(laplacian, eigvals_only=True, subset_by_index=[0, n_eigen - 1])
+    gaps = np.diff(eigenvalues)
+    return int(np.argmax(gaps)) + 1
+
+
+class OnlineClusterer:
+    """
+    逐次 (オンライン) 話者クラスタリング。
+    各埋め込みを既存クラスタの重心とコサイン類似度で比較し、閾値以内なら割り当てて重心を更新、
+    そうでなければ新しいクラスタを作る。ストリーミング処理のようにセグメントが順に届く場合に使う。
+    """
+
+    def __init__(self, threshold=DEFAULT_COSINE_THRESHOLD):
+        self.threshold = threshold
+        self.sums = np.zeros((0, 0))
+        self.centroids = np.zeros((0, 0))
+
+    def partial_fit(self, embeddings):
+        """埋め込みを順に割り当て、ラベルの配列を返す"""
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        if self.sums.size == 0:
+            self.sums = np.zeros((0, embeddings.shape[1]))
+            self.centroids = np.zeros((0, embeddings.shape[1]))
+        labels = np.empty(len(embeddings), dtype=np.int64)
+        for i, embedding in enumerate(embeddings):
+            if len(self.centroids):
+                similarities = self.centroids @ embedding
+                best = int(np.argmax(similarities))
+                if 1.0 - similarities[best] < self.threshold:
+                    self.sums[best] += embedding
+                    self.centroids[best] = self.sums[best] / np.linalg.norm(self.sums[best])
+                    labels[i] = best
+                    continue
+            self.sums = np.vstack([self.sums, embedding])
+            self.centroids = np.vstack([self.centroids, embedding / np.linalg.norm(embedding)])
+            labels[i] = len(self.centroids) - 1
+        return labels
+
+
+def cluster_embeddings(embeddings, method=DEFAULT_CLUSTERING_METHOD, num_speakers=None,
+                       threshold=DEFAULT_COSINE_THRESHOLD, eps=DEFAULT_EPS, min_samples=DEFAULT_MIN_SAMPLES,
+                       max_points=DEFAULT_MAX_POINTS):
+    """
+    L2正規化済みの話者埋め込みをクラスタリングし、話者ラベルの配列を返す (出現順に 0, 1, 2, ...)。
+
+    method:
+        agglomerative: コサイン距離の平均連結による階層クラスタリング (既定)。
+                       num_speakers が無ければ threshold で打ち切る。
+        spectral:      コサイン類似度を親和度としたスペクトラルクラスタリング。
+                       num_speakers が無ければ eigengap で推定する (点が少なければ agglomerative を使う)。
+        online:        OnlineClusterer による逐次クラスタリング。
+        dbscan:        従来の DBSCAN(eps, min_samples)。点数に対して計算量・メモリが急増する。
+    agglomerative / spectral では、点数が max_points を超えると代表点に圧縮してからクラスタリングするため、
+    数万セグメントでも計算量とメモリがほぼ線形に収まる。
+    """
+    if method not in CLUSTERING_METHODS:
+        raise ValueError(f"Unknown clustering method: {method} (choose from {', '.join(CLUSTERING_METHODS)})")
+    # scikit-learn は import に時間がかかるので、--help などでは読み込まない
+    from sklearn.cluster import DBSCAN, AgglomerativeClustering, SpectralClustering
+    embeddings = _normalize(np.asarray(embeddings, dtype=np.float64))
+    n = len(embeddings)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if n == 1:
+        return np.zeros(1, dtype=np.int64)
+
+    if method == "dbscan":
+        labels = DBSCAN(eps=eps, min_samples=min_samples).fit(embeddings).labels_
+        return _relabel_by_first_appearance(labels)
+    if method == "online":
+        return _relabel_by_first_appearance(OnlineClusterer(threshold=threshold).partial_fit(embeddings))
+
+    points, assignment = _compress(embeddings, max_points)
+    if len(points) == 1:
+        return np.zeros(n, dtype=np.int64)
+    n_clusters = min(num_speakers, len(points)) if num_speakers else None
+    if method == "spectral" and not n_clusters and len(points) < MIN_SPECTRAL_POINTS:
+        method = "agglomerative"
+
+    if method == "agglomerative":
+        if n_clusters:
+            model = AgglomerativeClustering(n_clusters=n_clusters, metric="cosine", linkage="average")
+        else:
+            model = AgglomerativeClustering(n_clusters=None, distance_threshold=threshold, metric="cosine", linkage="average")
+        point_labels = model.fit_predict(points)
+    else:
+        affinity = prune_affinity(np.clip(points @ points.T, 0.0, 1.0))
+        if not n_clusters:
+            n_clusters = estimate_num_speakers(affinity)
+        if n_clusters == 1:
+            point_labels = np.zeros(len(points), dtype=np.int64)
+        else:
+            model = SpectralClustering(n_clusters=n_clusters, affinity="precomputed", random_state=0)
+            point_labels = model.fit_predict(affinity)
+
+    return _relabel_by_first_appearance(point_labels[assignment])
+
+
+def add_clustering_arguments(parser):
+    """話者クラスタリングのコマンドライン引数を argparse のパーサーに追加する (各スクリプト共通)"""
+    parser.add_argument("--clustering", choices=CLUSTERING_METHODS, default=DEFAULT_CLUSTERING_METHOD, help=f"Speaker clustering method (default: {DEFAULT_CLUSTERING_METHOD}). 'online' assigns segments incrementally; 'dbscan' is the previous behaviour and scales poorly to tens of thousands of segments.")
+    parser.add_argument("--num-speakers", type=int, default=None, help="Known number of speakers for agglomerative/spectral clustering. Estimated automatically when omitted.")
+    parser.add_argument("--cluster-threshold", type=float, default=DEFAULT_COSINE_THRESHOLD, help=f"Cosine distance threshold for agglomerative/online clustering when --num-speakers is not given (default: {DEFAULT_COSINE_THRESHOLD}).")
+    parser.add_argument("--eps", type=float, default=DEFAULT_EPS, help=f"DBSCAN eps used with --clustering dbscan (default: {DEFAULT_EPS}).")
+    parser.add_argument("--min-samples", type=int, default=DEFAULT_MIN_SAMPLES, help=f"DBSCAN min_samples used with --clustering dbscan (default: {DEFAULT_MIN_SAMPLES}).")
+
+
+def clustering_options_from_args(args):
+    """add_clustering_arguments で追加した引数から cluster_embeddings に渡すオプションを作る"""
+    return {
+        'method': args.clustering,
+        'num_speakers': args.num_speakers,
+        'threshold': args.cluster_threshold,
+        'eps': args.eps,
+        'min_samples': args.min_samples,
+    }
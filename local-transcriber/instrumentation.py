@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError: # Windows には resource モジュールが無い
+    resource = None
+
+# パイプラインのステージ名 (レポートにはこの順で並べる)
+STAGES = ("decode", "transcribe", "embed", "cluster", "format", "write", "summarize")
+
+# 実行中のジョブの PipelineProfiler (None なら計測しない)。各ステージの処理からは stage() 経由で参照する。
+# 複数のジョブをスレッドで同時に実行しても混ざらないよう、コンテキスト変数に持つ
+# (別スレッドに処理を渡すときは contextvars.copy_context().run で引き継ぐ)
+_current_profiler = contextvars.ContextVar("current_profiler", default=None)
+
+
+def peak_rss_mb():
+    """このプロセスのこれまでの最大常駐メモリ (MB) を返す。取得できない環境では None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def default_metrics_path(output_file):
+    """文字起こし結果に対応する計測結果の保存先 ([出力ファイル].metrics.json) を返す"""
+    return output_file + ".metrics.json"
+
+
+class PipelineProfiler:
+    """
+    1ジョブ分のステージごとの計測結果 (実時間、CPU時間、最大常駐メモリ、RTF、セグメント/秒) を集める。
+    同じステージが何度も呼ばれる場合 (ストリーミングのウィンドウごとなど) は合計する。
+
+    CPU時間はプロセス全体 (torch のスレッドを含む) の値なので、OpenAI API の応答待ちと埋め込み計算を
+    並行して行う場合などは、重なっているステージの CPU時間が重複して数えられる。
+    最大常駐メモリはプロセス起動時からの最大値をステージの終了時に読んだもので、値が増えたステージがメモリを押し上げている。
+
+    profile_path を指定すると cProfile で計測して pstats 形式で保存する (profile_stages を指定した場合はそのステージの間だけ)。
+    cProfile が見るのは計測を始めたスレッドだけなので、スレッドをまたぐ処理や torch の内部は py-spy などで外から見る。
+    """
+
+    def __init__(self, audio_file=None, profile_path=None, profile_stages=None):
+        self.audio_file = audio_file
+        self.audio_sec = None
+        self.profile_path = profile_path
+        self.profile_stages = set(profile_stages or ())
+        self.stages = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._profile = None
+        self._profile_depth = 0
+        self._started_at = datetime.now().isoformat(timespec="seconds")
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._wall_sec = None
+        self._cpu_sec = None
+        if profile_path:
+            import cProfile
+            self._profile = cProfile.Profile()
+            if not self.profile_stages:
+                self._profile.enable()
+
+    def _profile_stage(self, name, enable):
+        if self._profile is None or name not in self.profile_stages:
+            return
+        with self._lock:
+            if enable:
+                self._profile_depth += 1
+                if self._profile_depth == 1:
+                    self._profile.enable()
+            else:
+                self._profile_depth -= 1
+                if self._profile_depth == 0:
+                    self._profile.disable()
+
+    @contextmanager
+    def stage(self, name, segments=None):
+        """
+        with ブロックの間をステージ name として計測する。
+        ブロック内で処理したセグメント数が後で分かる場合は、yield した辞書の 'segments' に入れる。
+        """
+        record = {'segments': segments}
+        self._profile_stage(name, True)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            wall_sec = time.perf_counter() - wall_start
+            cpu_sec = time.process_time() - cpu_start
+            self._profile_stage(name, False)
+            rss = peak_rss_mb()
+            with self._lock:
+                stats = self.stages.setdefault(name, {
+                    'calls': 0, 'wall_sec': 0.0, 'cpu_sec': 0.0, 'peak_rss_mb': None, 'segments': None,
+                })
+                stats['calls'] += 1
+                stats['wall_sec'] += wall_sec
+                stats['cpu_sec'] += cpu_sec
+                if rss is not None:
+                    stats['peak_rss_mb'] = max(stats['peak_rss_mb'] or 0.0, rss)
+                if record['segments'] is not None:
+                    stats['segments'] = (stats['segments'] or 0) + record['segments']
+                self.events.append({
+                    'stage': name,
+                    'start_sec': round(wall_start - self._wall_start, 4),
+                    'wall_sec': round(wall_sec, 4),
+                })
+
+    def finish(self):
+        """計測を終える (cProfile の結果があれば保存する)。以降の report() はこの時点の合計を使う"""
+        if self._wall_sec is not None:
+            return
+        self._wall_sec = time.perf_counter() - self._wall_start
+        self._cpu_sec = time.process_time() - self._cpu_start
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.profile_path)
+            print(f"cProfile stats saved to {self.profile_path} (view with 'python -m pstats {self.profile_path}' or snakeviz).")
+
+    def _rates(self, wall_sec, segments):
+        return {
+            'rtf': round(wall_sec / self.audio_sec, 4) if self.audio_sec else None,
+            'segments_per_sec': round(segments / wall_sec, 2) if segments is not None and wall_sec > 0 else None,
+        }
+
+    def summary(self):
+        """ジョブ全体の実時間・CPU時間・最大常駐メモリ・RTF を返す (バッチ処理のマニフェスト用)"""
+        wall_sec = self._wall_sec if self._wall_sec is not None else time.perf_counter() - self._wall_start
+        cpu_sec = self._cpu_sec if self._cpu_sec is not None else time.process_time() - self._cpu_start
+        return {
+            'wall_sec': round(wall_sec, 3),
+            'cpu_sec': round(cpu_sec, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'rtf': self._rates(wall_sec, None)['rtf'],
+        }
+
+    def report(self):
+        """計測結果全体を JSON に書ける辞書で返す"""
+        with self._lock:
+            names = [name for name in STAGES if name in self.stages]
+            names += sorted(name for name in self.stages if name not in STAGES)
+            stages = []
+            for name in names:
+                stats = self.stages[name]
+                stages.append(dict(
+                    {
+                        'stage': name,
+                        'calls': stats['calls'],
+                        'wall_sec': round(stats['wall_sec'], 3),
+                        'cpu_sec': round(stats['cpu_sec'], 3),
+                        'peak_rss_mb': stats['peak_rss_mb'],
+                        'segments': stats['segments'],
+                    },
+                    **self._rates(stats['wall_sec'], stats['segments'])
+                ))
+            events = list(self.events)
+        return {
+            'audio_file': self.audio_file,
+            'audio_sec': round(self.audio_sec, 2) if self.audio_sec else None,
+            'started_at': self._started_at,
+            'pid': os.getpid(),
+            'cpu_count': os.cpu_count(),
+            'total': self.summary(),
+            'stages': stages,
+            'events': events,
+        }
+
+    def write_json(self, path):
+        """計測結果を JSON ファイルに保存する"""
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        print(f"Pipeline metrics saved to {path}")
+
+    def print_summary(self):
+        """ステージごとの実時間・CPU時間・RTF を表示する"""
+        for stats in self.report()['stages']:
+            line = f"  {stats['stage']:>10}: {stats['wall_sec']:8.2f}s wall, {stats['cpu_sec']:8.2f}s CPU"
+            if stats['rtf'] is not None:
+                line += f", RTF {stats['rtf']:.3f}"
+            if stats['segments_per_sec'] is not None:
+                line += f", {stats['segments_per_sec']:.1f} segments/s"
+            if stats['peak_rss_mb'] is not None:
+                line += f", peak RSS {stats['peak_rss_mb']:.0f} MB"
+            print(line)
+
+
+@contextmanager
+def profiling(profiler):
+    """with ブロックの間、profiler を現在のジョブの計測先にする"""
+    token = _current_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current_profiler.reset(token)
+
+
+@contextmanager
+def stage(name, segments=None):
+    """現在のジョブの計測先があればステージ name として計測する (無ければ何もしない)"""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield {'segments': segments}
+        return
+    with profiler.stage(name, segments=segments) as record:
+        yield record
+
+
+def set_audio_duration(audio_sec):
+    """現在のジョブの音声の長さ (RTF の計算に使う) を記録する"""
+    profiler = _current_profiler.get()
+    if profiler is not None and audio_sec:
+        profiler.audio_sec = audio_sec
+
+
+def timed_iter(name, iterable):
+    """iterable から次の要素を取り出すのにかかった時間をステージ name として計測しながら要素を返す"""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+# 1つの応答に含める箇条書きの最大数
+MAX_BULLETS = 12
+BULLET_CHARS = 60
+
+
+def stub_summary(prompt):
+    """
+    プロンプトから決まった要約を作る (モデルを使わない)。
+    文字起こしのチャンク (「@話者 [時刻]」の行を含む) なら各発言の冒頭を、部分要約なら各箇条書きを並べる。
+    """
+    bullets = []
+    lines = prompt.splitlines()
+    for i, line in enumerate(lines):
+        if line.startswith("@") and i + 1 < len(lines):
+            bullets.append(f"- {line[1:].split(' [')[0]}: {lines[i + 1].strip()[:BULLET_CHARS]}")
+        elif line.startswith("- "):
+            bullets.append(line[:BULLET_CHARS + 2])
+    bullets = list(dict.fromkeys(bullets))[:MAX_BULLETS]
+    return "\n".join(bullets) if bullets else "- (no content)"
+
+
+class StubLLMRequestHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI 互換のチャット補完 API のスタブ (summarize.py の動作確認用)。
+    POST /v1/chat/completions   最後の user メッセージから stub_summary で応答を作る (delay 秒待ってから返す)
+    GET  /v1/models             モデル一覧 (1件)
+    """
+
+    server_version = "local-transcriber-llm-stub"
+    delay = 0.0
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path.rstrip("/") == "/v1/models":
+            self._send_json(200, {'object': "list", 'data': [{'id': "stub", 'object': "model", 'owned_by': "local"}]})
+        else:
+            self._send_json(404, {'error': {'message': "Not found."}})
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {'error': {'message': "Not found."}})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            prompt = [message for message in body['messages'] if message.get('role') == "user"][-1]['content']
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._send_json(400, {'error': {'message': "Invalid chat completion request."}})
+            return
+        with self.lock:
+            type(self).requests += 1
+            request_id = type(self).requests
+        time.sleep(self.delay)
+        content = stub_summary(prompt)
+        self._send_json(200, {
+            'id': f"chatcmpl-stub-{request_id}",
+            'object': "chat.completion",
+            'created': int(time.time()),
+            'model': body.get('model', "stub"),
+            'choices': [{'index': 0, 'message': {'role': "assistant", 'content': content}, 'finish_reason': "stop"}],
+            'usage': {'prompt_tokens': len(prompt), 'completion_tokens': len(content), 'total_tokens': len(prompt) + len(content)},
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible chat completion endpoint for testing summarize.py without a model or API key.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each response, to see the effect of --summary-concurrency (default: 0).")
+    args = parser.parse_args()
+
+    handler = type("Handler", (StubLLMRequestHandler,), {'delay': args.delay})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Stub LLM endpoint listening on http://{args.host}:{args.port}/v1. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
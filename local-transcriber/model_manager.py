@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+# Whisperの計算精度。int8 はCPU向けに Linear 層を動的量子化したもの
+COMPUTE_TYPES = ("float32", "int8")
+DEFAULT_WHISPER_MODEL = "large"
+DEFAULT_COMPUTE_TYPE = "float32"
+
+# 読み込み済みモデル: {(種類, 名前, デバイス): モデル}
+_models = {}
+_lock = threading.Lock()
+# 読み込み済みモデルでの推論 (Whisper の文字起こし、VoiceEncoder の埋め込み) を1つずつに制限するロック。
+# Whisper はデコードのたびに共有のデコーダーへ kv-cache のフックを登録するため、同じモデルを複数スレッドから
+# 同時に使うと互いの出力が壊れる。常駐サービスで複数ジョブを同時に実行する場合は、推論以外
+# (デコード、OpenAI API の待ち、クラスタリング、書き込み) だけが並行する
+inference_lock = threading.RLock()
+
+
+def resolve_device(device=None):
+    """device が未指定なら、GPUが利用可能かどうかで "cuda" / "cpu" を選ぶ"""
+    if device:
+        return device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def set_torch_threads(num_threads):
+    """torch の intra-op スレッド数を設定する (None なら torch の既定値のまま)。実際の値を返す"""
+    import torch
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
+def quantize_whisper_int8(model):
+    """
+    WhisperモデルのLinear層をint8に動的量子化する (CPU専用)。
+    whisper は独自の Linear サブクラスを使っており quantize_dynamic の対象にならないため、
+    先に同じ重みの nn.Linear に置き換えてから量子化する。
+    """
+    import torch
+    from torch import nn
+    from whisper.model import Linear as WhisperLinear
+
+    def replace_linear(module):
+        for child_name, child in module.named_children():
+            if isinstance(child, WhisperLinear):
+                plain = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                plain.load_state_dict(child.state_dict())
+                setattr(module, child_name, plain)
+            else:
+                replace_linear(child)
+
+    replace_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def _get_or_load(kind, name, device, loader):
+    """(種類, 名前, デバイス) ごとにモデルを一度だけ読み込み、読み込み時間を表示する"""
+    key = (kind, name, device)
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"Loading {kind} model '{name}' on {device}...")
+            started = time.perf_counter()
+            model = loader()
+            print(f"Loaded {kind} model '{name}' on {device} in {time.perf_counter() - started:.1f}s.")
+            _models[key] = model
+    return model
+
+
+def get_whisper_model(name=DEFAULT_WHISPER_MODEL, device=None, compute_type=DEFAULT_COMPUTE_TYPE):
+    """
+    Whisperモデルを返す。whisper (と torch) は最初に必要になった時点で import する。
+    compute_type="int8" はCPUでのみ使え、Linear層を動的量子化したモデルを返す。
+    """
+    if compute_type not in COMPUTE_TYPES:
+        raise ValueError(f"Unknown compute type: {compute_type} (choose from {', '.join(COMPUTE_TYPES)})")
+    if compute_type == "int8":
+        # 動的量子化のカーネルはCPUにしかない
+        if device not in (None, "cpu"):
+            raise ValueError("compute_type 'int8' is only supported on CPU.")
+        device = "cpu"
+    device = resolve_device(device)
+
+    def load():
+        import whisper
+        model = whisper.load_model(name, device=device)
+        if compute_type == "int8":
+            model = quantize_whisper_int8(model)
+        return model
+
+    return _get_or_load("whisper", name if compute_type == DEFAULT_COMPUTE_TYPE else f"{name}-{compute_type}", device, load)
+
+
+def get_voice_encoder(device=None):
+    """ResemblyzerのVoiceEncoderを返す。resemblyzer (と torch) は最初に必要になった時点で import する"""
+    device = resolve_device(device)
+
+    def load():
+        from resemblyzer import VoiceEncoder
+        return VoiceEncoder(device=device, verbose=False)
+
+    return _get_or_load("voice-encoder", "resemblyzer", device, load)
+
+
+def add_whisper_arguments(parser):
+    """Whisperモデルの選択に関するコマンドライン引数を argparse のパーサーに追加する (各スクリプト共通)"""
+    parser.add_argument("--whisper-model", default=DEFAULT_WHISPER_MODEL, help=f"Local Whisper model size, e.g. tiny, base, small, medium, large, turbo (default: {DEFAULT_WHISPER_MODEL}). Smaller models are much faster on CPU at some cost in accuracy.")
+    parser.add_argument("--compute-type", choices=COMPUTE_TYPES, default=DEFAULT_COMPUTE_TYPE, help=f"Precision of the local Whisper model. 'int8' (experimental) dynamically quantizes the Linear layers and runs on CPU only; check its accuracy on your audio with benchmark_whisper.py first (default: {DEFAULT_COMPUTE_TYPE}).")
+
+
+def loaded_models():
+    """読み込み済みモデルのキー (種類, 名前, デバイス) の一覧を返す"""
+    with _lock:
+        return list(_models)
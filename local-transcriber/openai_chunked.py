@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import random
+import wave
+
+import numpy as np
+
+from audio_io import SAMPLE_RATE
+
+# OpenAI APIの1ファイルあたりの上限 (25MB) に余裕を持たせたチャンクサイズ
+DEFAULT_MAX_CHUNK_MB = 24
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+# チャンクの末尾から遡って無音区間を探す範囲 (秒) と、エネルギー計算のフレーム長 (秒)
+SILENCE_SEARCH_SEC = 30.0
+FRAME_SEC = 0.03
+WAV_HEADER_BYTES = 44
+
+
+def find_chunk_boundaries(samples, max_chunk_sec, search_sec=SILENCE_SEARCH_SEC, frame_sec=FRAME_SEC):
+    """
+    音声を max_chunk_sec 以下のチャンクに分割する境界を返す。
+    各チャンクの末尾付近 search_sec の範囲で最もエネルギーの小さいフレーム (無音) で区切るので、発話の途中で切れにくい。
+    戻り値: [(start_sample, end_sample), ...]
+    """
+    max_chunk = int(max_chunk_sec * SAMPLE_RATE)
+    search = min(int(search_sec * SAMPLE_RATE), max_chunk // 2)
+    frame = max(1, int(frame_sec * SAMPLE_RATE))
+
+    boundaries = []
+    start = 0
+    total = len(samples)
+    while total - start > max_chunk:
+        region_start = start + max_chunk - search
+        n_frames = search // frame
+        region = samples[region_start:region_start + n_frames * frame].reshape(n_frames, frame)
+        # フレームごとのRMSが最小のフレームの中央で区切る
+        quietest = int(np.argmin(np.sqrt(np.mean(region.astype(np.float64) ** 2, axis=1))))
+        end = region_start + quietest * frame + frame // 2
+        boundaries.append((start, end))
+        start = end
+    if total > start:
+        boundaries.append((start, total))
+    return boundaries
+
+
+def encode_wav_bytes(samples):
+    """float32 配列を16kHzモノラル16bitのWAVバイト列 (メモリ上) にエンコードする"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def _is_retryable(error):
+    """一時的なエラー (通信エラー、レート制限、サーバーエラー) かどうか"""
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in (408, 409)
+
+
+def _retry_delay(error, attempt, base_delay):
+    """
+    再試行までの待ち時間 (秒)。応答に Retry-After (秒数) があればそれに従い、無ければ指数バックオフ (ジッター付き) にする。
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after is not None:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass # HTTP 日付形式は使わず、指数バックオフにする
+    return base_delay * (2 ** attempt) * (1 + random.random())
+
+
+async def _transcribe_chunk(client, semaphore, index, chunk_samples, model, max_retries, base_delay):
+    """1チャンクをアップロードして verbose_json の辞書を返す。一時的なエラーは指数バックオフで再試行する"""
+    for attempt in range(max_retries + 1):
+        # 再試行を待つ間は枠を手放し、他のチャンクのアップロードを止めない
+        async with semaphore:
+            # エンコードはアップロード直前に行い、同時に保持するWAVバイト列を同時実行数分に抑える
+            wav_bytes = encode_wav_bytes(chunk_samples)
+            try:
+                transcription = await client.audio.transcriptions.create(
+                    file=(f"chunk_{index:04d}.wav", wav_bytes, "audio/wav"),
+                    model=model,
+                    response_format="verbose_json",
+                    timestamp_granularities=["segment"]
+                )
+                return transcription.model_dump(mode="json")
+            except Exception as e:
+                if attempt >= max_retries or not _is_retryable(e):
+                    raise
+                delay = _retry_delay(e, attempt, base_delay)
+                print(f"Chunk {index + 1}: request failed ({e}). Retrying in {delay:.1f}s ({attempt + 1}/{max_retries})...")
+        del wav_bytes # 待っている間はWAVバイト列を持たない (再試行のたびにエンコードし直す)
+        await asyncio.sleep(delay)
+
+
+def merge_chunk_responses(responses, offsets_sec):
+    """
+    チャンクごとの verbose_json を1つにまとめる。セグメントの時刻にはチャンクの開始時刻を足して元のタイムラインに戻す。
+    """
+    merged_segments = []
+    texts = []
+    for response, offset in zip(responses, offsets_sec):
+        texts.append((response.get('text') or '').strip())
+        for segment in response.get('segments') or []:
+            segment = dict(segment)
+            segment['id'] = len(merged_segments)
+            segment['start'] = segment.get('start', 0) + offset
+            segment['end'] = segment.get('end', 0) + offset
+            merged_segments.append(segment)
+    duration = 0.0
+    if responses:
+        duration = offsets_sec[-1] + (responses[-1].get('duration') or 0)
+    language = next((r.get('language') for r in responses if r.get('language')), None)
+    return {
+        'text': " ".join(text for text in texts if text),
+        'language': language,
+        'duration': duration,
+        'segments': merged_segments,
+    }
+
+
+async def transcribe_chunked_async(samples, model="whisper-1", max_chunk_mb=DEFAULT_MAX_CHUNK_MB,
+                                   concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                                   base_delay=1.0, client=None):
+    """音声を無音位置でチャンクに分割し、同時実行数を制限しながら並行してアップロードする"""
+    max_chunk_sec = (max_chunk_mb * 1024 * 1024 - WAV_HEADER_BYTES) / (SAMPLE_RATE * 2)
+    boundaries = find_chunk_boundaries(samples, max_chunk_sec)
+    print(f"Uploading {len(boundaries)} chunks to OpenAI API (max {max_chunk_mb} MB each, concurrency {concurrency})...")
+
+    if client is None:
+        from openai import AsyncOpenAI
+        # 再試行はこちらで制御するので、クライアント側の自動再試行は無効にする
+        client = AsyncOpenAI(max_retries=0)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        _transcribe_chunk(client, semaphore, i, samples[start:end], model, max_retries, base_delay)
+        for i, (start, end) in enumerate(boundaries)
+    ]
+    responses = await asyncio.gather(*tasks)
+    offsets_sec = [start / SAMPLE_RATE for start, _ in boundaries]
+    return merge_chunk_responses(responses, offsets_sec)
+
+
+def transcribe_chunked(samples, **kwargs):
+    """transcribe_chunked_async の同期版"""
+    return asyncio.run(transcribe_chunked_async(samples, **kwargs))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# 既定のキャッシュ保存先 (Whisperモデルの ~/.cache/whisper に合わせる)
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TRANSCRIBER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "local-transcriber")
+)
+DEFAULT_CACHE_MAX_MB = 2048
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """ファイル内容のSHA-256ハッシュ (16進文字列) を返す"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """
+    音声ファイルの内容ハッシュ + モデル・パラメータをキーにした、ディスク上の結果キャッシュ。
+    JSON (セグメント一覧、APIの生レスポンス) と NumPy 配列 (埋め込み行列) を保存する。
+    合計サイズが上限を超えたら、最後に使われてから最も時間が経ったエントリから削除する (LRU)。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_mb=DEFAULT_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(audio_digest, **params):
+        """音声ハッシュとパラメータからキャッシュキーを作る"""
+        payload = json.dumps({"audio": audio_digest, **params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _touch(self, path):
+        # mtime を最終利用時刻として使う
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _write_atomic(self, path, write_func):
+        # 書き込み途中のファイルが読まれないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write_func(f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get_json(self, key):
+        path = self._path(key, "json")
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return value
+
+    def put_json(self, key, value):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._write_atomic(self._path(key, "json"), lambda f: f.write(data))
+
+    def get_arrays(self, key):
+        """put_arrays で保存した配列を {名前: 配列} で返す。無ければ None"""
+        path = self._path(key, "npz")
+        try:
+            with np.load(path) as data:
+                value = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return value
+
+    def put_arrays(self, key, **arrays):
+        self._write_atomic(self._path(key, "npz"), lambda f: np.savez(f, **arrays))
+
+    def evict(self):
+        """合計サイズが上限以下になるまで、最も古く使われたエントリを削除する"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
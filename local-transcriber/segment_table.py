@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from audio_io import SAMPLE_RATE
+
+# to_arrays() の配列の並び・名前を変えたら上げる (キャッシュキーに含め、古い形式のエントリを読まないようにする)
+SEGMENT_TABLE_VERSION = 1
+
+
+class SegmentTable:
+    """
+    文字起こしのセグメント一覧を、セグメントごとの辞書ではなく列ごとの配列で持つ表。
+    start / end (秒, float64)、index (元のセグメント番号, int64) は NumPy 配列、テキストは別のリストに持ち、
+    話者埋め込み (embeddings) とクラスタリングの結果 (labels) も同じ並びで持てる。
+    speaker_names にはラベルから話者名への対応 (登録話者の名前など) を入れる (無いラベルは Speaker_N)。
+    文字起こし → 埋め込み → クラスタリング → 整形の各ステージでこの表を受け渡し、
+    絞り込み (take) やサンプル位置の計算 (sample_spans) は配列演算でまとめて行う。
+    保存は to_arrays() / from_arrays() の npz 形式にそろえる (キャッシュとチェックポイントで共通)。
+    """
+
+    def __init__(self, start, end, text, index=None, embeddings=None, labels=None):
+        self.start = np.asarray(start, dtype=np.float64).reshape(-1)
+        self.end = np.asarray(end, dtype=np.float64).reshape(-1)
+        self.text = list(text)
+        self.index = np.arange(len(self.start), dtype=np.int64) if index is None else np.asarray(index, dtype=np.int64).reshape(-1)
+        self.embeddings = None if embeddings is None else np.asarray(embeddings, dtype=np.float32)
+        self.labels = None if labels is None else np.asarray(labels, dtype=np.int64)
+        self.speaker_names = {}
+        if not len(self.start) == len(self.end) == len(self.text) == len(self.index):
+            raise ValueError("start, end, text and index must have the same length")
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros(0), np.zeros(0), [])
+
+    @classmethod
+    def from_segments(cls, segments):
+        """
+        Whisperの辞書 / OpenAIのセグメントオブジェクトが混在しうるセグメント一覧から表を作る。
+        index には元の一覧での位置が入る (形式が想定外のセグメントは飛ばす)。
+        """
+        starts, ends, texts, indices = [], [], [], []
+        total_segments = len(segments)
+        for i, segment in enumerate(segments):
+            # start, end, text を取得 (オブジェクトか辞書かで分岐)
+            try:
+                if isinstance(segment, dict):
+                    start = segment.get('start', 0)
+                    end = segment.get('end', 0)
+                    text = segment.get('text', '').strip()
+                else: # TranscriptionSegment オブジェクトと仮定
+                    start = segment.start
+                    end = segment.end
+                    text = segment.text.strip()
+            except AttributeError:
+                print(f"Warning: Segment {i+1}/{total_segments} has unexpected format. Skipping.")
+                continue
+            starts.append(start)
+            ends.append(end)
+            texts.append(text)
+            indices.append(i)
+        return cls(starts, ends, texts, index=indices)
+
+    @classmethod
+    def concat(cls, tables):
+        """複数の表を順に連結する (埋め込み・ラベルは全ての表が持つ場合だけ連結する)"""
+        tables = [table for table in tables if table is not None]
+        if not tables:
+            return cls.empty()
+        embeddings = None
+        if all(table.embeddings is not None for table in tables):
+            embeddings = np.concatenate([table.embeddings for table in tables])
+        labels = None
+        if all(table.labels is not None for table in tables):
+            labels = np.concatenate([table.labels for table in tables])
+        return cls(
+            np.concatenate([table.start for table in tables]),
+            np.concatenate([table.end for table in tables]),
+            [text for table in tables for text in table.text],
+            index=np.concatenate([table.index for table in tables]),
+            embeddings=embeddings, labels=labels,
+        )
+
+    def __len__(self):
+        return len(self.start)
+
+    def take(self, selection):
+        """真偽値のマスクまたは位置の配列で行を選んだ新しい表を返す"""
+        selection = np.asarray(selection)
+        positions = np.flatnonzero(selection) if selection.dtype == bool else selection.astype(np.int64).reshape(-1)
+        return SegmentTable(
+            self.start[positions], self.end[positions], [self.text[i] for i in positions.tolist()],
+            index=self.index[positions],
+            embeddings=None if self.embeddings is None else self.embeddings[positions],
+            labels=None if self.labels is None else self.labels[positions],
+        )
+
+    def speaker_name(self, label):
+        """ラベルの話者名 (speaker_names に無ければ Speaker_N、-1 は Speaker_Unknown)"""
+        if label in self.speaker_names:
+            return self.speaker_names[label]
+        return f"Speaker_{label}" if label != -1 else "Speaker_Unknown"
+
+    def segment(self, i):
+        """i 行目を {'start', 'end', 'text'} の辞書で返す"""
+        return {'start': float(self.start[i]), 'end': float(self.end[i]), 'text': self.text[i]}
+
+    def sample_spans(self, sample_rate=SAMPLE_RATE, offset_sec=0.0, n_samples=None):
+        """
+        各セグメントの音声上のサンプル位置 (start_sample, end_sample) を返す。
+        offset_sec は音声配列の先頭の時刻 (ストリーミングのウィンドウ開始位置など)、
+        n_samples を指定すると終了位置をその長さで打ち切る。
+        戻り値: shape (len(self), 2) の int64 配列
+        """
+        starts = ((self.start - offset_sec) * sample_rate).astype(np.int64)
+        ends = ((self.end - offset_sec) * sample_rate).astype(np.int64)
+        if n_samples is not None:
+            ends = np.minimum(ends, n_samples)
+        return np.column_stack([starts, ends])
+
+    def to_dicts(self):
+        """[{'start', 'end', 'text'}, ...] の形式に戻す (JSON に書く場合など)"""
+        return [
+            {'start': start, 'end': end, 'text': text}
+            for start, end, text in zip(self.start.tolist(), self.end.tolist(), self.text)
+        ]
+
+    def to_arrays(self):
+        """
+        np.savez で保存できる {名前: 配列} を返す。
+        テキストは UTF-8 のバイト列を連結した配列と、各セグメントの開始位置の配列で持つ (pickle を使わずに読み書きできる)。
+        """
+        encoded = [text.encode("utf-8") for text in self.text]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        arrays = {
+            'start': self.start,
+            'end': self.end,
+            'index': self.index,
+            'text_bytes': np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            'text_offsets': offsets,
+        }
+        if self.embeddings is not None:
+            arrays['embeddings'] = self.embeddings
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """to_arrays() の結果 (np.load で読んだもの) から表を作る"""
+        data = np.asarray(arrays['text_bytes'], dtype=np.uint8).tobytes()
+        offsets = np.asarray(arrays['text_offsets']).tolist()
+        texts = [data[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+        return cls(
+            arrays['start'], arrays['end'], texts, index=arrays['index'],
+            embeddings=arrays.get('embeddings'), labels=arrays.get('labels'),
+        )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# 1回のforwardでVoiceEncoderに通す部分発話(partial utterance)ウィンドウ数の既定値
+DEFAULT_EMBEDDING_BATCH_SIZE = 64
+SAMPLE_RATE = 16000
+
+
+def embed_segments_batched(encoder, wav, spans, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                           rate=1.3, min_coverage=0.75, progress_callback=None):
+    """
+    複数セグメントの部分発話ウィンドウをまとめて固定サイズのバッチでVoiceEncoderに通し、
+    セグメントごとの埋め込みを返す。
+    結果はセグメントごとに encoder.embed_utterance を呼んだ場合と(浮動小数点誤差の範囲で)一致する。
+
+    spans: [(start_sample, end_sample), ...] (wav 上のサンプル位置)
+    戻り値: shape (len(spans), 256) の float32 配列 (各行はL2正規化済み)
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be >= 1, got {batch_size}")
+    # torch / resemblyzer は重いので、実際に埋め込みを計算する時点で import する
+    import torch
+    from resemblyzer import audio
+
+    n_spans = len(spans)
+    embed_sums = None
+    partial_counts = np.zeros(n_spans, dtype=np.int64)
+    pending_mels = []   # まだforwardしていない部分発話のメルスペクトログラム
+    pending_owner = []  # pending_mels の各要素がどのセグメントに属するか
+
+    def flush():
+        nonlocal embed_sums
+        if not pending_mels:
+            return
+        with torch.no_grad():
+            mels = torch.from_numpy(np.stack(pending_mels)).to(encoder.device)
+            partial_embeds = encoder(mels).cpu().numpy()
+        if embed_sums is None:
+            embed_sums = np.zeros((n_spans, partial_embeds.shape[1]), dtype=np.float64)
+        # 部分埋め込みを元のセグメントへ書き戻す (同じセグメントが複数回出現しても加算される)
+        owners = np.asarray(pending_owner)
+        np.add.at(embed_sums, owners, partial_embeds)
+        np.add.at(partial_counts, owners, 1)
+        pending_mels.clear()
+        pending_owner.clear()
+
+    for i, (start, end) in enumerate(spans):
+        segment_wav = wav[start:end]
+        # embed_utterance と同じ分割・パディングを行う
+        wav_slices, mel_slices = encoder.compute_partial_slices(len(segment_wav), rate, min_coverage)
+        max_wave_length = wav_slices[-1].stop
+        if max_wave_length >= len(segment_wav):
+            segment_wav = np.pad(segment_wav, (0, max_wave_length - len(segment_wav)), "constant")
+        mel = audio.wav_to_mel_spectrogram(segment_wav)
+        for mel_slice in mel_slices:
+            pending_mels.append(mel[mel_slice])
+            pending_owner.append(i)
+            if len(pending_mels) >= batch_size:
+                flush()
+        if progress_callback is not None:
+            progress_callback(i + 1, n_spans)
+    flush()
+
+    if embed_sums is None:
+        return np.zeros((0, 256), dtype=np.float32)
+
+    raw_embeds = embed_sums / partial_counts[:, None]
+    embeds = raw_embeds / np.linalg.norm(raw_embeds, axis=1, keepdims=True)
+    return embeds.astype(np.float32)
+
+
+def embed_sliding_windows(encoder, wav, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, rate=1.3, silence_db=-50.0):
+    """
+    音声全体をResemblyzerの部分発話ウィンドウ (1.6秒、rate に応じたステップ) で区切り、
+    ウィンドウごとの埋め込みをバッチで計算する。
+    RMSが silence_db (dBFS) 未満のウィンドウは無音として埋め込みを計算しない (簡易VAD)。
+    セグメント情報が無くても計算できるので、文字起こしと並行して実行できる。
+
+    戻り値: {'embeddings': (n, 256), 'starts': (n,) 秒, 'ends': (n,) 秒} (発話ありのウィンドウのみ)
+    """
+    import torch
+    from resemblyzer import audio
+
+    wav_slices, mel_slices = encoder.compute_partial_slices(len(wav), rate, 0.75)
+    max_wave_length = wav_slices[-1].stop
+    if max_wave_length >= len(wav):
+        wav = np.pad(wav, (0, max_wave_length - len(wav)), "constant")
+
+    starts = np.array([s.start for s in wav_slices], dtype=np.int64)
+    ends = np.array([s.stop for s in wav_slices], dtype=np.int64)
+    # ウィンドウごとのRMS (dBFS) で無音ウィンドウを除外する
+    rms = np.array([np.sqrt(np.mean(np.square(wav[s], dtype=np.float64))) for s in wav_slices])
+    speech = 20 * np.log10(np.maximum(rms, 1e-10)) >= silence_db
+    print(f"Sliding-window embedding: {int(speech.sum())}/{len(speech)} windows contain speech.")
+
+    mel = audio.wav_to_mel_spectrogram(wav)
+    speech_indices = np.flatnonzero(speech)
+    embeds = np.zeros((len(speech_indices), 256), dtype=np.float32)
+    for batch_start in range(0, len(speech_indices), batch_size):
+        batch = speech_indices[batch_start:batch_start + batch_size]
+        mels = np.stack([mel[mel_slices[i]] for i in batch])
+        with torch.no_grad():
+            partial_embeds = encoder(torch.from_numpy(mels).to(encoder.device)).cpu().numpy()
+        embeds[batch_start:batch_start + len(batch)] = partial_embeds
+
+    return {
+        'embeddings': embeds,
+        'starts': starts[speech_indices] / SAMPLE_RATE,
+        'ends': ends[speech_indices] / SAMPLE_RATE,
+    }
+
+
+def pool_window_embeddings(windows, spans_sec):
+    """
+    embed_sliding_windows の結果をセグメントに割り当てる。
+    中心がセグメント内にあるウィンドウの埋め込みを平均し、該当ウィンドウが無い短いセグメントは
+    中心が最も近いウィンドウを使う。
+
+    spans_sec: [(start_sec, end_sec), ...]
+    戻り値: shape (len(spans_sec), 256) の配列 (ウィンドウが1つも無い場合は None)
+    """
+    window_embeds = windows['embeddings']
+    if len(window_embeds) == 0:
+        return None
+    centers = (windows['starts'] + windows['ends']) / 2
+    # 累積和で区間ごとの合計をまとめて求める
+    cumulative = np.vstack([np.zeros((1, window_embeds.shape[1])), np.cumsum(window_embeds, axis=0, dtype=np.float64)])
+
+    spans = np.asarray(spans_sec, dtype=np.float64).reshape(-1, 2)
+    lo = np.searchsorted(centers, spans[:, 0], side="left")
+    hi = np.searchsorted(centers, spans[:, 1], side="right")
+    counts = hi - lo
+    sums = cumulative[hi] - cumulative[lo]
+
+    # ウィンドウ中心を含まないセグメントは、中点に最も近いウィンドウを使う
+    empty = counts == 0
+    if np.any(empty):
+        midpoints = spans[empty].mean(axis=1)
+        right = np.clip(np.searchsorted(centers, midpoints), 0, len(centers) - 1)
+        left = np.clip(right - 1, 0, len(centers) - 1)
+        nearest = np.where(np.abs(centers[left] - midpoints) <= np.abs(centers[right] - midpoints), left, right)
+        sums[empty] = window_embeds[nearest]
+        counts = np.where(empty, 1, counts)
+
+    raw_embeds = sums / counts[:, None]
+    embeds = raw_embeds / np.linalg.norm(raw_embeds, axis=1, keepdims=True)
+    return embeds.astype(np.float32)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# 既定の話者レジストリの保存先 (キャッシュと違い削除されると困るので ~/.local/share に置く)
+DEFAULT_REGISTRY_DIR = os.environ.get(
+    "TRANSCRIBER_SPEAKER_REGISTRY", os.path.join(os.path.expanduser("~"), ".local", "share", "local-transcriber", "speakers")
+)
+# クラスタ重心と登録済み埋め込みのコサイン類似度がこれ以上なら同一人物とみなす
+DEFAULT_MATCH_THRESHOLD = 0.75
+EMBEDDING_DIM = 256
+SAMPLE_RATE = 16000
+
+
+def cluster_centroids(embeddings, labels):
+    """
+    クラスタごとに埋め込みの平均 (L2正規化済み) を求める。
+    戻り値: (ラベルの配列, shape (クラスタ数, 256) の重心) (ノイズの -1 は除く)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    labels = np.asarray(labels)
+    unique_labels = np.array(sorted(set(labels.tolist()) - {-1}), dtype=np.int64)
+    if len(unique_labels) == 0:
+        return unique_labels, np.zeros((0, embeddings.shape[1]), dtype=np.float32)
+    mask = labels != -1
+    index = np.searchsorted(unique_labels, labels[mask])
+    sums = np.zeros((len(unique_labels), embeddings.shape[1]), dtype=np.float64)
+    np.add.at(sums, index, embeddings[mask])
+    centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return unique_labels, centroids.astype(np.float32)
+
+
+class SpeakerRegistry:
+    """
+    名前付きで登録した話者の参照埋め込み (VoiceEncoderの出力) を保存し、
+    クラスタ重心に最も近い登録話者の名前を返すレジストリ。
+
+    埋め込みは L2正規化済みの float32 行列として embeddings.npy に、各行の名前は speakers.json に保存する。
+    embeddings.npy はメモリマップで開くので、数千人分登録していても起動時の読み込みはほぼ一瞬で、
+    照合はクラスタ重心との行列積1回で済む。1人につき複数の参照埋め込みを登録できる。
+    """
+
+    def __init__(self, registry_dir=DEFAULT_REGISTRY_DIR):
+        self.registry_dir = registry_dir
+        self.embeddings_path = os.path.join(registry_dir, "embeddings.npy")
+        self.names_path = os.path.join(registry_dir, "speakers.json")
+        self.names = []
+        self.embeddings = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.load()
+
+    def load(self):
+        """レジストリをディスクから読み込む (存在しなければ空)"""
+        if not os.path.exists(self.embeddings_path) or not os.path.exists(self.names_path):
+            return
+        with open(self.names_path, "r", encoding="utf8") as f:
+            self.names = json.load(f)
+        self.embeddings = np.load(self.embeddings_path, mmap_mode="r")
+        if len(self.names) != len(self.embeddings):
+            raise RuntimeError(
+                f"Speaker registry {self.registry_dir} is inconsistent: "
+                f"{len(self.names)} names but {len(self.embeddings)} embeddings."
+            )
+
+    def __len__(self):
+        return len(self.names)
+
+    def speakers(self):
+        """登録済みの名前と、それぞれの参照埋め込みの数を返す"""
+        counts = {}
+        for name in self.names:
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def _save(self, names, embeddings):
+        # 書き込み途中のファイルが読まれないよう、両方を一時ファイルに書き終えてから置き換える。
+        # 書き込みに失敗してもディスク上とメモリ上のレジストリ (メモリマップ) は元のまま残る
+        os.makedirs(self.registry_dir, exist_ok=True)
+        tmp_paths = []
+        try:
+            for write_func in (
+                lambda f: np.save(f, embeddings),
+                lambda f: f.write(json.dumps(names, ensure_ascii=False, indent=2).encode("utf-8")),
+            ):
+                fd, tmp_path = tempfile.mkstemp(dir=self.registry_dir, suffix=".tmp")
+                tmp_paths.append(tmp_path)
+                with os.fdopen(fd, "wb") as f:
+                    write_func(f)
+            os.replace(tmp_paths[0], self.embeddings_path)
+            os.replace(tmp_paths[1], self.names_path)
+        finally:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        # 置き換えた後で、新しいファイルのメモリマップに差し替える
+        self.load()
+
+    def enroll(self, name, embeddings):
+        """name の参照埋め込みを追加する (embeddings: shape (256,) または (n, 256))"""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        combined = np.vstack([np.asarray(self.embeddings, dtype=np.float32), embeddings])
+        self._save(self.names + [name] * len(embeddings), combined)
+
+    def remove(self, name):
+        """name の参照埋め込みをすべて削除し、削除した件数を返す"""
+        keep = np.array([n != name for n in self.names], dtype=bool)
+        removed = int((~keep).sum())
+        if removed:
+            kept_names = [n for n in self.names if n != name]
+            self._save(kept_names, np.asarray(self.embeddings, dtype=np.float32)[keep])
+        return removed
+
+    def identify(self, centroids, threshold=DEFAULT_MATCH_THRESHOLD):
+        """
+        各重心に最も近い登録話者を探す。
+        戻り値: [(名前 または None, コサイン類似度), ...] (類似度が threshold 未満なら名前は None)
+        """
+        centroids = np.atleast_2d(np.asarray(centroids, dtype=np.float32))
+        if len(self.names) == 0 or len(centroids) == 0:
+            return [(None, 0.0)] * len(centroids)
+        centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        # 登録済み埋め込みは正規化済みなので、内積がそのままコサイン類似度になる
+        similarities = centroids @ self.embeddings.T
+        best = np.argmax(similarities, axis=1)
+        best_similarities = similarities[np.arange(len(centroids)), best]
+        return [
+            (self.names[index] if similarity >= threshold else None, float(similarity))
+            for index, similarity in zip(best.tolist(), best_similarities.tolist())
+        ]
+
+    def name_clusters(self, embeddings, labels, threshold=DEFAULT_MATCH_THRESHOLD):
+        """
+        クラスタリング結果の各クラスタに登録話者の名前を割り当てる。戻り値: {ラベル: 名前} (一致したものだけ)
+        1つの名前は1つのクラスタにだけ付ける。(クラスタ, 名前) の組を類似度の高い順に見て、どちらもまだ
+        割り当てていなければ割り当てる。名前を取れなかったクラスタは Speaker_N のまま出力される。
+        """
+        unique_labels, centroids = cluster_centroids(embeddings, labels)
+        if len(self.names) == 0 or len(centroids) == 0:
+            return {}
+        centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        # 名前ごとに、その名前の登録埋め込みのうち最も近いものとの類似度を取る
+        unique_names, name_index = np.unique(np.array(self.names), return_inverse=True)
+        similarities = np.full((len(centroids), len(unique_names)), -np.inf, dtype=np.float32)
+        np.maximum.at(similarities.T, name_index, (centroids @ self.embeddings.T).T)
+
+        names = {}
+        taken = set()
+        for flat in np.argsort(-similarities, axis=None, kind="stable").tolist():
+            row, column = divmod(flat, len(unique_names))
+            similarity = float(similarities[row, column])
+            if similarity < threshold:
+                break
+            label, name = int(unique_labels[row]), str(unique_names[column])
+            if label in names:
+                continue
+            if name in taken:
+                print(f"Speaker_{label} also matches {name} (similarity {similarity:.3f}), but {name} is already assigned to a closer speaker.")
+                continue
+            print(f"Speaker_{label} identified as {name} (similarity {similarity:.3f}).")
+            names[label] = name
+            taken.add(name)
+        return names
+
+
+def embed_audio_file(audio_path, start=None, end=None):
+    """音声ファイル (の start~end 秒) を VoiceEncoder で1つの埋め込みにする"""
+    from resemblyzer import preprocess_wav
+    from audio_io import decode_audio
+    from model_manager import get_voice_encoder
+
+    samples = decode_audio(audio_path)
+    start_sample = int(start * SAMPLE_RATE) if start is not None else 0
+    end_sample = int(end * SAMPLE_RATE) if end is not None else len(samples)
+    wav = preprocess_wav(samples[start_sample:end_sample], source_sr=SAMPLE_RATE)
+    if len(wav) == 0:
+        raise RuntimeError(f"No speech found in {audio_path}.")
+    return get_voice_encoder().embed_utterance(wav)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the speaker registry used to name diarized speakers across recordings.")
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY_DIR, help=f"Directory of the speaker registry (default: {DEFAULT_REGISTRY_DIR}).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enroll_parser = subparsers.add_parser("enroll", help="Enroll a reference recording of one speaker.")
+    enroll_parser.add_argument("name", help="Speaker name written in transcripts, e.g. 'Tanaka'.")
+    enroll_parser.add_argument("audio_file", help="Recording in which only this speaker talks.")
+    enroll_parser.add_argument("--start", type=float, default=None, help="Start of the speaker's section in seconds.")
+    enroll_parser.add_argument("--end", type=float, default=None, help="End of the speaker's section in seconds.")
+
+    lookup_parser = subparsers.add_parser("lookup", help="Find the enrolled speaker closest to a recording.")
+    lookup_parser.add_argument("audio_file", help="Recording to identify.")
+    lookup_parser.add_argument("--start", type=float, default=None, help="Start of the section in seconds.")
+    lookup_parser.add_argument("--end", type=float, default=None, help="End of the section in seconds.")
+    lookup_parser.add_argument("--threshold", type=float, default=DEFAULT_MATCH_THRESHOLD, help=f"Minimum cosine similarity for a match (default: {DEFAULT_MATCH_THRESHOLD}).")
+
+    subparsers.add_parser("list", help="List enrolled speakers.")
+    remove_parser = subparsers.add_parser("remove", help="Remove every reference embedding of a speaker.")
+    remove_parser.add_argument("name", help="Speaker name to remove.")
+    args = parser.parse_args()
+
+    registry = SpeakerRegistry(args.registry)
+    if args.command in ("enroll", "lookup") and not os.path.exists(args.audio_file):
+        print(f"Error: {args.audio_file} not found.")
+        sys.exit(1)
+
+    if args.command == "enroll":
+        embedding = embed_audio_file(args.audio_file, start=args.start, end=args.end)
+        registry.enroll(args.name, embedding)
+        print(f"Enrolled {args.name} ({registry.speakers()[args.name]} reference embeddings) in {args.registry}.")
+    elif args.command == "lookup":
+        embedding = embed_audio_file(args.audio_file, start=args.start, end=args.end)
+        started = time.perf_counter()
+        (name, similarity), = registry.identify(embedding, threshold=args.threshold)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if name is None:
+            print(f"No enrolled speaker matched (best similarity {similarity:.3f}, lookup {elapsed_ms:.3f} ms).")
+        else:
+            print(f"Matched {name} (similarity {similarity:.3f}, lookup {elapsed_ms:.3f} ms over {len(registry)} embeddings).")
+    elif args.command == "list":
+        for name, count in sorted(registry.speakers().items()):
+            print(f"{name}\t{count}")
+        print(f"{len(registry.speakers())} speakers, {len(registry)} reference embeddings.")
+    elif args.command == "remove":
+        removed = registry.remove(args.name)
+        print(f"Removed {removed} reference embeddings of {args.name}.")
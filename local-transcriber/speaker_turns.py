@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import re
+
+import numpy as np
+
+from segment_table import SegmentTable
+from clustering import _relabel_by_first_appearance
+
+# これより短い話者の区間は、話者の交代ではなく揺らぎとみなして隣の区間にまとめる (秒)
+DEFAULT_MIN_TURN_SEC = 1.0
+# ウィンドウごとの話者ラベルを多数決でならす幅 (ウィンドウ数、奇数)
+DEFAULT_TURN_SMOOTHING = 3
+# テキストを分割するとき、時間の比率で決めた位置からこの割合 (文字数比) の範囲で句読点・空白を探す
+SNAP_RATIO = 0.15
+_BREAK_CHARS = re.compile(r"[\s、。，．,.!?！？」』)）]")
+
+
+def smooth_labels(labels, width=DEFAULT_TURN_SMOOTHING):
+    """
+    時系列順のウィンドウの話者ラベルを、前後 width 個の多数決でならす (同数なら元のラベルを残す)。
+    1ウィンドウだけ別の話者になるような揺らぎを消す。ノイズ (-1) は多数決に加えない。
+    ならした結果で消えたラベルがあっても番号が飛ばないよう、出現順に 0, 1, 2, ... に振り直して返す。
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if width <= 1 or len(labels) == 0 or labels.max() < 0:
+        return _relabel_by_first_appearance(labels)
+    half = width // 2
+    width = 2 * half + 1
+    n_labels = labels.max() + 1
+    one_hot = np.zeros((len(labels) + 2 * half, n_labels), dtype=np.float64)
+    valid = np.flatnonzero(labels >= 0)
+    one_hot[valid + half, labels[valid]] = 1.0
+    # 累積和で幅 width の窓ごとの得票数をまとめて求める
+    cumulative = np.vstack([np.zeros((1, n_labels)), np.cumsum(one_hot, axis=0)])
+    votes = cumulative[width:] - cumulative[:-width]
+    votes[valid, labels[valid]] += 0.5 # 同数なら元のラベル
+    smoothed = np.argmax(votes, axis=1)
+    return _relabel_by_first_appearance(np.where(votes.max(axis=1) > 0, smoothed, labels))
+
+
+def find_turns(starts, ends, labels):
+    """
+    ウィンドウ (時系列順) のラベルから、話者が交代する時刻を求める。
+    交代の時刻は、ラベルが変わる前後のウィンドウの中心の中点とする。
+    戻り値: (boundaries, turn_labels) — turn_labels[i] は boundaries[i-1] から boundaries[i] までの話者
+            (先頭は -inf から、末尾は +inf まで)
+    """
+    centers = (np.asarray(starts) + np.asarray(ends)) / 2
+    labels = np.asarray(labels, dtype=np.int64)
+    changes = np.flatnonzero(labels[1:] != labels[:-1])
+    boundaries = (centers[changes] + centers[changes + 1]) / 2
+    turn_labels = np.concatenate([labels[changes], labels[-1:]])
+    return boundaries, turn_labels
+
+
+def _merge_short_pieces(edges, labels, min_turn_sec):
+    """区間 (edges[i]~edges[i+1] が labels[i]) のうち min_turn_sec 未満のものを、長い方の隣の区間にまとめる"""
+    edges = list(edges)
+    labels = list(labels)
+    while len(labels) > 1:
+        durations = np.diff(edges)
+        shortest = int(np.argmin(durations))
+        if durations[shortest] >= min_turn_sec:
+            break
+        if shortest == 0:
+            neighbor = 1
+        elif shortest == len(labels) - 1:
+            neighbor = shortest - 1
+        else:
+            neighbor = shortest - 1 if durations[shortest - 1] >= durations[shortest + 1] else shortest + 1
+        # 短い区間を隣の区間に吸収する (境界を1つ消す)
+        del edges[max(shortest, neighbor)]
+        del labels[shortest]
+    # 同じ話者が隣り合った区間をつなげる
+    merged_edges = [edges[0]]
+    merged_labels = []
+    for i, label in enumerate(labels):
+        if merged_labels and merged_labels[-1] == label:
+            merged_edges[-1] = edges[i + 1]
+        else:
+            merged_labels.append(label)
+            merged_edges.append(edges[i + 1])
+    return merged_edges, merged_labels
+
+
+def split_text(text, fractions):
+    """
+    text を fractions (各区間の時間の割合) に比例した文字数で分ける。
+    分割位置の近くに句読点や空白があればそこで切る。空白で単語を区切る言語 (ASCII のみのテキスト) は
+    単語の途中では切らず、近くに無ければ最も近い区切りで切る。空になる片は作らない (分けられなければ None)。
+    """
+    n_chars = len(text)
+    if n_chars < 2 * len(fractions):
+        return None
+    breaks = np.array([match.end() for match in _BREAK_CHARS.finditer(text, 1, n_chars - 1)], dtype=np.int64)
+    radius = max(2, int(n_chars * SNAP_RATIO))
+    cuts = []
+    previous = 0
+    for position in np.cumsum(fractions)[:-1]:
+        target = int(round(position * n_chars))
+        candidates = breaks[breaks > previous]
+        if len(candidates) and (text.isascii() or np.abs(candidates - target).min() <= radius):
+            cut = int(candidates[np.argmin(np.abs(candidates - target))])
+        elif text.isascii():
+            return None
+        else:
+            cut = target
+        cut = min(max(cut, previous + 1), n_chars - 1)
+        cuts.append(cut)
+        previous = cut
+    pieces = [text[a:b].strip() for a, b in zip([0] + cuts, cuts + [n_chars])]
+    if any(not piece for piece in pieces):
+        return None
+    return pieces
+
+
+def assign_turns(segments, boundaries, turn_labels, min_turn_sec=DEFAULT_MIN_TURN_SEC):
+    """
+    Whisper のセグメント (SegmentTable) を話者の交代時刻で分割し、各片に話者ラベルを付けた新しい表を返す。
+    交代をまたがないセグメント (ほとんど) は配列演算でまとめてラベルを付け、またぐものだけを個別に分割する。
+    分割された片の index は元のセグメントの index のまま。min_turn_sec 未満の片は隣の片にまとめる。
+    テキストは各片の長さに比例して (句読点・空白の位置に寄せて) 分け、分けられない場合は分割せず最も長い話者のラベルを付ける。
+    """
+    first = np.searchsorted(boundaries, segments.start, side="right")
+    last = np.searchsorted(boundaries, segments.end, side="left")
+    labels = turn_labels[first]
+    crossing = np.flatnonzero(last > first).tolist()
+    if not crossing:
+        labeled = segments.take(np.arange(len(segments)))
+        labeled.labels = labels
+        return labeled, 0
+
+    # 交代をまたぐセグメントだけを分割し、その他の行とつなぎ直す
+    starts, ends, texts, indices, piece_labels = [], [], [], [], []
+    n_split = 0
+    previous = 0
+    for i in crossing:
+        starts.extend(segments.start[previous:i].tolist())
+        ends.extend(segments.end[previous:i].tolist())
+        texts.extend(segments.text[previous:i])
+        indices.extend(segments.index[previous:i].tolist())
+        piece_labels.extend(labels[previous:i].tolist())
+        previous = i + 1
+
+        start, end = float(segments.start[i]), float(segments.end[i])
+        edges = [start] + boundaries[first[i]:last[i]].tolist() + [end]
+        edges, turn = _merge_short_pieces(edges, turn_labels[first[i]:last[i] + 1].tolist(), min_turn_sec)
+        durations = np.diff(edges)
+        pieces = split_text(segments.text[i], durations / durations.sum()) if len(turn) > 1 else None
+        if pieces is None:
+            starts.append(start)
+            ends.append(end)
+            texts.append(segments.text[i])
+            indices.append(int(segments.index[i]))
+            piece_labels.append(turn[int(np.argmax(durations))])
+            continue
+        n_split += 1
+        starts.extend(edges[:-1])
+        ends.extend(edges[1:])
+        texts.extend(pieces)
+        indices.extend([int(segments.index[i])] * len(pieces))
+        piece_labels.extend(turn)
+    starts.extend(segments.start[previous:].tolist())
+    ends.extend(segments.end[previous:].tolist())
+    texts.extend(segments.text[previous:])
+    indices.extend(segments.index[previous:].tolist())
+    piece_labels.extend(labels[previous:].tolist())
+
+    labeled = SegmentTable(starts, ends, texts, index=indices, labels=piece_labels)
+    return labeled, n_split
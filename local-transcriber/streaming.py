@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import threading
+import time
+
+import numpy as np
+
+import instrumentation
+from audio_io import SAMPLE_RATE, ffmpeg_decode_command, pcm16_to_float32
+from segment_table import SegmentTable
+from speaker_embedding import embed_segments_batched, DEFAULT_EMBEDDING_BATCH_SIZE
+from vad import transcribe_speech_only
+from model_manager import inference_lock
+
+# ストリーミングモードの既定ウィンドウ長と重なり (秒)
+DEFAULT_WINDOW_SEC = 300.0
+DEFAULT_OVERLAP_SEC = 10.0
+# ffmpegのstdoutから一度に読むバイト数 (16bit PCM 10秒分)
+READ_CHUNK_BYTES = SAMPLE_RATE * 2 * 10
+
+
+def iter_audio_windows(audio_path, window_sec=DEFAULT_WINDOW_SEC, overlap_sec=DEFAULT_OVERLAP_SEC, start_sec=0.0):
+    """
+    ffmpegで音声を16kHzモノラルの s16le としてデコードし、stdoutから固定長で重なりのある
+    ウィンドウを順に返すジェネレータ。保持するのは常に1ウィンドウ分+読み込みチャンク程度なので、
+    入力の長さに関係なくメモリ使用量は一定になる。
+    start_sec を指定すると、その位置からデコードを始める (チェックポイントからの再開用)。
+
+    yield: (window_start_sec, samples(float32, -1.0~1.0), is_last)
+    """
+    window = int(window_sec * SAMPLE_RATE)
+    overlap = int(overlap_sec * SAMPLE_RATE)
+    if not 0 <= overlap < window:
+        raise ValueError(f"overlap_sec ({overlap_sec}) must be >= 0 and smaller than window_sec ({window_sec})")
+    hop = window - overlap
+
+    extra_args = ("-ss", f"{start_sec:.6f}") if start_sec > 0 else ()
+    process = subprocess.Popen(ffmpeg_decode_command(audio_path, extra_args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    # stderrが詰まってffmpegが止まらないよう別スレッドで読み捨てる (エラー表示用に保持)
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    buffer = np.empty(0, dtype=np.float32)
+    buffer_offset = int(round(start_sec * SAMPLE_RATE)) # buffer[0] が元音声の何サンプル目か
+    eof = False
+    try:
+        while True:
+            # 次のウィンドウが存在するか判定できるよう、1サンプル余分に読み込んでおく
+            while not eof and len(buffer) <= window:
+                chunk = process.stdout.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    eof = True
+                    break
+                samples = pcm16_to_float32(chunk)
+                buffer = np.concatenate([buffer, samples])
+
+            if len(buffer) > window:
+                yield buffer_offset / SAMPLE_RATE, buffer[:window].copy(), False
+                buffer = buffer[hop:]
+                buffer_offset += hop
+            else:
+                if len(buffer) > 0:
+                    yield buffer_offset / SAMPLE_RATE, buffer, True
+                break
+    finally:
+        if process.poll() is None and not eof:
+            # 呼び出し側が途中で読むのをやめた場合
+            process.kill()
+        process.wait()
+        stderr_thread.join(timeout=1)
+
+    if process.returncode != 0:
+        stderr_text = b"".join(stderr_lines).decode("utf-8", errors="replace")
+        print(f"ffmpeg stderr: {stderr_text}")
+        raise RuntimeError(f"ffmpeg decoding failed with code {process.returncode}")
+
+
+def stitch_window_segments(window_segments, window_start, window_sec, overlap_sec, is_first, is_last, last_kept=None):
+    """
+    ウィンドウ内のセグメント (SegmentTable、時刻は元音声のタイムライン) のうち、このウィンドウが担当する範囲のものだけを残す。
+    隣り合うウィンドウの重なり区間は中央で分割し、セグメントの中点がどちら側にあるかで担当ウィンドウを決める。
+    直前に採用したセグメント (last_kept は {'start', 'end', 'text'} の辞書) と同じテキストが重なって出てきた場合は重複として除外する。
+    """
+    lower = -np.inf if is_first else window_start + overlap_sec / 2
+    upper = np.inf if is_last else window_start + window_sec - overlap_sec / 2
+
+    # 担当範囲はまとめて判定し、重複の確認だけを範囲内のセグメントについて順に行う
+    midpoints = (window_segments.start + window_segments.end) / 2
+    candidates = np.flatnonzero((lower <= midpoints) & (midpoints < upper)).tolist()
+    kept = []
+    previous_text, previous_end = (last_kept['text'], last_kept['end']) if last_kept is not None else (None, None)
+    for i in candidates:
+        text = window_segments.text[i]
+        if text == previous_text and window_segments.start[i] < previous_end:
+            continue
+        kept.append(i)
+        previous_text, previous_end = text, window_segments.end[i]
+    return window_segments.take(np.array(kept, dtype=np.int64))
+
+
+def stream_transcribe_and_embed(audio_path, whisper_model, encoder,
+                                window_sec=DEFAULT_WINDOW_SEC, overlap_sec=DEFAULT_OVERLAP_SEC,
+                                embedding_batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, total_duration=None, vad_options=None,
+                                resume_state=None, on_window_done=None):
+    """
+    音声をウィンドウ単位で読み込みながら、届いたウィンドウごとにWhisperでの文字起こしと
+    Resemblyzerでの埋め込み計算を行う。ウィンドウ境界のセグメントはつなぎ合わせて重複を除く。
+    vad_options が None でなければ、ウィンドウごとにVADで検出した発話区間だけを文字起こしする。
+
+    on_window_done を指定すると、各ウィンドウの処理後に途中状態 (resume_state と同じ形式の辞書) を渡して呼ぶ。
+    その辞書を resume_state に渡すと、続きのウィンドウから処理を再開する。
+
+    戻り値: 埋め込みを計算したセグメントの表 (SegmentTable)。
+        index は先頭からの通し番号、embeddings は shape (len(segments), 256) の配列
+    """
+    from resemblyzer import audio
+    from resemblyzer.hparams import audio_norm_target_dBFS
+
+    tables = [] # ウィンドウごとの、埋め込みを計算したセグメントの表
+    n_segments = 0
+    last_kept = None
+    start_sec = 0.0
+    first_window_index = 0
+    if resume_state is not None:
+        tables.append(resume_state['segments'])
+        n_segments = len(resume_state['segments'])
+        last_kept = resume_state['last_kept']
+        start_sec = resume_state['next_window_start']
+        first_window_index = resume_state['next_window_index']
+        print(f"Resuming streaming at window {first_window_index + 1} ({start_sec:.1f}s, {n_segments} segments done).")
+    whisper_sec = 0.0 # Whisperにかかった時間の合計 (RTFの表示用)
+    speech_sec = 0.0 # VAD使用時、Whisperに渡した発話区間の合計
+    windowed_sec = 0.0 # 全ウィンドウの長さの合計 (重なりを含む)
+    window_end = 0.0
+
+    # ffmpeg から次のウィンドウが届くまで待った時間を decode ステージとして計測する
+    windows = instrumentation.timed_iter(
+        "decode", iter_audio_windows(audio_path, window_sec=window_sec, overlap_sec=overlap_sec, start_sec=start_sec)
+    )
+    for window_index, (window_start, samples, is_last) in enumerate(windows, start=first_window_index):
+        window_end = window_start + len(samples) / SAMPLE_RATE
+        windowed_sec += len(samples) / SAMPLE_RATE
+        if total_duration:
+            print(f"Streaming window {window_index + 1}: {window_start:.1f}s - {window_end:.1f}s / {total_duration:.1f}s")
+        else:
+            print(f"Streaming window {window_index + 1}: {window_start:.1f}s - {window_end:.1f}s")
+
+        # 前のウィンドウの最後の発話をプロンプトにして、境界での文脈を引き継ぐ
+        initial_prompt = last_kept['text'] if last_kept else None
+        # 同じモデルを使う他のジョブ (常駐サービス) の推論が終わるのを待ってから計測を始める
+        with inference_lock:
+            started = time.perf_counter()
+            with instrumentation.stage("transcribe") as record:
+                if vad_options is not None:
+                    result, vad_stats = transcribe_speech_only(whisper_model, samples, vad_options, initial_prompt=initial_prompt)
+                    speech_sec += vad_stats['speech_sec']
+                else:
+                    result = whisper_model.transcribe(samples, initial_prompt=initial_prompt)
+                record['segments'] = len(result.get("segments", []))
+            whisper_sec += time.perf_counter() - started
+        # ウィンドウ内の時刻を元音声のタイムラインに直す
+        window_segments = SegmentTable.from_segments(result.get("segments", []))
+        window_segments.start += window_start
+        window_segments.end += window_start
+        kept = stitch_window_segments(window_segments, window_start, window_sec, overlap_sec,
+                                      is_first=(window_index == 0), is_last=is_last, last_kept=last_kept)
+        if len(kept):
+            last_kept = kept.segment(len(kept) - 1)
+
+        # preprocess_wav は無音区間を詰めてタイムラインがずれるため、音量正規化のみ行う
+        wav = audio.normalize_volume(samples, audio_norm_target_dBFS, increase_only=True)
+        spans = kept.sample_spans(offset_sec=window_start, n_samples=len(wav))
+        embeddable = spans[:, 1] - spans[:, 0] >= 160 # 短すぎるセグメントはエンコーダーがエラーを出すことがある (0.01秒)
+        for start in kept.start[~embeddable].tolist():
+            print(f"Segment at {start:.2f}s is too short, skipping embedding extraction.")
+        embedded = kept.take(embeddable)
+        embedded.index = np.arange(n_segments, n_segments + len(embedded), dtype=np.int64)
+
+        if len(embedded):
+            with inference_lock, instrumentation.stage("embed", segments=len(embedded)):
+                embedded.embeddings = embed_segments_batched(encoder, wav, spans[embeddable], batch_size=embedding_batch_size)
+            tables.append(embedded)
+            n_segments += len(embedded)
+        print(f"Window {window_index + 1}: kept {len(kept)} segments ({n_segments} total).")
+        if on_window_done is not None and not is_last:
+            on_window_done({
+                'segments': _concat_embedded(tables),
+                'last_kept': last_kept,
+                'next_window_start': window_start + window_sec - overlap_sec,
+                'next_window_index': window_index + 1,
+            })
+
+    instrumentation.set_audio_duration(window_end)
+    if window_end > 0:
+        print(f"Whisper: {whisper_sec:.1f}s for {window_end:.1f}s of audio (RTF {whisper_sec / window_end:.3f}).")
+        if vad_options is not None and windowed_sec > 0:
+            print(f"VAD: {speech_sec / windowed_sec * 100:.1f}% of the windowed audio was sent to Whisper.")
+    return _concat_embedded(tables)
+
+
+def _concat_embedded(tables):
+    """埋め込み付きの表を連結する (1つも無ければ shape (0, 256) の埋め込みを持つ空の表)"""
+    if not tables:
+        empty = SegmentTable.empty()
+        empty.embeddings = np.zeros((0, 256), dtype=np.float32)
+        return empty
+    return SegmentTable.concat(tables)
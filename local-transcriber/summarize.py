@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import zlib
+
+from openai_chunked import _is_retryable, DEFAULT_MAX_RETRIES
+from result_cache import ResultCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_MB
+from transcript_writers import format_clock
+
+DEFAULT_SUMMARY_MODEL = "gpt-4o-mini"
+# 1回のリクエストで送る文字起こし (または部分要約) の上限 (トークン数の見積もり)
+DEFAULT_CHUNK_TOKENS = 3000
+DEFAULT_SUMMARY_CONCURRENCY = 4
+# チャンクは上限に達する前でも、上限のこの割合を超えていれば「内容で決まる区切り」(発言のハッシュ値が
+# BOUNDARY_MODULUS で割り切れる話者交代) で区切る。一部の発言が変わっても、それ以降のチャンクの区切りが元に戻るので、
+# 変わっていないチャンクの要約はキャッシュから使い回せる
+BOUNDARY_MIN_RATIO = 0.5
+BOUNDARY_MODULUS = 4
+
+SYSTEM_PROMPT = "あなたは文字起こしされた議事録を要約するアシスタントです。"
+MAP_PROMPT = (
+    "以下は会議の文字起こしの一部です (「@話者 [時刻]」の後に発言が続きます)。\n"
+    "話者ごとの主な発言、決定事項、宿題 (TODO) を箇条書きで簡潔にまとめてください。\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "以下は1つの会議の文字起こしを時系列順に分割して要約したものです。\n"
+    "重複をまとめ、全体の要約、決定事項、宿題 (TODO) の見出しを付けて1つの要約にしてください。\n\n{text}"
+)
+SHORTEN_PROMPT = (
+    "以下は会議の文字起こしの一部を要約したものです。後で他の部分の要約とまとめるため、\n"
+    "話者ごとの主な発言、決定事項、宿題 (TODO) を残して、半分以下の長さの箇条書きに短くしてください。\n\n{text}"
+)
+PART_SEPARATOR = "\n\n---\n\n"
+
+
+def summary_path(output_file):
+    """要約の保存先 (文字起こしの出力ファイルの拡張子を .summary.md に置き換えたパス)"""
+    return os.path.splitext(output_file)[0] + ".summary.md"
+
+
+def estimate_tokens(text):
+    """
+    トークン数の見積もり (tokenizer を使わない概算)。
+    ASCII は約4文字で1トークン、それ以外 (日本語など) は1文字1トークンとして数えるので、実際より多めになる。
+    """
+    n_ascii = len(text.encode("ascii", errors="ignore"))
+    return (n_ascii + 3) // 4 + (len(text) - n_ascii)
+
+
+def transcript_records(segments):
+    """話者ラベル付きの SegmentTable を [(話者名, 開始秒, テキスト), ...] にする"""
+    labels = segments.labels.tolist() if segments.labels is not None else [-1] * len(segments)
+    return [
+        (segments.speaker_name(label), start, text)
+        for label, start, text in zip(labels, segments.start.tolist(), segments.text)
+    ]
+
+
+def load_transcript_records(path):
+    """transcription.py が書き出した .json / .jsonl の文字起こしを [(話者名, 開始秒, テキスト), ...] で読み込む"""
+    with open(path, "r", encoding="utf8") as f:
+        if path.endswith(".jsonl"):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)['segments']
+    return [(item['speaker'], item['start'], item['text']) for item in items]
+
+
+def _split_text(text, max_chars):
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def group_turns(records, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """
+    同じ話者が続くセグメントを1つの発言 (「@話者 [時刻]」+ 本文) にまとめる。
+    1つの発言が max_tokens を超える場合はセグメントの切れ目で分ける (1セグメントだけで超える場合は文字数で分ける)。
+    どの発言も、見出しを含めて max_tokens 以下になる (見出しだけで max_tokens に近いほど小さい上限は除く)。
+    戻り値: 発言のテキストのリスト
+    """
+    turns = []
+    speaker = None
+    header = ""
+    lines = []
+    tokens = 0
+    for record_speaker, start, text in records:
+        text = text.strip()
+        if not text:
+            continue
+        # 見出しから始まる発言に入れても上限を超えない長さ (見積もりは1文字あたり1トークン以下なので文字数で分ければ収まる)
+        record_header = f"@{record_speaker} [{format_clock(start)}]"
+        piece_chars = max(1, min(max_tokens // 2, max_tokens - estimate_tokens(record_header) - 2))
+        for piece in _split_text(text, piece_chars) if estimate_tokens(text) > piece_chars else [text]:
+            piece_tokens = estimate_tokens(piece) + 1
+            if record_speaker != speaker or tokens + piece_tokens > max_tokens:
+                if lines:
+                    turns.append(header + "\n" + "\n".join(lines))
+                speaker = record_speaker
+                header = f"@{speaker} [{format_clock(start)}]"
+                lines = []
+                tokens = estimate_tokens(header) + 1
+            lines.append(piece)
+            tokens += piece_tokens
+    if lines:
+        turns.append(header + "\n" + "\n".join(lines))
+    return turns
+
+
+def chunk_turns(turns, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """
+    発言を、話者の交代の位置でだけ区切って max_tokens 以下のチャンクにまとめる。
+    上限の BOUNDARY_MIN_RATIO を超えたら、発言の内容から決まる位置でも区切る (BOUNDARY_MODULUS を参照)。
+    戻り値: チャンクのテキストのリスト
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for turn in turns:
+        turn_tokens = estimate_tokens(turn) + 2
+        if current and current_tokens + turn_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(turn)
+        current_tokens += turn_tokens
+        if current_tokens >= max_tokens * BOUNDARY_MIN_RATIO and zlib.crc32(turn.encode("utf-8")) % BOUNDARY_MODULUS == 0:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _truncate_tokens(text, max_tokens):
+    """text を見積もりで max_tokens 以下になるよう行単位で切り詰める (1行目だけで超える場合は文字単位で切る)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    kept_tokens = 0
+    for line in text.splitlines():
+        line_tokens = estimate_tokens(line) + 1
+        if kept_tokens + line_tokens > max_tokens:
+            break
+        kept.append(line)
+        kept_tokens += line_tokens
+    if kept:
+        return "\n".join(kept)
+    # 見積もりは1文字あたり1トークン以下なので、max_tokens 文字までなら必ず収まる
+    return text[:max_tokens]
+
+
+def _group_parts(parts, max_tokens):
+    """
+    部分要約を、区切りを含めて max_tokens 以下のグループにまとめる。
+    どの2つも束ねられない場合は parts と同じ数のグループになる (呼び出し側で部分要約を短くしてから束ね直す)。
+    """
+    groups = []
+    current = []
+    current_tokens = 0
+    for part in parts:
+        part_tokens = estimate_tokens(part) + 2
+        if current and current_tokens + part_tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(part)
+        current_tokens += part_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _shorten_parts(summarizer, parts, max_tokens):
+    """
+    max_tokens の半分 (2つ束ねて収まる長さ) を超える部分要約を1つずつ要約し直し、それでも長いものは切り詰める。
+    戻り値の部分要約は、どれも2つ束ねれば max_tokens 以下になる (reduce が必ず数を減らせる)。
+    """
+    part_limit = max(1, max_tokens // 2 - 2) # _group_parts は部分要約ごとに区切りの分として2トークンを足す
+    long_parts = [i for i, part in enumerate(parts) if estimate_tokens(part) > part_limit]
+    print(f"Shortening {len(long_parts)} partial summaries that are too long to merge...")
+    # 1つだけで上限を超える部分要約は、プロンプトが上限を超えないよう切り詰めてから送る
+    shortened = await asyncio.gather(*[
+        summarizer.complete(SHORTEN_PROMPT.format(text=_truncate_tokens(parts[i], max_tokens))) for i in long_parts
+    ])
+    parts = list(parts)
+    n_truncated = 0
+    for i, part in zip(long_parts, shortened):
+        if estimate_tokens(part) > part_limit:
+            n_truncated += 1
+            part = _truncate_tokens(part, part_limit)
+        parts[i] = part
+    if n_truncated:
+        print(f"Warning: {n_truncated} partial summaries were still longer than {part_limit} tokens after shortening and were truncated.")
+    return parts
+
+
+class ChunkSummarizer:
+    """
+    チャット補完 API で文字起こしのチャンクを要約する。同時に送るリクエストは concurrency 件まで。
+    要約はプロンプト (モデル + 本文) の内容ハッシュをキーに result_cache に保存し、同じ内容は再送しない。
+    接続先は base_url (省略時は環境変数 OPENAI_BASE_URL) で変更できるので、ローカルのスタブサーバーでも動かせる。
+    """
+
+    def __init__(self, model=DEFAULT_SUMMARY_MODEL, concurrency=DEFAULT_SUMMARY_CONCURRENCY, cache=None,
+                 base_url=None, client=None, max_retries=DEFAULT_MAX_RETRIES, base_delay=1.0):
+        self.model = model
+        self.cache = cache
+        self.base_url = base_url
+        self.client = client
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.requests = 0
+        self.cache_hits = 0
+
+    def _get_client(self):
+        # 全てキャッシュから賄える場合は API キーが無くても動くよう、最初のリクエストまで作らない
+        if self.client is None:
+            from openai import AsyncOpenAI
+            # 再試行はこちらで制御するので、クライアント側の自動再試行は無効にする。
+            # ローカルのエンドポイントはキーを確認しないことが多いので、未設定ならダミーのキーを渡す
+            api_key = os.environ.get("OPENAI_API_KEY") or ("local" if self.base_url else None)
+            self.client = AsyncOpenAI(max_retries=0, base_url=self.base_url, api_key=api_key)
+        return self.client
+
+    def _cache_key(self, prompt):
+        digest = hashlib.sha256(json.dumps([SYSTEM_PROMPT, prompt], ensure_ascii=False).encode("utf-8")).hexdigest()
+        return ResultCache.make_key(digest, stage="summary", model=self.model)
+
+    async def complete(self, prompt):
+        """1件のプロンプトを要約して本文を返す。一時的なエラーは指数バックオフで再試行する"""
+        cache_key = self._cache_key(prompt)
+        if self.cache is not None:
+            cached = self.cache.get_json(cache_key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached['text']
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                try:
+                    self.requests += 1
+                    response = await self._get_client().chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": prompt},
+                        ],
+                    )
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self.base_delay * (2 ** attempt) * (1 + random.random())
+                    print(f"Summary request failed ({e}). Retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})...")
+            # 待っている間は同時実行の枠を他のプロンプトに譲る
+            await asyncio.sleep(delay)
+        text = (response.choices[0].message.content or "").strip()
+        if self.cache is not None:
+            self.cache.put_json(cache_key, {'text': text})
+        return text
+
+
+async def summarize_records_async(records, model=DEFAULT_SUMMARY_MODEL, chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                                  concurrency=DEFAULT_SUMMARY_CONCURRENCY, cache=None, base_url=None, client=None,
+                                  max_retries=DEFAULT_MAX_RETRIES, base_delay=1.0):
+    """
+    話者ラベル付きの文字起こし [(話者名, 開始秒, テキスト), ...] を map-reduce で要約する。
+    map: 話者の交代の位置で chunk_tokens 以下に分けたチャンクを、同時実行数を制限しながら並行して要約する。
+    reduce: 部分要約を chunk_tokens 以下のグループにまとめて要約し直すことを、1つになるまで繰り返す。
+            どの2つも束ねられないほど長い部分要約は、先に1つずつ短くする (上限を超えるプロンプトは送らない)。
+    戻り値: 要約のテキスト (文字起こしが空なら空文字列)
+    """
+    chunks = chunk_turns(group_turns(records, chunk_tokens), chunk_tokens)
+    if not chunks:
+        return ""
+    summarizer = ChunkSummarizer(model=model, concurrency=concurrency, cache=cache, base_url=base_url, client=client,
+                                 max_retries=max_retries, base_delay=base_delay)
+    print(f"Summarizing {len(chunks)} chunks with {model} (up to {chunk_tokens} tokens each, concurrency {concurrency})...")
+    parts = await asyncio.gather(*[summarizer.complete(MAP_PROMPT.format(text=chunk)) for chunk in chunks])
+    while len(parts) > 1:
+        groups = _group_parts(parts, chunk_tokens)
+        # 1つも束ねられない場合や、1つだけで上限を超える部分要約がある場合は、先に短くする
+        if len(groups) == len(parts) or any(estimate_tokens(part) + 2 > chunk_tokens for part in parts):
+            parts = await _shorten_parts(summarizer, parts, chunk_tokens)
+            groups = _group_parts(parts, chunk_tokens)
+        print(f"Merging {len(parts)} partial summaries in {len(groups)} requests...")
+        parts = await asyncio.gather(*[summarizer.complete(REDUCE_PROMPT.format(text=PART_SEPARATOR.join(group))) for group in groups])
+    print(f"Summary finished: {summarizer.requests} requests, {summarizer.cache_hits} loaded from cache.")
+    return parts[0]
+
+
+def summarize_records(records, **kwargs):
+    """summarize_records_async の同期版"""
+    return asyncio.run(summarize_records_async(records, **kwargs))
+
+
+def write_summary(path, summary):
+    """要約をファイルに書き出す (一時ファイルに書いてから置き換える)"""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf8", newline="\n") as f:
+            f.write(summary.rstrip() + "\n")
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def add_summary_arguments(parser, flag=True):
+    """要約のコマンドライン引数を argparse のパーサーに追加する (flag=False なら --summarize を付けない)"""
+    if flag:
+        parser.add_argument("--summarize", action="store_true", help="After writing the transcript, summarize it with a chat model (map-reduce over speaker-turn chunks) and save it to '[output file].summary.md'.")
+    parser.add_argument("--summary-model", default=DEFAULT_SUMMARY_MODEL, help=f"Chat model used for the summary (default: {DEFAULT_SUMMARY_MODEL}).")
+    parser.add_argument("--summary-chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS, help=f"Maximum estimated tokens of transcript per summary request (default: {DEFAULT_CHUNK_TOKENS}). Chunks always end at a speaker turn.")
+    parser.add_argument("--summary-concurrency", type=int, default=DEFAULT_SUMMARY_CONCURRENCY, help=f"Maximum number of concurrent summary requests (default: {DEFAULT_SUMMARY_CONCURRENCY}).")
+    parser.add_argument("--summary-base-url", default=None, help="Base URL of an OpenAI-compatible chat endpoint for the summary, e.g. http://127.0.0.1:8766/v1 for llm_stub_server.py (default: OPENAI_BASE_URL or the OpenAI API).")
+
+
+def summary_options_from_args(args):
+    """add_summary_arguments で追加した引数から summarize_records に渡すオプションを作る (--summarize が無ければ None)"""
+    if not getattr(args, "summarize", True):
+        return None
+    return {
+        'model': args.summary_model,
+        'chunk_tokens': args.summary_chunk_tokens,
+        'concurrency': args.summary_concurrency,
+        'base_url': args.summary_base_url,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a diarized transcript (.json or .jsonl written with --formats) with a chat model, map-reduce style.")
+    parser.add_argument("transcript", help="Transcript written by transcription.py with --formats json or jsonl.")
+    parser.add_argument("-o", "--output", default=None, help="Path of the summary. Defaults to '[transcript].summary.md'.")
+    add_summary_arguments(parser, flag=False)
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write cached chunk summaries.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"Directory of the result cache (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum size of the result cache in MB (default: {DEFAULT_CACHE_MAX_MB}).")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.transcript):
+        print(f"Error: {args.transcript} not found.")
+        sys.exit(1)
+    if not args.transcript.endswith((".json", ".jsonl")):
+        parser.error("the transcript must be a .json or .jsonl file.")
+    if args.summary_chunk_tokens < 100 or args.summary_concurrency < 1:
+        parser.error("--summary-chunk-tokens must be >= 100 and --summary-concurrency >= 1.")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    cache = None if args.no_cache else ResultCache(cache_dir=args.cache_dir, max_mb=args.cache_max_mb)
+    output_path = args.output or summary_path(args.transcript)
+    try:
+        summary = summarize_records(load_transcript_records(args.transcript), cache=cache, **summary_options_from_args(args))
+    except Exception as e:
+        print(f"Error summarizing {args.transcript}: {e}")
+        sys.exit(1)
+    write_summary(output_path, summary)
+    print(f"Summary saved to {output_path}")
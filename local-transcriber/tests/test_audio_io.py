@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from audio_io import decode_audio, decode_audio_parallel, ffmpeg_available
+
+pytestmark = pytest.mark.skipif(not ffmpeg_available(), reason="ffmpeg is required")
+
+
+@pytest.fixture(scope="module")
+def tone_file(tmp_path_factory):
+    """10分間の 44.1kHz のチャープ (区間の境界がずれれば波形が一致しなくなる)"""
+    path = str(tmp_path_factory.mktemp("audio") / "tone.wav")
+    subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-f", "lavfi", "-i", "aevalsrc=0.5*sin(2*PI*(200+t)*t):s=44100:d=600",
+                    "-y", path], check=True)
+    return path
+
+
+@pytest.mark.parametrize("total_duration,workers", [(600.0, 4), (600.0, 1), (None, 4), (None, 1)])
+def test_parallel_decode_matches_decode_audio(tone_file, total_duration, workers):
+    expected = decode_audio(tone_file)
+    np.testing.assert_array_equal(decode_audio_parallel(tone_file, total_duration, workers=workers), expected)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_parallel_decode_writes_into_one_buffer(tone_file, workers):
+    # 長さが分かっていれば、1区間でも全体を別に受け取って連結せず、確保した配列に直接書き込む
+    tracemalloc.start()
+    try:
+        samples = decode_audio_parallel(tone_file, 600.0, workers=workers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1.5 * samples.nbytes
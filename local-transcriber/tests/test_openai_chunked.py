@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import types
+
+import numpy as np
+import pytest
+
+from audio_io import SAMPLE_RATE
+from openai_chunked import (find_chunk_boundaries, merge_chunk_responses, transcribe_chunked_async, _retry_delay,
+                            WAV_HEADER_BYTES)
+import transcription_stub_server
+
+
+def make_speech(seconds, gap_every=7.0, gap_sec=0.5, seed=0):
+    """gap_every 秒ごとに gap_sec 秒の無音を挟んだ雑音 (発話の代わり)"""
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(int(seconds * SAMPLE_RATE)) * 0.1).astype(np.float32)
+    for start in np.arange(gap_every, seconds, gap_every):
+        samples[int(start * SAMPLE_RATE):int((start + gap_sec) * SAMPLE_RATE)] = 0.0
+    return samples
+
+
+@pytest.fixture
+def stub_server():
+    """スタブの文字起こしサーバーを空いているポートで起動し、(server, base_url) を返す"""
+    servers = []
+
+    def start(**options):
+        server = transcription_stub_server.make_server("127.0.0.1", 0, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_find_chunk_boundaries_cover_audio_and_cut_in_silence():
+    samples = make_speech(100.0)
+    max_chunk_sec = 16.0
+    boundaries = find_chunk_boundaries(samples, max_chunk_sec)
+    assert boundaries[0][0] == 0
+    assert boundaries[-1][1] == len(samples)
+    for (_, end), (next_start, _) in zip(boundaries, boundaries[1:]):
+        assert end == next_start
+        # 区切りは無音の区間の中
+        assert samples[end] == 0.0
+    assert all(end - start <= max_chunk_sec * SAMPLE_RATE for start, end in boundaries)
+
+
+def test_find_chunk_boundaries_short_audio_is_one_chunk():
+    samples = make_speech(10.0)
+    assert find_chunk_boundaries(samples, 16.0) == [(0, len(samples))]
+
+
+def test_merge_chunk_responses_offsets_segments():
+    responses = [
+        {'text': " first ", 'language': None, 'duration': 10.0,
+         'segments': [{'id': 0, 'start': 0.0, 'end': 4.0, 'text': "a"}, {'id': 1, 'start': 4.0, 'end': 10.0, 'text': "b"}]},
+        {'text': "second", 'language': "japanese", 'duration': 5.5,
+         'segments': [{'id': 0, 'start': 0.5, 'end': 5.5, 'text': "c"}]},
+    ]
+    merged = merge_chunk_responses(responses, [0.0, 10.0])
+    assert merged['text'] == "first second"
+    assert merged['language'] == "japanese"
+    assert merged['duration'] == pytest.approx(15.5)
+    assert [segment['id'] for segment in merged['segments']] == [0, 1, 2]
+    assert [(segment['start'], segment['end']) for segment in merged['segments']] == [(0.0, 4.0), (4.0, 10.0), (10.5, 15.5)]
+    # 元の応答は書き換えない
+    assert responses[1]['segments'][0]['start'] == 0.5
+
+
+def test_retry_delay_prefers_retry_after_header():
+    error = types.SimpleNamespace(response=types.SimpleNamespace(headers={'retry-after': "3"}))
+    assert _retry_delay(error, attempt=0, base_delay=100.0) == 3.0
+    no_header = types.SimpleNamespace(response=types.SimpleNamespace(headers={}))
+    assert 2.0 <= _retry_delay(no_header, attempt=1, base_delay=1.0) <= 4.0
+    assert 1.0 <= _retry_delay(ConnectionError(), attempt=0, base_delay=1.0) <= 2.0
+
+
+@pytest.mark.parametrize("fail_status, base_delay", [
+    # 429 は Retry-After (0秒) に従うので、base_delay が長くてもすぐに再試行する
+    (429, 60.0),
+    # 503 には Retry-After が無いので指数バックオフ
+    (503, 0.01),
+])
+def test_transcribe_chunked_retries_within_concurrency(stub_server, fail_status, base_delay):
+    openai = pytest.importorskip("openai")
+    concurrency = 2
+    server, base_url = stub_server(delay=0.05, fail_first=1, fail_status=fail_status, retry_after=0)
+    samples = make_speech(100.0)
+    max_chunk_mb = (16.0 * SAMPLE_RATE * 2 + WAV_HEADER_BYTES) / (1024 * 1024)
+    client = openai.AsyncOpenAI(base_url=base_url, api_key="dummy", max_retries=0)
+
+    merged = asyncio.run(asyncio.wait_for(transcribe_chunked_async(
+        samples, max_chunk_mb=max_chunk_mb, concurrency=concurrency, max_retries=2, base_delay=base_delay, client=client
+    ), timeout=30))
+
+    handler = server.RequestHandlerClass
+    n_chunks = len(find_chunk_boundaries(samples, 16.0))
+    assert n_chunks > concurrency
+    # どのチャンクも1回失敗してから成功している
+    assert sorted(handler.attempts.values()) == [2] * n_chunks
+    assert handler.requests == 2 * n_chunks
+    assert 1 < handler.max_in_flight <= concurrency
+
+    starts = np.array([segment['start'] for segment in merged['segments']])
+    ends = np.array([segment['end'] for segment in merged['segments']])
+    assert np.all(np.diff(starts) > 0)
+    assert np.all(ends > starts)
+    assert np.all(ends[:-1] <= starts[1:] + 1e-3)
+    assert merged['duration'] == pytest.approx(len(samples) / SAMPLE_RATE, abs=1e-3)
+    assert ends[-1] == pytest.approx(merged['duration'], abs=1e-3)
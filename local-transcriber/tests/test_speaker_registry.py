@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+import pytest
+
+import speaker_registry
+from speaker_registry import SpeakerRegistry
+
+
+def test_enroll_and_remove_round_trip(tmp_path):
+    registry = SpeakerRegistry(str(tmp_path))
+    rng = np.random.default_rng(0)
+    registry.enroll("Tanaka", rng.random((3, 256)))
+    registry.enroll("Suzuki", rng.random((2, 256)))
+    assert isinstance(registry.embeddings, np.memmap)
+    assert SpeakerRegistry(str(tmp_path)).speakers() == {'Tanaka': 3, 'Suzuki': 2}
+
+    assert registry.remove("Tanaka") == 3
+    assert registry.speakers() == {'Suzuki': 2}
+    assert SpeakerRegistry(str(tmp_path)).speakers() == {'Suzuki': 2}
+    assert sorted(os.listdir(tmp_path)) == ["embeddings.npy", "speakers.json"]
+
+
+def test_failed_save_keeps_registry(tmp_path, monkeypatch):
+    registry = SpeakerRegistry(str(tmp_path))
+    registry.enroll("Tanaka", np.random.default_rng(0).random((3, 256)))
+    before = np.array(registry.embeddings)
+
+    def failing_save(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(speaker_registry.np, "save", failing_save)
+    with pytest.raises(OSError):
+        registry.enroll("Suzuki", np.ones(256))
+    monkeypatch.undo()
+
+    # メモリ上もディスク上も元のまま (一時ファイルも残らない)
+    assert registry.speakers() == {'Tanaka': 3}
+    np.testing.assert_array_equal(np.asarray(registry.embeddings), before)
+    assert SpeakerRegistry(str(tmp_path)).speakers() == {'Tanaka': 3}
+    assert sorted(os.listdir(tmp_path)) == ["embeddings.npy", "speakers.json"]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import llm_stub_server
+import summarize
+from result_cache import ResultCache
+from summarize import (estimate_tokens, group_turns, chunk_turns, _group_parts, summarize_records, summarize_records_async,
+                       MAP_PROMPT, REDUCE_PROMPT, SHORTEN_PROMPT, PART_SEPARATOR)
+
+SPEAKERS = ["Speaker_0", "Speaker_1", "営業部の山田部長と鈴木課長"]
+
+
+def make_records(n, seed=0, long_every=0):
+    """話者が入れ替わる文字起こし。long_every ごとに1つ、非常に長い発言 (1セグメント) を混ぜる"""
+    rng = random.Random(seed)
+    records = []
+    speaker = SPEAKERS[0]
+    for i in range(n):
+        if rng.random() < 0.4:
+            speaker = rng.choice(SPEAKERS)
+        if long_every and i % long_every == long_every - 1:
+            text = "とても長い発言です。" * 400
+        elif rng.random() < 0.5:
+            text = f"発言 {i}: " + "今日の議題について確認します。" * rng.randint(1, 6)
+        else:
+            text = f"Line {i}: " + "we should ship the release next week. " * rng.randint(1, 6)
+        records.append((speaker, i * 5.0, text))
+    return records
+
+
+def body(prompt):
+    """プロンプトから本文 ({text} の部分) を取り出す"""
+    for template in (MAP_PROMPT, REDUCE_PROMPT, SHORTEN_PROMPT):
+        prefix = template.split("{text}")[0]
+        if prompt.startswith(prefix):
+            return prompt[len(prefix):]
+    raise AssertionError("unknown prompt")
+
+
+@pytest.mark.parametrize("max_tokens", [24, 40, 100, 300, 3000])
+def test_chunks_never_exceed_chunk_tokens(max_tokens):
+    records = make_records(300, long_every=50)
+    turns = group_turns(records, max_tokens)
+    assert all(estimate_tokens(turn) <= max_tokens for turn in turns)
+    chunks = chunk_turns(turns, max_tokens)
+    assert all(estimate_tokens(chunk) <= max_tokens for chunk in chunks)
+    # 長い発言は途中で分けても、本文は欠けずにすべて含まれる
+    assert "".join(chunks).count("。") == sum(text.count("。") for _, _, text in records)
+
+
+@pytest.mark.parametrize("max_tokens", [40, 300])
+def test_group_parts_fit_when_parts_fit_in_half(max_tokens):
+    rng = random.Random(1)
+    parts = ["- " + "あ" * rng.randint(1, max_tokens // 2 - 4) for _ in range(50)]
+    groups = _group_parts(parts, max_tokens)
+    assert sum(len(group) for group in groups) == len(parts)
+    assert len(groups) < len(parts)
+    assert all(estimate_tokens(PART_SEPARATOR.join(group)) <= max_tokens for group in groups)
+
+
+class VerboseSummarizer:
+    """要約を短くしない (入力と関係なく長い応答を返す) モデルの代わり"""
+
+    def __init__(self, reply_tokens, **kwargs):
+        self.reply_tokens = reply_tokens
+        self.prompts = []
+        self.requests = 0
+        self.cache_hits = 0
+
+    async def complete(self, prompt):
+        self.prompts.append(prompt)
+        self.requests += 1
+        return "- " + "あ" * self.reply_tokens
+
+
+@pytest.mark.parametrize("reply_tokens", [50, 900, 5000])
+def test_reduce_never_sends_prompt_over_chunk_tokens(monkeypatch, reply_tokens):
+    summarizers = []
+
+    def make_summarizer(**kwargs):
+        summarizers.append(VerboseSummarizer(reply_tokens))
+        return summarizers[-1]
+
+    monkeypatch.setattr(summarize, "ChunkSummarizer", make_summarizer)
+    records = make_records(400, long_every=40)
+    summary = asyncio.run(summarize_records_async(records, chunk_tokens=1000))
+    prompts = summarizers[0].prompts
+    assert summary
+    assert len(prompts) > len(chunk_turns(group_turns(records, 1000), 1000))
+    assert max(estimate_tokens(body(prompt)) for prompt in prompts) <= 1000
+
+
+def edit_record(records, index):
+    """index 番目の発言の冒頭の1文字を同じ長さの別の文字に変える"""
+    records = list(records)
+    speaker, start, text = records[index]
+    records[index] = (speaker, start, "X" + text[1:])
+    return records
+
+
+def first_of_turn(records, near):
+    """near 番目以降で、話者が替わって発言のまとまりが始まる位置"""
+    return next(i for i in range(near, len(records)) if records[i][0] != records[i - 1][0])
+
+
+def test_chunk_boundaries_are_stable_after_one_edit():
+    records = make_records(600, seed=3)
+    before = chunk_turns(group_turns(records, 800), 800)
+    after = chunk_turns(group_turns(edit_record(records, first_of_turn(records, 300)), 800), 800)
+    assert len(before) > 20
+    changed = set(after) - set(before)
+    # 変わるのは編集した発言を含むチャンク (と、区切りが元に戻るまでの直後のチャンク) だけ
+    assert 1 <= len(changed) <= 2
+    assert len(set(before) - set(after)) == len(changed)
+
+
+@pytest.fixture
+def llm_stub(monkeypatch):
+    """スタブの LLM サーバーを空いているポートで起動し、(受け取ったプロンプトのリスト, base_url) を返す"""
+    prompts = []
+    stub_summary = llm_stub_server.stub_summary
+
+    def recording_stub_summary(prompt):
+        prompts.append(prompt)
+        return stub_summary(prompt)
+
+    monkeypatch.setattr(llm_stub_server, "stub_summary", recording_stub_summary)
+    handler = type("Handler", (llm_stub_server.StubLLMRequestHandler,), {'log_message': lambda self, *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield prompts, f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_rerun_requests_only_changed_chunk(llm_stub, tmp_path):
+    pytest.importorskip("openai")
+    prompts, base_url = llm_stub
+    cache = ResultCache(cache_dir=str(tmp_path / "cache"))
+    records = make_records(600, seed=3)
+    options = {'chunk_tokens': 800, 'cache': cache, 'base_url': base_url, 'base_delay': 0.01}
+
+    first = summarize_records(records, **options)
+    n_chunks = len(chunk_turns(group_turns(records, 800), 800))
+    assert sum(prompt.startswith(MAP_PROMPT.split("{text}")[0]) for prompt in prompts) == n_chunks
+
+    # 同じ内容の再実行はすべてキャッシュから
+    prompts.clear()
+    assert summarize_records(records, **options) == first
+    assert prompts == []
+
+    # 1つの発言を直すと、そのチャンクの map と、それを含む reduce だけが送られる
+    # (スタブは発言の冒頭を要約に使うので、まとまりの最初の発言を直して部分要約も変わるようにする)
+    index = first_of_turn(records, 300)
+    summarize_records(edit_record(records, index), **options)
+    map_prompts = [prompt for prompt in prompts if prompt.startswith(MAP_PROMPT.split("{text}")[0])]
+    reduce_prompts = [prompt for prompt in prompts if prompt.startswith(REDUCE_PROMPT.split("{text}")[0])]
+    assert len(map_prompts) == 1
+    assert "X" + records[index][2][1:20] in map_prompts[0]
+    assert len(map_prompts) + len(reduce_prompts) == len(prompts)
+    # reduce は段ごとに (編集した部分を含むグループの) 1件だけ
+    assert 1 <= len(reduce_prompts) <= 3
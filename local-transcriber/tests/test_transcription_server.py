@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+import threading
+import time
+import types
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from transcription_server import TranscriptionService, create_server
+
+
+class FakeTranscription:
+    """process_audio_file の代わり。release が set されるまで待ってから、音声の中身を書き出す"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.started = []
+
+    def process_audio_file(self, audio_path, output_file, metrics_file=None, **kwargs):
+        self.started.append(audio_path)
+        assert self.release.wait(10)
+        with open(audio_path, "rb") as f:
+            data = f.read()
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write(f"@Speaker_0 [00:00]\n{data.decode('utf-8')}\n")
+        with open(metrics_file, "w", encoding="utf-8") as f:
+            json.dump({'stages': []}, f)
+        return {'status': 'ok', 'message': "done", 'metrics': {'stages': []}}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeTranscription()
+    module = types.ModuleType("transcription")
+    module.process_audio_file = fake.process_audio_file
+    monkeypatch.setitem(sys.modules, "transcription", module)
+    return fake
+
+
+@pytest.fixture
+def start_server(tmp_path, fake):
+    """サービスと HTTP サーバーを空いているポートで起動し、ベースURLを返す"""
+    started = []
+
+    def start(max_queue=8, keep_jobs=200, audio_root=None):
+        service = TranscriptionService(jobs_dir=str(tmp_path / "jobs"), concurrency=1, max_queue=max_queue, keep_jobs=keep_jobs)
+        service.start()
+        server = create_server(service, port=0, audio_root=audio_root)
+        server.RequestHandlerClass.log_message = lambda self, *args: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append((service, server))
+        return service, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    fake.release.set()
+    for service, server in started:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def request(method, url, body=None, content_type="application/octet-stream"):
+    """(ステータス, ヘッダー, 本文) を返す (エラーのステータスも例外にしない)"""
+    headers = {'Content-Type': content_type} if body is not None else {}
+    try:
+        with urlopen(Request(url, data=body, method=method, headers=headers), timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def upload(base_url, text, filename="audio.mp3"):
+    status, headers, body = request("POST", f"{base_url}/jobs?filename={filename}", text.encode("utf-8"))
+    return status, headers, json.loads(body)
+
+
+def wait_for(base_url, job_id, statuses, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = json.loads(request("GET", f"{base_url}/jobs/{job_id}")[2])
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not reach {statuses}")
+
+
+def test_submit_status_result(start_server):
+    service, base_url = start_server()
+    status, headers, job = upload(base_url, "hello")
+    assert status == 202
+    assert headers['Location'] == f"/jobs/{job['id']}"
+    assert job['status'] in ("queued", "running", "done")
+
+    job = wait_for(base_url, job['id'], ("done",))
+    assert job['result_url'] == f"/jobs/{job['id']}/result"
+    status, _, body = request("GET", base_url + job['result_url'])
+    assert status == 200
+    assert body.decode("utf-8") == "@Speaker_0 [00:00]\nhello\n"
+    assert json.loads(request("GET", f"{base_url}/jobs/{job['id']}/metrics")[2]) == {'stages': []}
+    # アップロードされた音声は完了後に削除される
+    assert not os.path.exists(os.path.join(service.jobs_dir, job['id'], "audio.mp3"))
+    assert request("GET", f"{base_url}/jobs/unknown")[0] == 404
+
+
+def test_full_queue_returns_429_and_cancel_frees_a_slot(start_server, fake):
+    fake.release.clear()
+    service, base_url = start_server(max_queue=2)
+    running = upload(base_url, "running")[2]
+    wait_for(base_url, running['id'], ("running",))
+    queued = [upload(base_url, f"queued {i}")[2] for i in range(2)]
+    assert [job['queue_position'] for job in queued] == [0, 1]
+
+    status, headers, body = upload(base_url, "rejected")
+    assert status == 429
+    assert int(headers['Retry-After']) >= 1
+    assert body['retry_after'] == int(headers['Retry-After'])
+
+    # 実行中のジョブは取り消せない
+    assert request("DELETE", f"{base_url}/jobs/{running['id']}")[0] == 409
+    status, _, body = request("DELETE", f"{base_url}/jobs/{queued[0]['id']}")
+    assert status == 200
+    assert json.loads(body)['status'] == "cancelled"
+    assert not os.path.exists(os.path.join(service.jobs_dir, queued[0]['id'], "audio.mp3"))
+    assert request("DELETE", f"{base_url}/jobs/{queued[0]['id']}")[0] == 409
+
+    # 取り消したジョブの分だけ待ち行列に空きができる
+    health = json.loads(request("GET", f"{base_url}/health")[2])
+    assert (health['queued'], health['running']) == (1, 1)
+    status, _, accepted = upload(base_url, "accepted")
+    assert status == 202
+    assert accepted['queue_position'] == 1
+    assert upload(base_url, "rejected again")[0] == 429
+
+    fake.release.set()
+    for job in (running, queued[1], accepted):
+        wait_for(base_url, job['id'], ("done",))
+    assert json.loads(request("GET", f"{base_url}/jobs/{queued[0]['id']}")[2])['status'] == "cancelled"
+    # 取り消したジョブは処理されない
+    assert len(fake.started) == 3
+    assert json.loads(request("GET", f"{base_url}/health")[2])['queued'] == 0
+
+
+def test_old_jobs_are_evicted(start_server):
+    service, base_url = start_server(keep_jobs=2)
+    jobs = []
+    for i in range(4):
+        jobs.append(upload(base_url, f"job {i}")[2])
+        wait_for(base_url, jobs[-1]['id'], ("done",))
+    for job in jobs[:2]:
+        assert request("GET", f"{base_url}/jobs/{job['id']}")[0] == 404
+        assert not os.path.exists(os.path.join(service.jobs_dir, job['id']))
+    for job in jobs[2:]:
+        assert request("GET", f"{base_url}/jobs/{job['id']}/result")[0] == 200
+
+
+def submit_path(base_url, audio_path):
+    status, _, body = request("POST", f"{base_url}/jobs", json.dumps({'audio_path': audio_path}).encode("utf-8"),
+                              content_type="application/json")
+    return status, json.loads(body)
+
+
+def test_audio_path_jobs_are_restricted(start_server, tmp_path):
+    root = tmp_path / "audio"
+    root.mkdir()
+    (root / "inside.mp3").write_text("inside")
+    (tmp_path / "secret.txt").write_text("secret")
+    os.symlink(tmp_path / "secret.txt", root / "link.mp3")
+
+    # --audio-root を指定しなければパス指定のジョブは受け付けない
+    _, base_url = start_server()
+    assert submit_path(base_url, str(root / "inside.mp3"))[0] == 403
+
+    _, base_url = start_server(audio_root=str(root))
+    for path in (str(tmp_path / "secret.txt"), "../secret.txt", str(root / "link.mp3")):
+        status, body = submit_path(base_url, path)
+        assert status == 403, path
+        assert "--audio-root" in body['error']
+    assert submit_path(base_url, "missing.mp3")[0] == 400
+    for path in (str(root / "inside.mp3"), "inside.mp3"):
+        status, job = submit_path(base_url, path)
+        assert status == 202
+        job = wait_for(base_url, job['id'], ("done",))
+        assert "inside" in request("GET", base_url + job['result_url'])[2].decode("utf-8")
+        # パス指定のジョブは元のファイルを削除しない
+        assert (root / "inside.mp3").exists()
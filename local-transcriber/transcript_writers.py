@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+# 出力できる形式 (txt はこれまでどおりの "@Speaker_N [m:ss]" 形式)
+OUTPUT_FORMATS = ("txt", "srt", "vtt", "json", "jsonl")
+DEFAULT_FORMATS = ("txt",)
+# HTTP で返すときの Content-Type
+CONTENT_TYPES = {
+    'txt': "text/plain; charset=utf-8",
+    'srt': "application/x-subrip; charset=utf-8",
+    'vtt': "text/vtt; charset=utf-8",
+    'json': "application/json; charset=utf-8",
+    'jsonl': "application/x-ndjson; charset=utf-8",
+}
+
+
+def parse_formats(value):
+    """"txt,srt,vtt" のようなカンマ区切りの指定を検証して形式のタプルにする (不正な形式は ValueError)"""
+    formats = tuple(dict.fromkeys(name.strip().lower() for name in value.split(",") if name.strip()))
+    unknown = [name for name in formats if name not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        raise ValueError(f"Unknown output format: {', '.join(unknown) or value!r} (choose from {', '.join(OUTPUT_FORMATS)})")
+    return formats
+
+
+def transcript_paths(output_file, formats=DEFAULT_FORMATS):
+    """
+    形式ごとの出力先を返す。txt は output_file そのもの、それ以外は output_file の拡張子を形式名に置き換えたパス。
+    戻り値: {形式: パス}
+    """
+    base = os.path.splitext(output_file)[0]
+    paths = {name: output_file if name == "txt" else f"{base}.{name}" for name in formats}
+    if len(set(paths.values())) != len(paths):
+        raise ValueError(f"Output paths for {', '.join(formats)} collide; give the output file a .txt extension.")
+    return paths
+
+
+def format_clock(seconds):
+    """txt 用の時刻 (1時間未満は m:ss、それ以上は h:mm:ss)"""
+    total = int(seconds)
+    hours, rest = divmod(total, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{secs:02}"
+    return f"{minutes}:{secs:02}"
+
+
+def format_cue_time(seconds, separator):
+    """字幕用の時刻 (HH:MM:SS,mmm / HH:MM:SS.mmm)。separator は SRT なら ","、WebVTT なら "." """
+    total_ms = max(int(round(seconds * 1000)), 0)
+    hours, rest = divmod(total_ms, 3600 * 1000)
+    minutes, rest = divmod(rest, 60 * 1000)
+    secs, ms = divmod(rest, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02}{separator}{ms:03}"
+
+
+def _cue_text(text):
+    # 空行は字幕ブロックの区切りとみなされるので、テキスト内の改行は空行を作らない形にそろえる
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+class SegmentWriter:
+    """1形式分の書き出し。セグメントは write_segment で1件ずつ受け取り、ファイル (f) に直接書く"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write_segment(self, speaker, start, end, text):
+        raise NotImplementedError
+
+    def close(self):
+        """全セグメントを書き終えたときに呼ぶ (閉じ括弧などが必要な形式用)"""
+
+
+class TextTranscriptWriter(SegmentWriter):
+    """従来の "@話者 [時刻]" + 本文の形式。セグメントの間は空行で区切る"""
+
+    def write_segment(self, speaker, start, end, text):
+        if self.count:
+            self.f.write("\n")
+        self.f.write(f"@{speaker} [{format_clock(start)}]\n{text}\n")
+        self.count += 1
+
+
+class SrtTranscriptWriter(SegmentWriter):
+    """SubRip (.srt) 字幕。話者名は本文の先頭に "話者: " として付ける (本文の "-->" は時刻行と誤認されないよう "->" にする)"""
+
+    def write_segment(self, speaker, start, end, text):
+        self.count += 1
+        self.f.write(f"{self.count}\n{format_cue_time(start, ',')} --> {format_cue_time(max(end, start), ',')}\n"
+                     f"{speaker}: {_cue_text(text).replace('-->', '->')}\n\n")
+
+
+class VttTranscriptWriter(SegmentWriter):
+    """WebVTT (.vtt) 字幕。話者名は <v 話者> の声タグで付け、本文の & < > はエスケープする"""
+
+    def __init__(self, f):
+        super().__init__(f)
+        self.f.write("WEBVTT\n\n")
+
+    @staticmethod
+    def _escape(text):
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    def write_segment(self, speaker, start, end, text):
+        self.f.write(f"{format_cue_time(start, '.')} --> {format_cue_time(max(end, start), '.')}\n"
+                     f"<v {self._escape(speaker)}>{self._escape(_cue_text(text))}\n\n")
+        self.count += 1
+
+
+class JsonTranscriptWriter(SegmentWriter):
+    """
+    {"audio_file": ..., "segments": [{"start", "end", "speaker", "text"}, ...]} の JSON。
+    セグメントは届いた順に1件ずつ書き出し、全体をメモリ上に組み立てない。
+    """
+
+    def __init__(self, f, audio_file=None):
+        super().__init__(f)
+        self.f.write('{"audio_file": ' + json.dumps(audio_file, ensure_ascii=False) + ', "segments": [')
+
+    def write_segment(self, speaker, start, end, text):
+        item = json.dumps({'start': round(start, 3), 'end': round(end, 3), 'speaker': speaker, 'text': text}, ensure_ascii=False)
+        self.f.write(("," if self.count else "") + "\n  " + item)
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]}\n" if self.count else "]}\n")
+
+
+class JsonlTranscriptWriter(SegmentWriter):
+    """1行に1セグメントの JSON Lines (検索インデックスなどへの取り込み用)"""
+
+    def write_segment(self, speaker, start, end, text):
+        self.f.write(json.dumps({'start': round(start, 3), 'end': round(end, 3), 'speaker': speaker, 'text': text}, ensure_ascii=False) + "\n")
+        self.count += 1
+
+
+class TranscriptWriters:
+    """
+    ラベル付きのセグメントを、指定した全ての形式のファイルへ1件ずつ同時に書き出す。
+    各ファイルは一時ファイルに書き、全て書き終えたら置き換える (途中で失敗した場合は一時ファイルを消し、既存の出力は残す)。
+
+    with TranscriptWriters(output_file, ("txt", "srt")) as writers:
+        writers.write_segment("Speaker_0", 0.0, 2.5, "こんにちは")
+    """
+
+    def __init__(self, output_file, formats=DEFAULT_FORMATS, audio_file=None):
+        self.paths = transcript_paths(output_file, formats)
+        self.audio_file = audio_file
+        self._files = {}
+        self._writers = {}
+        self.count = 0
+
+    def _make_writer(self, name, f):
+        if name == "txt":
+            return TextTranscriptWriter(f)
+        if name == "srt":
+            return SrtTranscriptWriter(f)
+        if name == "vtt":
+            return VttTranscriptWriter(f)
+        if name == "json":
+            return JsonTranscriptWriter(f, audio_file=self.audio_file)
+        return JsonlTranscriptWriter(f)
+
+    def __enter__(self):
+        try:
+            for name, path in self.paths.items():
+                tmp_path = path + ".tmp"
+                f = open(tmp_path, "w", encoding="utf8", newline="\n")
+                self._files[name] = (f, tmp_path)
+                self._writers[name] = self._make_writer(name, f)
+        except Exception:
+            self._discard()
+            raise
+        return self
+
+    def write_segment(self, speaker, start, end, text):
+        for writer in self._writers.values():
+            writer.write_segment(speaker, start, end, text)
+        self.count += 1
+
+    def _discard(self):
+        for f, tmp_path in self._files.values():
+            f.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._files.clear()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._discard()
+            return False
+        try:
+            for name, writer in self._writers.items():
+                writer.close()
+                f, tmp_path = self._files[name]
+                f.close()
+                os.replace(tmp_path, self.paths[name])
+        except Exception:
+            self._discard()
+            raise
+        return False
+
+
+def write_segments(writer, segments):
+    """
+    話者ラベル付きの SegmentTable を1行ずつ writer (TranscriptWriters または各形式の SegmentWriter) に渡す。
+    出力全体の文字列は作らないので、セグメント数が増えてもメモリ使用量は増えない。
+    """
+    labels = segments.labels.tolist() if segments.labels is not None else [-1] * len(segments)
+    speakers = {label: segments.speaker_name(label) for label in set(labels)}
+    for label, start, end, text in zip(labels, segments.start.tolist(), segments.end.tolist(), segments.text):
+        writer.write_segment(speakers[label], start, end, text)
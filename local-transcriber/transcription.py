@@ -1,36 +1,59 @@
 # -*- coding: utf-8 -*-
-import whisper
-from resemblyzer import VoiceEncoder, preprocess_wav
-from sklearn.cluster import DBSCAN
-from pydub import AudioSegment
 import numpy as np
-import torch
 import os
 import json
 import argparse
-from openai import OpenAI
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import sys
 from dotenv import load_dotenv
+from speaker_embedding import embed_segments_batched, embed_sliding_windows, pool_window_embeddings, DEFAULT_EMBEDDING_BATCH_SIZE
+from streaming import stream_transcribe_and_embed, DEFAULT_WINDOW_SEC, DEFAULT_OVERLAP_SEC
+from audio_io import AudioBuffer, ffmpeg_available, SAMPLE_RATE, DEFAULT_DECODE_WORKERS, MIN_DECODE_RANGE_SEC
+from openai_chunked import transcribe_chunked, DEFAULT_MAX_CHUNK_MB, DEFAULT_CONCURRENCY
+from result_cache import ResultCache, file_digest, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_MB
+from clustering import cluster_embeddings, add_clustering_arguments, clustering_options_from_args
+from speaker_registry import SpeakerRegistry, DEFAULT_REGISTRY_DIR, DEFAULT_MATCH_THRESHOLD
+from vad import transcribe_speech_only, DEFAULT_PAD_SEC
+from segment_table import SegmentTable, SEGMENT_TABLE_VERSION
+from speaker_turns import smooth_labels, find_turns, assign_turns, DEFAULT_MIN_TURN_SEC, DEFAULT_TURN_SMOOTHING
+from transcript_writers import TranscriptWriters, write_segments, parse_formats, transcript_paths, OUTPUT_FORMATS, DEFAULT_FORMATS
+from summarize import summarize_records, transcript_records, write_summary, summary_path, add_summary_arguments, summary_options_from_args
+from checkpoint import PipelineCheckpoint, default_checkpoint_dir, DEFAULT_CHECKPOINT_EVERY
+import instrumentation
+from instrumentation import PipelineProfiler, default_metrics_path, STAGES
+from model_manager import (get_whisper_model, get_voice_encoder, set_torch_threads, add_whisper_arguments, inference_lock,
+                           DEFAULT_WHISPER_MODEL, DEFAULT_COMPUTE_TYPE)
 
 # .env ファイルから環境変数を読み込む
 load_dotenv()
 
-# GPUが利用可能なら設定
-device = "cuda" if torch.cuda.is_available() else "cpu"
-# ローカルモデルとエンコーダーは必要に応じて初期化
+# 使用するデバイス (None なら最初のモデル読み込み時に、GPUが利用可能かどうかで決める)
+device = None
+# ローカルモデルとエンコーダーは必要に応じて初期化 (torch / whisper / resemblyzer の import もその時点まで遅らせる)
 whisper_model = None
 encoder = None
 openai_client = None
+# 結果キャッシュ (--no-cache 指定時は None)
+result_cache = None
+# 登録話者のレジストリ (--speaker-registry 指定時のみ)。一致したクラスタは Speaker_N の代わりに名前で出力する
+speaker_registry = None
+match_threshold = DEFAULT_MATCH_THRESHOLD
+# ローカルWhisperのモデルサイズと計算精度 (--whisper-model / --compute-type で変更)
+whisper_model_name = DEFAULT_WHISPER_MODEL
+whisper_compute_type = DEFAULT_COMPUTE_TYPE
+# デコードに使うffmpegのプロセス数 (--decode-workers で変更。2以上なら時間区間ごとに並列にデコードする)
+decode_workers = DEFAULT_DECODE_WORKERS
+OPENAI_MODEL_NAME = "whisper-1"
 
 def initialize_local_models(require_whisper=True, require_encoder=True):
-    """ローカル処理に必要なモデルを初期化する"""
+    """ローカル処理に必要なモデルを初期化する (読み込み済みのモデルは model_manager で使い回す)"""
     global whisper_model, encoder
     if require_whisper and whisper_model is None:
-        print("Initializing local Whisper model...")
-        whisper_model = whisper.load_model("large", device=device)
+        whisper_model = get_whisper_model(whisper_model_name, device=device, compute_type=whisper_compute_type)
     if require_encoder and encoder is None:
-        print("Initializing local VoiceEncoder model...")
-        encoder = VoiceEncoder(device=device)
+        encoder = get_voice_encoder(device=device)
 
 def initialize_openai_client():
     """OpenAI APIクライアントを初期化する"""
@@ -38,6 +61,7 @@ def initialize_openai_client():
     if openai_client is None:
         print("Initializing OpenAI client...")
         try:
+            from openai import OpenAI
             openai_client = OpenAI()
             openai_client.models.list()
             print("OpenAI client initialized successfully.")
@@ -47,104 +71,203 @@ def initialize_openai_client():
             openai_client = None
             raise
 
-def convert_mp3_to_wav(mp3_path, wav_path):
-    """pydubを使ってMP3ファイルをWAVに変換する"""
-    print("Starting MP3 to WAV conversion...")
-    audio = AudioSegment.from_mp3(mp3_path)
-    # Resemblyzerが必要とする16kHzモノラルに変換
-    audio = audio.set_frame_rate(16000).set_channels(1)
-    audio.export(wav_path, format="wav")
-    print(f"Finished conversion: {mp3_path} -> {wav_path} (16kHz Mono)")
-
-
-def diarize_with_resemblyzer(segments, wav_path):
+def diarize_with_resemblyzer(segments, audio, embedding_batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, clustering_options=None,
+                             audio_digest=None, checkpoint=None, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
     """
-    与えられたセグメント情報とWAVファイルパスに基づき、Resemblyzerで話者分離を行う。
-    話者ラベル付きのフォーマットされた文字列を返す。
+    文字起こし結果 (SegmentTable) とデコード済み音声 (AudioBuffer) に基づき、Resemblyzerで話者分離を行う。
+    埋め込みは複数セグメント分をまとめてバッチ処理で計算する。
+    audio_digest が指定され、キャッシュが有効な場合は埋め込み行列をキャッシュから読み書きする。
+    checkpoint (PipelineCheckpoint) を指定すると checkpoint_every セグメントごとに計算済みの埋め込みを保存し、
+    保存済みの埋め込みがあればその続きから計算する。
+    話者ラベル付きの SegmentTable (label_speakers の戻り値) を返す。失敗した場合はメッセージの文字列を返す。
     """
+    cache_key = None
+    if result_cache is not None and audio_digest:
+        cache_key = result_cache.make_key(
+            audio_digest, stage="embeddings", encoder="resemblyzer",
+            spans=np.column_stack([segments.start, segments.end]).tolist()
+        )
+        cached = result_cache.get_arrays(cache_key)
+        if cached is not None:
+            print(f"Loaded {len(cached['embeddings'])} speaker embeddings from cache.")
+            # segments.index は昇順なので、キャッシュの元インデックスから行の位置を二分探索で求める
+            valid_segments = segments.take(np.searchsorted(segments.index, cached['original_index']))
+            return label_speakers(valid_segments, cached['embeddings'], clustering_options=clustering_options)
+
     initialize_local_models(require_whisper=False, require_encoder=True) # Encoderのみ必要
+    from resemblyzer import preprocess_wav
 
-    print(f"Performing speaker diarization using Resemblyzer on {wav_path}...")
+    print(f"Performing speaker diarization using Resemblyzer on {audio.path}...")
     try:
-        wav = preprocess_wav(wav_path)
+        # Whisperと同じデコード済み配列を使う (16kHzなのでリサンプリングは行われない)
+        samples = audio.samples
+        with instrumentation.stage("embed"):
+            wav = preprocess_wav(samples, source_sr=16000)
     except Exception as e:
-        print(f"Error preprocessing WAV file {wav_path}: {e}")
+        print(f"Error preprocessing audio {audio.path}: {e}")
         return "Error during audio preprocessing for diarization."
 
-    speaker_embeddings = []
-    valid_segments = [] # Embedding抽出に成功したセグメントのみを保持
+    # 全セグメントのサンプル範囲をまとめて求め、短すぎるセグメントは埋め込みの対象から外す
+    all_spans = segments.sample_spans(n_samples=len(wav))
+    embeddable = all_spans[:, 1] - all_spans[:, 0] >= 160 # 短すぎるセグメントはエンコーダーがエラーを出すことがある (0.01秒)
+    for i in segments.index[~embeddable].tolist():
+        print(f"Segment {i+1} is too short, skipping embedding extraction.")
+    # 元のセグメント情報も保持しておく（クラスタリング結果と対応付けるため）
+    valid_segments = segments.take(embeddable)
+    spans = all_spans[embeddable]
 
-    print("Extracting speaker embeddings for each segment...")
-    total_segments = len(segments)
-    for i, segment in enumerate(segments):
-        # start, end, text を取得 (オブジェクトか辞書かで分岐)
-        try:
-            if isinstance(segment, dict):
-                start = segment.get('start', 0)
-                end = segment.get('end', 0)
-                text = segment.get('text', '').strip()
-            else: # TranscriptionSegment オブジェクトと仮定
-                start = segment.start
-                end = segment.end
-                text = segment.text.strip()
-        except AttributeError:
-            print(f"Warning: Segment {i+1}/{total_segments} has unexpected format. Skipping.")
-            continue
-
-        print(f"Processing segment {i+1}/{total_segments} (time {start:.2f} - {end:.2f} sec)...")
-        segment_wav = wav[int(start * 16000):int(end * 16000)]
-
-        if len(segment_wav) < 160: # 短すぎるセグメントはエンコーダーがエラーを出すことがある (0.01秒)
-            print(f"Segment {i+1} is too short, skipping embedding extraction.")
-            # このセグメントを結果に残すかどうかの判断が必要。ここでは残すがEmbeddingはNoneとするか？
-            # または結果から除外するか。一旦除外する方針で実装。
-            continue # embeddingに追加せず、valid_segmentsにも追加しない
+    print(f"Extracting speaker embeddings for {len(spans)} segments (batch size {embedding_batch_size})...")
+    try:
+        embedding_blocks = []
+        done = 0
+        if checkpoint is not None and checkpoint.state.get('stage') == "embedding":
+            saved = checkpoint.load_arrays()
+            if saved is not None and 'partial_embeddings' in saved and len(saved['partial_embeddings']) <= len(spans):
+                embedding_blocks.append(saved['partial_embeddings'])
+                done = len(saved['partial_embeddings'])
+                print(f"Resuming speaker embedding at segment {done}/{len(spans)}.")
+        # チェックポイントを書かない場合は全セグメントを一度に計算する
+        step = checkpoint_every if checkpoint is not None else max(len(spans), 1)
+        for chunk_start in range(done, len(spans), step):
+            chunk_spans = spans[chunk_start:chunk_start + step]
+            with inference_lock, instrumentation.stage("embed", segments=len(chunk_spans)):
+                embedding_blocks.append(embed_segments_batched(encoder, wav, chunk_spans, batch_size=embedding_batch_size))
+            if checkpoint is not None:
+                # 文字起こし結果と同じファイルに、ここまでの埋め込みを加えて保存する
+                checkpoint.save(arrays=dict(segments.to_arrays(), partial_embeddings=np.concatenate(embedding_blocks)), stage="embedding")
+                print(f"Checkpoint saved: {chunk_start + len(chunk_spans)}/{len(spans)} segments embedded.")
+        speaker_embeddings = np.concatenate(embedding_blocks) if embedding_blocks else np.zeros((0, 256), dtype=np.float32)
+        if cache_key is not None:
+            result_cache.put_arrays(cache_key, embeddings=speaker_embeddings, original_index=valid_segments.index)
+    except Exception as e:
+        print(f"Error extracting speaker embeddings: {e}")
+        speaker_embeddings = []
+        valid_segments = SegmentTable.empty()
 
-        try:
-            embedding = encoder.embed_utterance(segment_wav)
-            speaker_embeddings.append(embedding)
-            # 元のセグメント情報も保存しておく（クラスタリング結果と対応付けるため）
-            valid_segments.append({'start': start, 'end': end, 'text': text, 'original_index': i})
-        except Exception as e:
-            print(f"Error extracting embedding for segment {i+1} (time {start:.2f}-{end:.2f}): {e}. Skipping segment.")
-            # ここでもエラーが出たセグメントは除外
+    return label_speakers(valid_segments, speaker_embeddings, clustering_options=clustering_options)
+
+
+def compute_window_embeddings(audio, embedding_batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, audio_digest=None):
+    """
+    セグメント情報を使わずに、音声全体のスライディングウィンドウ埋め込みを計算する。
+    文字起こし (OpenAI API) の応答待ちの間に実行するためのもの。
+    """
+    cache_key = None
+    if result_cache is not None and audio_digest:
+        cache_key = result_cache.make_key(audio_digest, stage="window_embeddings", encoder="resemblyzer")
+        cached = result_cache.get_arrays(cache_key)
+        if cached is not None:
+            print(f"Loaded {len(cached['embeddings'])} window embeddings from cache.")
+            return cached
 
-    if not speaker_embeddings:
+    initialize_local_models(require_whisper=False, require_encoder=True) # Encoderのみ必要
+    from resemblyzer.audio import normalize_volume
+    from resemblyzer.hparams import audio_norm_target_dBFS
+    print(f"Computing sliding-window speaker embeddings for {audio.path}...")
+    # preprocess_wav は無音区間を詰めてタイムラインがずれるため、音量正規化のみ行う
+    samples = audio.samples
+    with inference_lock, instrumentation.stage("embed"):
+        wav = normalize_volume(samples, audio_norm_target_dBFS, increase_only=True)
+        windows = embed_sliding_windows(encoder, wav, batch_size=embedding_batch_size)
+    if cache_key is not None:
+        result_cache.put_arrays(cache_key, **windows)
+    return windows
+
+
+def diarize_with_window_embeddings(segments, windows, clustering_options=None):
+    """
+    事前に計算したウィンドウ埋め込みを文字起こし結果 (SegmentTable) に割り当てて話者分離を行う。
+    話者ラベル付きの SegmentTable (label_speakers の戻り値) を返す。失敗した場合はメッセージの文字列を返す。
+    """
+    speaker_embeddings = pool_window_embeddings(windows, np.column_stack([segments.start, segments.end]))
+    if speaker_embeddings is None:
+        speaker_embeddings = []
+    print(f"Mapped window embeddings onto {len(segments)} segments.")
+    return label_speakers(segments, speaker_embeddings, clustering_options=clustering_options)
+
+
+def diarize_with_speaker_turns(segments, windows, clustering_options=None, turn_options=None):
+    """
+    セグメント単位ではなく、音声全体のウィンドウ埋め込み (compute_window_embeddings) の時系列で話者の交代を検出し、
+    交代をまたぐWhisperのセグメントはその時刻で分割してから話者ラベルを付ける。
+    ウィンドウは音声全体で一度にバッチ計算するので、セグメントごとのエンコーダー呼び出しは無く、
+    短すぎて埋め込みを計算できないセグメントも落とさずに出力する。
+    turn_options は {'min_turn_sec': 秒, 'smoothing': ウィンドウ数} (省略時は speaker_turns の既定値)。
+    話者ラベル付きの SegmentTable を返す。
+    """
+    turn_options = turn_options or {}
+    if len(windows['embeddings']) == 0:
+        print("No speech windows were found. Skipping clustering.")
+        segments.labels = np.full(len(segments), -1, dtype=np.int64)
+        segments.speaker_names = {-1: "Unknown"}
+        return segments
+
+    with instrumentation.stage("cluster", segments=len(windows['embeddings'])):
+        window_labels = cluster_embeddings(windows['embeddings'], **(clustering_options or {}))
+        window_labels = smooth_labels(window_labels, turn_options.get('smoothing', DEFAULT_TURN_SMOOTHING))
+        print(f"Clustering finished. Found {len(set(window_labels.tolist()) - {-1})} distinct speakers.")
+
+    with instrumentation.stage("format", segments=len(segments)):
+        boundaries, turn_labels = find_turns(windows['starts'], windows['ends'], window_labels)
+        labeled, n_split = assign_turns(segments, boundaries, turn_labels,
+                                        min_turn_sec=turn_options.get('min_turn_sec', DEFAULT_MIN_TURN_SEC))
+        print(f"Detected {len(boundaries)} speaker turns; split {n_split} of {len(segments)} segments at turn boundaries.")
+        # 登録話者との照合は、ウィンドウ埋め込みを話者ごとにまとめた重心で行う
+        if speaker_registry is not None:
+            labeled.speaker_names = speaker_registry.name_clusters(windows['embeddings'], window_labels, threshold=match_threshold)
+    return labeled
+
+
+def label_speakers(valid_segments, speaker_embeddings, clustering_options=None):
+    """
+    埋め込みをクラスタリングし、valid_segments (SegmentTable) に話者ラベル (labels) と話者名 (speaker_names) を付けて返す。
+    valid_segments と speaker_embeddings の並びは対応している必要がある。
+    clustering_options は clustering.cluster_embeddings にそのまま渡す (method, num_speakers, threshold など)。
+    書き出すセグメントが無い場合はメッセージの文字列を返す。
+    """
+    if len(speaker_embeddings) == 0:
         print("No valid speaker embeddings could be extracted. Skipping clustering.")
         # Embeddingが全くない場合は、話者ラベルなしでvalid_segmentsを出力するか、エラーメッセージを返す
-        output_lines = []
-        for seg_info in valid_segments: # valid_segmentsも空のはずだが念のため
-             minute = int(seg_info['start'] // 60)
-             second = int(seg_info['start'] % 60)
-             timestamp = f"{minute}:{second:02}"
-             output_lines.append(f"@Unknown [{timestamp}]\\n{seg_info['text']}\\n")
-        return "\\n".join(output_lines) if output_lines else "No segments to transcribe after embedding errors."
+        if len(valid_segments) == 0: # valid_segmentsも空のはずだが念のため
+            return "No segments to transcribe after embedding errors."
+        valid_segments.labels = np.full(len(valid_segments), -1, dtype=np.int64)
+        valid_segments.speaker_names = {-1: "Unknown"}
+        return valid_segments
 
 
     # クラスタリング
-    embeddings = np.array(speaker_embeddings)
-    clustering = DBSCAN(eps=0.5, min_samples=1).fit(embeddings) # min_samples=1に変更し、ノイズ点をなくす
-    labels = clustering.labels_
-
-    # 結果のフォーマット
-    output_lines = []
-    # labels と valid_segments のインデックスが対応しているはず
-    for i, seg_info in enumerate(valid_segments):
-        label = labels[i] # DBSCANのラベル (0, 1, 2, ...)
-        minute = int(seg_info['start'] // 60)
-        second = int(seg_info['start'] % 60)
-        timestamp = f"{minute}:{second:02}"
-        output_lines.append(f"@Speaker_{label} [{timestamp}]\n{seg_info['text']}\n")
+    embeddings = np.asarray(speaker_embeddings)
+    with instrumentation.stage("cluster", segments=len(embeddings)):
+        labels = cluster_embeddings(embeddings, **(clustering_options or {}))
+        print(f"Clustering finished. Found {len(set(labels.tolist()) - {-1})} distinct speakers.")
+    valid_segments.embeddings = embeddings
+    valid_segments.labels = labels
 
-    return "\n".join(output_lines)
+    # 話者名 (登録話者に一致したクラスタは名前、それ以外は出現順の Speaker_N)
+    with instrumentation.stage("format", segments=len(valid_segments)):
+        if speaker_registry is not None:
+            valid_segments.speaker_names = speaker_registry.name_clusters(embeddings, labels, threshold=match_threshold)
+    return valid_segments
 
 
-def transcribe_with_openai(mp3_path):
+def transcribe_with_openai(mp3_path, audio_digest=None):
     """
-    OpenAI APIを使用して文字起こしを実行し、セグメント情報のリストを返す。
-    形式: [{'start': float, 'end': float, 'text': str}, ...]
+    OpenAI APIを使用して文字起こしを実行し、セグメントの表 (SegmentTable) を返す。
+    audio_digest が指定され、キャッシュが有効な場合はAPIの生レスポンスをキャッシュから読み書きする。
     """
     global openai_client
+    cache_key = None
+    if result_cache is not None and audio_digest:
+        cache_key = result_cache.make_key(
+            audio_digest, stage="openai_raw", model=OPENAI_MODEL_NAME,
+            response_format="verbose_json", timestamp_granularities=["segment"]
+        )
+        cached = result_cache.get_json(cache_key)
+        if cached is not None:
+            segments = SegmentTable.from_segments(cached.get('segments') or [])
+            print(f"Loaded cached OpenAI API response. Found {len(segments)} segments.")
+            return segments
+
     if openai_client is None:
          initialize_openai_client()
          if openai_client is None:
@@ -153,10 +276,10 @@ def transcribe_with_openai(mp3_path):
 
     print(f"Running transcription with OpenAI API for {mp3_path}...")
     try:
-        with open(mp3_path, "rb") as audio_file:
+        with open(mp3_path, "rb") as audio_file, instrumentation.stage("transcribe"):
             transcription = openai_client.audio.transcriptions.create(
                 file=audio_file,
-                model="whisper-1",
+                model=OPENAI_MODEL_NAME,
                 response_format="verbose_json",
                 timestamp_granularities=["segment"]
             )
@@ -183,55 +306,414 @@ def transcribe_with_openai(mp3_path):
         except Exception as e:
             print(f"Error saving raw OpenAI response to JSON: {e}")
 
-        # 結果をセグメント辞書のリストに変換
-        segments_list = []
+        if cache_key is not None:
+            try:
+                if hasattr(transcription, 'model_dump'):
+                    result_cache.put_json(cache_key, transcription.model_dump(mode="json"))
+                elif isinstance(transcription, dict):
+                    result_cache.put_json(cache_key, transcription)
+            except Exception as e:
+                print(f"Error caching raw OpenAI response: {e}")
+
+        # 結果をセグメントの表に変換
         if hasattr(transcription, 'segments') and transcription.segments:
-            for segment in transcription.segments:
-                 segments_list.append({
-                     'start': segment.start,
-                     'end': segment.end,
-                     'text': segment.text.strip()
-                 })
-            print(f"OpenAI transcription successful. Found {len(segments_list)} segments.")
-            return segments_list
+            segments = SegmentTable.from_segments(transcription.segments)
+            print(f"OpenAI transcription successful. Found {len(segments)} segments.")
+            return segments
         else:
             print("Warning: No segments found in OpenAI API response.")
-            return [] # 空のリストを返す
+            return SegmentTable.empty() # 空の表を返す
+
+    except Exception as e:
+        print(f"An error occurred during OpenAI transcription: {e}")
+        return None # エラーを示すためにNoneを返す
+
 
+def transcribe_with_openai_chunked(audio, audio_digest=None, max_chunk_mb=DEFAULT_MAX_CHUNK_MB,
+                                   concurrency=DEFAULT_CONCURRENCY):
+    """
+    音声を無音位置でサイズ上限付きのチャンクに分割し、OpenAI APIへ並行してアップロードして文字起こしする。
+    各チャンクの verbose_json はチャンクの開始時刻で補正したうえで1つにまとめ、セグメントの表 (SegmentTable) を返す。
+    """
+    cache_key = None
+    if result_cache is not None and audio_digest:
+        cache_key = result_cache.make_key(
+            audio_digest, stage="openai_chunked_raw", model=OPENAI_MODEL_NAME,
+            response_format="verbose_json", timestamp_granularities=["segment"], max_chunk_mb=max_chunk_mb
+        )
+        cached = result_cache.get_json(cache_key)
+        if cached is not None:
+            segments = SegmentTable.from_segments(cached.get('segments') or [])
+            print(f"Loaded cached OpenAI API response. Found {len(segments)} segments.")
+            return segments
+
+    print(f"Running chunked transcription with OpenAI API for {audio.path}...")
+    try:
+        samples = audio.samples
+        with instrumentation.stage("transcribe") as record:
+            merged = transcribe_chunked(samples, model=OPENAI_MODEL_NAME, max_chunk_mb=max_chunk_mb, concurrency=concurrency)
+            record['segments'] = len(merged['segments'])
     except Exception as e:
         print(f"An error occurred during OpenAI transcription: {e}")
         return None # エラーを示すためにNoneを返す
 
+    out_dir = "out"
+    os.makedirs(out_dir, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(audio.path))[0]
+    openai_raw_output_path = os.path.join(out_dir, base_name + "_openai_raw.json")
+    print(f"Saving merged raw OpenAI API response to {openai_raw_output_path}...")
+    try:
+        with open(openai_raw_output_path, "w", encoding="utf8") as json_f:
+            json.dump(merged, json_f, ensure_ascii=False, indent=4)
+    except Exception as e:
+        print(f"Error saving raw OpenAI response to JSON: {e}")
+    if cache_key is not None:
+        result_cache.put_json(cache_key, merged)
+
+    segments = SegmentTable.from_segments(merged['segments'])
+    print(f"OpenAI transcription successful. Found {len(segments)} segments.")
+    return segments
+
 
-def transcribe_with_local_whisper(wav_path):
+def transcribe_with_local_whisper(audio, audio_digest=None, vad_options=None):
     """
-    ローカルのWhisperモデルで文字起こしを実行し、セグメント情報のリストを返す。
-    形式: [{'start': float, 'end': float, 'text': str}, ...]
+    ローカルのWhisperモデルでデコード済み音声 (AudioBuffer) の文字起こしを実行し、セグメントの表 (SegmentTable) を返す。
+    audio_digest が指定され、キャッシュが有効な場合はセグメントの表をキャッシュから読み書きする。
+    vad_options が None でなければ、VADで検出した発話区間だけを文字起こしする (時刻は元の音声基準)。
     """
+    cache_key = None
+    if result_cache is not None and audio_digest:
+        cache_key = result_cache.make_key(
+            audio_digest, stage="segments", backend="local", model=whisper_model_name, compute_type=whisper_compute_type,
+            vad=vad_options, table_version=SEGMENT_TABLE_VERSION
+        )
+        cached = result_cache.get_arrays(cache_key)
+        if cached is not None:
+            segments = SegmentTable.from_arrays(cached)
+            print(f"Loaded cached local Whisper transcript. Found {len(segments)} segments.")
+            return segments
+
     initialize_local_models(require_whisper=True, require_encoder=False) # Whisperのみ必要
-    print(f"Running local transcription with Whisper on {wav_path}... (This may take some time)")
+    print(f"Running local transcription with Whisper on {audio.path}... (This may take some time)")
     try:
-        result = whisper_model.transcribe(wav_path)
-        segments = result.get("segments", [])
-        # Whisperの辞書形式のままで良い（diarize_with_resemblyzerが対応）
+        samples = audio.samples
+        # 同じモデルを使う他のジョブ (常駐サービス) の推論が終わるのを待ってから計測を始める
+        with inference_lock:
+            started = time.perf_counter()
+            with instrumentation.stage("transcribe") as record:
+                if vad_options is not None:
+                    result, _ = transcribe_speech_only(whisper_model, samples, vad_options)
+                else:
+                    result = whisper_model.transcribe(samples)
+                record['segments'] = len(result.get("segments", []))
+            elapsed = time.perf_counter() - started
+        segments = SegmentTable.from_segments(result.get("segments", []))
         print(f"Local Whisper finished. Detected {len(segments)} segments.")
+        print_real_time_factor("Whisper", elapsed, len(samples) / SAMPLE_RATE)
+        if cache_key is not None:
+            result_cache.put_arrays(cache_key, **segments.to_arrays())
         return segments
     except Exception as e:
         print(f"An error occurred during local Whisper transcription: {e}")
         return None
 
 
+def print_real_time_factor(stage, elapsed, audio_sec):
+    """処理時間と実時間比 (RTF = 処理時間 / 音声の長さ。1未満なら実時間より速い) を表示する"""
+    if audio_sec > 0:
+        print(f"{stage}: {elapsed:.1f}s for {audio_sec:.1f}s of audio (RTF {elapsed / audio_sec:.3f}, {audio_sec / max(elapsed, 1e-9):.1f}x real time).")
+
+
+def default_output_path(mp3_file, use_openai=False, out_dir="out"):
+    """デフォルトの出力ファイルパス (out_dir/[audio_filename]_transcript_{openai|local}_diarized.txt) を返す"""
+    base_name = os.path.splitext(os.path.basename(mp3_file))[0]
+    if use_openai:
+        suffix = "_transcript_openai_diarized.txt"
+    else:
+        suffix = "_transcript_local_diarized.txt"
+    return os.path.join(out_dir, base_name + suffix)
+
+
+def process_audio_file(mp3_file, output_file, metrics_file=None, profile_file=None, profile_stages=None, **pipeline_options):
+    """
+    1ファイル分のパイプライン (run_pipeline) を、ステージごとの計測付きで実行する。
+    metrics_file を指定すると、ステージごとの実時間・CPU時間・最大常駐メモリ・RTF・セグメント/秒を JSON で保存する。
+    profile_file を指定すると cProfile の結果を保存する (profile_stages を指定した場合はそのステージの間だけ計測する)。
+    その他の引数は run_pipeline にそのまま渡す。
+    戻り値: run_pipeline の戻り値に、ジョブ全体の計測結果 'metrics' を加えたもの
+    """
+    profiler = PipelineProfiler(mp3_file, profile_path=profile_file, profile_stages=profile_stages)
+    with instrumentation.profiling(profiler):
+        status = run_pipeline(mp3_file, output_file, **pipeline_options)
+    profiler.finish()
+    print("Pipeline stages:")
+    profiler.print_summary()
+    if metrics_file:
+        try:
+            profiler.write_json(metrics_file)
+        except OSError as e:
+            print(f"Error saving pipeline metrics to {metrics_file}: {e}")
+    status['metrics'] = profiler.summary()
+    return status
+
+
+def run_pipeline(mp3_file, output_file, use_openai=False, stream=False,
+                 window_sec=DEFAULT_WINDOW_SEC, overlap_sec=DEFAULT_OVERLAP_SEC,
+                 embedding_batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, clustering_options=None,
+                 openai_chunked=False, openai_max_chunk_mb=DEFAULT_MAX_CHUNK_MB,
+                 openai_concurrency=DEFAULT_CONCURRENCY, pipelined=False, vad_options=None,
+                 checkpoint_dir=None, resume=False, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, formats=DEFAULT_FORMATS,
+                 turn_options=None, summary_options=None):
+    """
+    1ファイル分の デコード → 文字起こし → 話者分離 → 書き込み を行う。
+    音声はメモリ上に一度だけデコードし、一時ファイルは作らないので複数ジョブを同時に実行しても衝突しない。
+    checkpoint_dir を指定すると、文字起こし結果と計算済みの埋め込みをそこに保存し (完了したら削除)、
+    resume=True なら保存済みの状態から再開する。
+    formats には出力する形式 (txt / srt / vtt / json / jsonl) を指定する。txt は output_file に、
+    それ以外は output_file の拡張子を形式名に置き換えたパスに書き出す。
+    turn_options を指定すると (空の辞書でもよい)、話者分離を diarize_with_speaker_turns で行い、
+    話者の交代をまたぐセグメントを分割する (ストリーミングモードでは使えない)。
+    summary_options を指定すると (空の辞書でもよい)、書き出した文字起こしを summarize.summarize_records で要約し、
+    summary_path(output_file) に保存する。要約に失敗しても文字起こしの結果はそのまま (status['summary_error'] に理由)。
+    戻り値: {'status': 'ok' | 'failed' | 'error', 'message': str, 'outputs': {形式: パス} (書き出した場合のみ、要約は 'summary')}
+    """
+    # デコードはキャッシュに無い処理で必要になった時点で一度だけ行い、その配列を全ステージで共有する
+    audio = AudioBuffer(mp3_file, workers=decode_workers)
+    segments = None
+    transcript = None
+    status = {'status': 'failed', 'message': ''}
+
+    try:
+        audio_digest = None
+        if result_cache is not None or checkpoint_dir:
+            audio_digest = file_digest(mp3_file)
+
+        checkpoint = None
+        resume_state = None
+        if checkpoint_dir:
+            # これらが同じ場合に限り、保存済みの途中結果を使い回せる
+            checkpoint = PipelineCheckpoint(checkpoint_dir, mp3_file, audio_digest, params={
+                'stream': stream, 'use_openai': use_openai, 'openai_chunked': openai_chunked, 'pipelined': pipelined,
+                'model': OPENAI_MODEL_NAME if use_openai else whisper_model_name,
+                'compute_type': None if use_openai else whisper_compute_type,
+                'vad': vad_options, 'window_sec': window_sec if stream else None, 'overlap_sec': overlap_sec if stream else None,
+            })
+            if resume:
+                resume_state = checkpoint.load()
+
+        if stream and turn_options is not None:
+            raise ValueError("Speaker turn detection is not supported with streaming mode.")
+        if stream:
+            # ストリーミングモード: 一時WAVを作らず、ウィンドウごとに文字起こしと埋め込みを行う
+            print("Mode: Streaming Local Whisper Transcription + Local Diarization")
+            cache_key = None
+            cached_arrays = None
+            if result_cache is not None:
+                cache_key = result_cache.make_key(
+                    audio_digest, stage="stream", model=whisper_model_name, compute_type=whisper_compute_type, encoder="resemblyzer",
+                    window_sec=window_sec, overlap_sec=overlap_sec, vad=vad_options, table_version=SEGMENT_TABLE_VERSION
+                )
+                cached_arrays = result_cache.get_arrays(cache_key)
+            if cached_arrays is not None:
+                valid_segments = SegmentTable.from_arrays(cached_arrays)
+                print(f"Loaded {len(valid_segments)} streamed segments and embeddings from cache.")
+            else:
+                initialize_local_models(require_whisper=True, require_encoder=True)
+                stream_resume_state = None
+                if resume_state is not None and resume_state.get('stage') == "streaming":
+                    saved = checkpoint.load_arrays()
+                    if saved is not None:
+                        stream_resume_state = dict(resume_state['stream'], segments=SegmentTable.from_arrays(saved))
+
+                def save_stream_checkpoint(state):
+                    # ウィンドウごとに、それまでのセグメント (埋め込み付きの表) と次のウィンドウの位置を保存する
+                    progress = {key: value for key, value in state.items() if key != 'segments'}
+                    checkpoint.save(arrays=state['segments'].to_arrays(), stage="streaming", stream=progress)
+
+                valid_segments = stream_transcribe_and_embed(
+                    mp3_file, whisper_model, encoder,
+                    window_sec=window_sec, overlap_sec=overlap_sec,
+                    embedding_batch_size=embedding_batch_size, vad_options=vad_options,
+                    resume_state=stream_resume_state,
+                    on_window_done=save_stream_checkpoint if checkpoint is not None else None
+                )
+                if cache_key is not None:
+                    result_cache.put_arrays(cache_key, **valid_segments.to_arrays())
+            transcript = label_speakers(valid_segments, valid_segments.embeddings, clustering_options=clustering_options)
+            status = {'status': 'ok', 'message': f"{len(valid_segments)} segments"}
+        else:
+            # 1. 文字起こし (Whisper: OpenAI or Local)
+            windows = None
+            resumed = False
+            if resume_state is not None and resume_state.get('stage') in ("transcribed", "embedding"):
+                saved = checkpoint.load_arrays()
+                resumed = saved is not None
+            if resumed:
+                # 文字起こしはチェックポイントに保存済み
+                segments = SegmentTable.from_arrays(saved)
+                print(f"Loaded {len(segments)} transcribed segments from checkpoint.")
+                if use_openai and pipelined:
+                    windows = compute_window_embeddings(audio, embedding_batch_size=embedding_batch_size, audio_digest=audio_digest)
+            elif use_openai and pipelined:
+                # OpenAI APIの応答を待つ間に、ローカルでウィンドウ埋め込みを計算しておく
+                print("Mode: Pipelined OpenAI Whisper Transcription + Local Diarization")
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    # 文字起こし側のステージも同じジョブの計測に入るよう、コンテキストを引き継ぐ
+                    context = contextvars.copy_context()
+                    if openai_chunked:
+                        future = executor.submit(
+                            context.run, transcribe_with_openai_chunked, audio, audio_digest=audio_digest,
+                            max_chunk_mb=openai_max_chunk_mb, concurrency=openai_concurrency
+                        )
+                    else:
+                        future = executor.submit(context.run, transcribe_with_openai, mp3_file, audio_digest=audio_digest)
+                    windows = compute_window_embeddings(audio, embedding_batch_size=embedding_batch_size, audio_digest=audio_digest)
+                    segments = future.result()
+            elif use_openai and openai_chunked:
+                print("Mode: Chunked OpenAI Whisper Transcription + Local Diarization")
+                segments = transcribe_with_openai_chunked(
+                    audio, audio_digest=audio_digest,
+                    max_chunk_mb=openai_max_chunk_mb, concurrency=openai_concurrency
+                )
+            elif use_openai:
+                print("Mode: OpenAI Whisper Transcription + Local Diarization")
+                segments = transcribe_with_openai(mp3_file, audio_digest=audio_digest) # MP3を渡す
+            else:
+                print("Mode: Local Whisper Transcription + Local Diarization")
+                segments = transcribe_with_local_whisper(audio, audio_digest=audio_digest, vad_options=vad_options) # デコード済み配列を渡す
+
+            if checkpoint is not None and segments and not resumed:
+                checkpoint.save(arrays=segments.to_arrays(), stage="transcribed")
+                print(f"Checkpoint saved: {len(segments)} transcribed segments.")
+
+            # 2. 話者分離 (Local Resemblyzer)
+            if segments and turn_options is not None:
+                # 音声全体のウィンドウ埋め込みで話者の交代を検出する (--pipelined なら計算済みのものを使う)
+                if windows is None:
+                    windows = compute_window_embeddings(audio, embedding_batch_size=embedding_batch_size, audio_digest=audio_digest)
+                transcript = diarize_with_speaker_turns(segments, windows, clustering_options=clustering_options, turn_options=turn_options)
+                status = {'status': 'ok', 'message': f"{len(segments)} segments"}
+            elif segments and use_openai and pipelined:
+                transcript = diarize_with_window_embeddings(segments, windows, clustering_options=clustering_options)
+                status = {'status': 'ok', 'message': f"{len(segments)} segments"}
+            elif segments is not None and segments: # セグメントが正常に取得できた場合のみ実行
+                transcript = diarize_with_resemblyzer(
+                    segments, audio, embedding_batch_size=embedding_batch_size, clustering_options=clustering_options,
+                    audio_digest=audio_digest, checkpoint=checkpoint, checkpoint_every=checkpoint_every
+                )
+                status = {'status': 'ok', 'message': f"{len(segments)} segments"}
+            elif segments is None:
+                 print("Transcription failed. Skipping diarization.")
+                 transcript = "Transcription step failed."
+                 status = {'status': 'failed', 'message': transcript}
+            else: # 空の表
+                 print("No segments found by Whisper. Skipping diarization.")
+                 transcript = "No speech detected or no segments returned by Whisper."
+                 status = {'status': 'ok', 'message': transcript}
+
+
+        # 3. 結果をファイルに書き込み (話者ラベル付きのセグメントは指定された全形式へ1件ずつ書き出す)
+        if isinstance(transcript, SegmentTable):
+            with instrumentation.stage("write", segments=len(transcript)), \
+                    TranscriptWriters(output_file, formats, audio_file=mp3_file) as writers:
+                write_segments(writers, transcript)
+            for path in writers.paths.values():
+                print(f"Transcription with speaker diarization saved to {path}")
+            status['outputs'] = dict(writers.paths)
+            if checkpoint is not None and status['status'] == 'ok':
+                checkpoint.clear()
+            # 4. 要約 (チャンクごとに並行して要約し、部分要約をまとめる)
+            if summary_options is not None and len(transcript):
+                summary_file = summary_path(output_file)
+                try:
+                    with instrumentation.stage("summarize", segments=len(transcript)):
+                        summary = summarize_records(transcript_records(transcript), cache=result_cache, **summary_options)
+                    write_summary(summary_file, summary)
+                    print(f"Summary saved to {summary_file}")
+                    status['outputs']['summary'] = summary_file
+                except Exception as e:
+                    print(f"Error summarizing the transcript: {e}")
+                    status['summary_error'] = str(e)
+        elif transcript:
+            with instrumentation.stage("write"), open(output_file, "w", encoding="utf8") as f:
+                f.write(transcript)
+            print(f"Transcription with speaker diarization saved to {output_file}")
+            if checkpoint is not None and status['status'] == 'ok':
+                checkpoint.clear()
+        else:
+             print("Failed to generate transcription.")
+             status = {'status': 'failed', 'message': "Failed to generate transcription."}
+
+
+    except Exception as e:
+        print(f"An overall error occurred: {e}")
+        status = {'status': 'error', 'message': str(e)}
+        # エラー発生時もファイルにメッセージを残す場合
+        try:
+             with open(output_file, "w", encoding="utf8") as f:
+                 f.write(f"An error occurred during processing: {e}")
+        except Exception as write_error:
+             print(f"Additionally, failed to write error message to output file: {write_error}")
+
+    return status
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Transcribe audio file using local Whisper or OpenAI API, with local speaker diarization.")
     parser.add_argument("audio_file", help="Path to the audio file (MP3 format)")
     parser.add_argument("--use-openai", action="store_true", help="Use OpenAI API for transcription, then local diarization.")
+    parser.add_argument("--openai-chunked", action="store_true", help="With --use-openai, split the audio at silences into size-capped chunks and upload them concurrently.")
+    parser.add_argument("--openai-max-chunk-mb", type=float, default=DEFAULT_MAX_CHUNK_MB, help=f"Maximum upload size per chunk in MB for --openai-chunked (default: {DEFAULT_MAX_CHUNK_MB}).")
+    parser.add_argument("--openai-concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Maximum number of concurrent uploads for --openai-chunked (default: {DEFAULT_CONCURRENCY}).")
+    parser.add_argument("--pipelined", action="store_true", help="With --use-openai, compute sliding-window speaker embeddings locally while the API request is in flight, then map them onto the returned segments.")
     parser.add_argument("-o", "--output", default=None, help="Path to save the transcription output file. Defaults to './out/[audio_filename]_diarized.txt'.")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help=f"Comma-separated output formats written in one pass: {', '.join(OUTPUT_FORMATS)} (default: {','.join(DEFAULT_FORMATS)}). Formats other than txt are written next to the output file with their own extension.")
+    parser.add_argument("--stream", action="store_true", help="Decode, transcribe and embed the audio in fixed-length overlapping windows to keep memory flat for very long recordings (local Whisper only).")
+    parser.add_argument("--window-sec", type=float, default=DEFAULT_WINDOW_SEC, help=f"Window length in seconds for --stream (default: {DEFAULT_WINDOW_SEC}).")
+    parser.add_argument("--overlap-sec", type=float, default=DEFAULT_OVERLAP_SEC, help=f"Overlap between consecutive windows in seconds for --stream (default: {DEFAULT_OVERLAP_SEC}).")
+    parser.add_argument("--speaker-turns", action="store_true", help="Detect speaker changes on a sliding-window embedding timeline computed over the whole audio in one batched pass, and split Whisper segments that span a speaker turn (not supported with --stream). Segments too short for their own embedding are kept.")
+    parser.add_argument("--min-turn-sec", type=float, default=DEFAULT_MIN_TURN_SEC, help=f"With --speaker-turns, speaker turns shorter than this many seconds inside a segment are merged into the neighbouring turn (default: {DEFAULT_MIN_TURN_SEC}).")
+    parser.add_argument("--turn-smoothing", type=int, default=DEFAULT_TURN_SMOOTHING, help=f"With --speaker-turns, smooth the per-window speaker labels with a majority vote over this many windows (default: {DEFAULT_TURN_SMOOTHING}; 1 disables smoothing).")
+    parser.add_argument("--decode-workers", type=int, default=DEFAULT_DECODE_WORKERS, help=f"Split the audio into this many time ranges (using the duration from ffprobe) and decode them with parallel ffmpeg processes into one buffer (default: {DEFAULT_DECODE_WORKERS}). Ranges are at least {MIN_DECODE_RANGE_SEC:.0f}s long. Not used with --stream.")
+    parser.add_argument("--embedding-batch-size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE, help=f"Number of partial-utterance windows per VoiceEncoder forward pass (default: {DEFAULT_EMBEDDING_BATCH_SIZE}).")
+    add_whisper_arguments(parser)
+    parser.add_argument("--vad", action="store_true", help="Detect speech with a lightweight energy/spectral VAD and send only the (padded) speech regions to local Whisper. Prints the speech ratio and how much audio was skipped.")
+    parser.add_argument("--vad-pad-sec", type=float, default=DEFAULT_PAD_SEC, help=f"Padding added before and after each speech region for --vad (default: {DEFAULT_PAD_SEC}).")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Number of torch intra-op threads for local inference (default: torch's choice, usually the number of physical cores).")
+    add_clustering_arguments(parser)
+    parser.add_argument("--speaker-registry", nargs="?", const=DEFAULT_REGISTRY_DIR, default=None, help=f"Name clusters that match speakers enrolled with speaker_registry.py instead of writing Speaker_N. Optionally give the registry directory (default: {DEFAULT_REGISTRY_DIR}).")
+    parser.add_argument("--match-threshold", type=float, default=DEFAULT_MATCH_THRESHOLD, help=f"Minimum cosine similarity between a cluster centroid and an enrolled speaker for --speaker-registry (default: {DEFAULT_MATCH_THRESHOLD}).")
+    add_summary_arguments(parser)
+    parser.add_argument("--metrics", default=None, help="Path of the per-stage metrics JSON (wall time, CPU time, peak RSS, real-time factor and segments/s for decode, transcribe, embed, cluster, format, write and summarize). Defaults to '[output file].metrics.json'.")
+    parser.add_argument("--no-metrics", action="store_true", help="Do not write the metrics JSON (the per-stage summary is still printed).")
+    parser.add_argument("--profile", default=None, help="Run cProfile and save the stats (pstats format) to this path, e.g. out/run.prof.")
+    parser.add_argument("--profile-stage", action="append", choices=STAGES, default=None, help="With --profile, profile only this stage (can be repeated). Profiles the whole run by default.")
+    parser.add_argument("--resume", action="store_true", help="Resume an interrupted run from its checkpoint (completed transcript segments and the speaker embeddings computed so far) instead of starting from zero.")
+    parser.add_argument("--checkpoint-dir", default=None, help="Directory for the checkpoint of this run (default: '[output file].checkpoint'). It is deleted once the transcript is written.")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY, help=f"Save a checkpoint after this many segments during speaker embedding (default: {DEFAULT_CHECKPOINT_EVERY}). With --stream a checkpoint is saved after every window.")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not write checkpoints.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the on-disk result cache (transcripts, raw API responses, embeddings).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"Directory of the result cache (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum size of the result cache in MB; least recently used entries are evicted (default: {DEFAULT_CACHE_MAX_MB}).")
     args = parser.parse_args()
 
     mp3_file = args.audio_file
     if not os.path.exists(mp3_file):
         print(f"Error: {mp3_file} not found.")
         sys.exit(1)
+    if args.stream and args.use_openai:
+        print("Error: --stream is only supported with local Whisper transcription.")
+        sys.exit(1)
+    if args.stream and args.speaker_turns:
+        print("Error: --speaker-turns is not supported with --stream.")
+        sys.exit(1)
+    try:
+        formats = parse_formats(args.formats)
+    except ValueError as e:
+        parser.error(str(e))
+    if not ffmpeg_available():
+        print("Error: ffmpeg is required but not found. Please install ffmpeg and ensure it's in your system's PATH.")
+        sys.exit(1)
 
     out_dir = "out"
     os.makedirs(out_dir, exist_ok=True)
@@ -249,64 +731,36 @@ if __name__ == "__main__":
             output_file = os.path.join(out_dir, args.output)
     else:
         # デフォルトのファイル名を ./out ディレクトリ内に生成
-        base_name = os.path.splitext(os.path.basename(mp3_file))[0]
-        if args.use_openai:
-            suffix = "_transcript_openai_diarized.txt"
-        else:
-            suffix = "_transcript_local_diarized.txt"
-        output_file = os.path.join(out_dir, base_name + suffix) # ★修正
-
-    # 一時的なWAVファイルパス（これはカレントディレクトリで良い場合が多い）
-    wav_file = "temp_audio_for_diarization.wav"
-    segments = None
-    formatted_transcription = None
-
+        output_file = default_output_path(mp3_file, use_openai=args.use_openai, out_dir=out_dir)
     try:
-        # 1. MP3をWAVに変換 (どちらのモードでもDiarizationに必要)
-        convert_mp3_to_wav(mp3_file, wav_file)
-
-        # 2. 文字起こし (Whisper: OpenAI or Local)
-        if args.use_openai:
-            print("Mode: OpenAI Whisper Transcription + Local Diarization")
-            segments = transcribe_with_openai(mp3_file) # MP3を渡す
-        else:
-            print("Mode: Local Whisper Transcription + Local Diarization")
-            segments = transcribe_with_local_whisper(wav_file) # WAVを渡す
-
-        # 3. 話者分離 (Local Resemblyzer)
-        if segments is not None and segments: # セグメントが正常に取得できた場合のみ実行
-            formatted_transcription = diarize_with_resemblyzer(segments, wav_file)
-        elif segments is None:
-             print("Transcription failed. Skipping diarization.")
-             formatted_transcription = "Transcription step failed."
-        else: # segments == []
-             print("No segments found by Whisper. Skipping diarization.")
-             formatted_transcription = "No speech detected or no segments returned by Whisper."
-
-
-        # 4. 結果をファイルに書き込み
-        if formatted_transcription:
-            with open(output_file, "w", encoding="utf8") as f:
-                f.write(formatted_transcription)
-            print(f"Transcription with speaker diarization saved to {output_file}")
-        else:
-             print("Failed to generate transcription.")
-
-
-    except Exception as e:
-        print(f"An overall error occurred: {e}")
-        # エラー発生時もファイルにメッセージを残す場合
-        try:
-             with open(output_file, "w", encoding="utf8") as f:
-                 f.write(f"An error occurred during processing: {e}")
-        except Exception as write_error:
-             print(f"Additionally, failed to write error message to output file: {write_error}")
-
-    finally:
-        # 一時ファイルの削除
-        if os.path.exists(wav_file):
-             print(f"Removing temporary file: {wav_file}")
-             try:
-                  os.remove(wav_file)
-             except OSError as e:
-                  print(f"Error removing temporary file {wav_file}: {e}")
\ No newline at end of file
+        transcript_paths(output_file, formats)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not args.no_cache:
+        result_cache = ResultCache(cache_dir=args.cache_dir, max_mb=args.cache_max_mb)
+    whisper_model_name = args.whisper_model
+    whisper_compute_type = args.compute_type
+    decode_workers = args.decode_workers
+    print(f"Using {set_torch_threads(args.torch_threads)} torch threads.")
+    if args.speaker_registry:
+        speaker_registry = SpeakerRegistry(args.speaker_registry)
+        match_threshold = args.match_threshold
+        print(f"Loaded speaker registry with {len(speaker_registry.speakers())} enrolled speakers.")
+    checkpoint_dir = None
+    if not args.no_checkpoint:
+        checkpoint_dir = args.checkpoint_dir or default_checkpoint_dir(output_file)
+
+    process_audio_file(
+        mp3_file, output_file, use_openai=args.use_openai, stream=args.stream,
+        window_sec=args.window_sec, overlap_sec=args.overlap_sec,
+        embedding_batch_size=args.embedding_batch_size, clustering_options=clustering_options_from_args(args),
+        openai_chunked=args.openai_chunked, openai_max_chunk_mb=args.openai_max_chunk_mb,
+        openai_concurrency=args.openai_concurrency, pipelined=args.pipelined,
+        vad_options={'pad_sec': args.vad_pad_sec} if args.vad else None,
+        checkpoint_dir=checkpoint_dir, resume=args.resume, checkpoint_every=args.checkpoint_every, formats=formats,
+        turn_options={'min_turn_sec': args.min_turn_sec, 'smoothing': args.turn_smoothing} if args.speaker_turns else None,
+        summary_options=summary_options_from_args(args),
+        metrics_file=None if args.no_metrics else (args.metrics or default_metrics_path(output_file)),
+        profile_file=args.profile, profile_stages=args.profile_stage
+    )
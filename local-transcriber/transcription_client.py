@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, urlopen
+
+from transcription_server import DEFAULT_HOST, DEFAULT_PORT
+
+DEFAULT_SERVER = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+DEFAULT_POLL_SEC = 2.0
+# 待ち行列が一杯 (429) のときに再送する最大回数
+DEFAULT_MAX_RETRIES = 30
+
+
+class TranscriptionClient:
+    """transcription_server.py のジョブ投入・状態確認・結果取得を行うクライアント (標準ライブラリのみ)"""
+
+    def __init__(self, server=DEFAULT_SERVER, max_retries=DEFAULT_MAX_RETRIES):
+        self.server = server.rstrip("/")
+        self.max_retries = max_retries
+
+    def _request(self, method, path, body=None, headers=None):
+        request = Request(self.server + path, data=body, method=method, headers=headers or {})
+        with urlopen(request) as response:
+            return response.read()
+
+    def _submit(self, path, body, headers):
+        # 待ち行列が一杯なら Retry-After の秒数だけ待って再送する
+        for attempt in range(self.max_retries + 1):
+            try:
+                return json.loads(self._request("POST", path, body=body, headers=headers))
+            except HTTPError as e:
+                if e.code != 429 or attempt == self.max_retries:
+                    raise
+                retry_after = float(e.headers.get("Retry-After") or 1)
+                print(f"Server queue is full; retrying in {retry_after:.0f}s...")
+                time.sleep(retry_after)
+
+    def upload(self, audio_file, options=None):
+        """音声ファイルをアップロードしてジョブを投入し、ジョブの状態 (JSON) を返す"""
+        query = urlencode({'filename': os.path.basename(audio_file), 'options': json.dumps(options or {})}, quote_via=quote)
+        with open(audio_file, "rb") as f:
+            body = f.read()
+        return self._submit(f"/jobs?{query}", body, {'Content-Type': "application/octet-stream"})
+
+    def submit_path(self, audio_path, options=None):
+        """サーバーから読めるパスの音声ファイルでジョブを投入し、ジョブの状態 (JSON) を返す"""
+        body = json.dumps({'audio_path': os.path.abspath(audio_path), 'options': options or {}}).encode("utf-8")
+        return self._submit("/jobs", body, {'Content-Type': "application/json"})
+
+    def status(self, job_id):
+        return json.loads(self._request("GET", f"/jobs/{job_id}"))
+
+    def result(self, job_id, format_name="txt"):
+        """文字起こし結果を返す (format_name には投入時の options の formats に含めた形式を指定できる)"""
+        return self._request("GET", f"/jobs/{job_id}/result?format={quote(format_name)}").decode("utf-8")
+
+    def metrics(self, job_id):
+        return json.loads(self._request("GET", f"/jobs/{job_id}/metrics"))
+
+    def cancel(self, job_id):
+        return json.loads(self._request("DELETE", f"/jobs/{job_id}"))
+
+    def health(self):
+        return json.loads(self._request("GET", "/health"))
+
+    def wait(self, job_id, poll_sec=DEFAULT_POLL_SEC, timeout=None):
+        """ジョブが終わるまで状態を確認し続け、最終的な状態を返す"""
+        started = time.time()
+        last_status = None
+        while True:
+            job = self.status(job_id)
+            if job['status'] != last_status:
+                position = f" (position {job['queue_position']})" if job['queue_position'] is not None else ""
+                print(f"Job {job_id}: {job['status']}{position}")
+                last_status = job['status']
+            if job['status'] in ("done", "failed", "cancelled"):
+                return job
+            if timeout is not None and time.time() - started > timeout:
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout}s.")
+            time.sleep(poll_sec)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit an audio file to a running transcription_server.py and fetch the transcript.")
+    parser.add_argument("audio_file", nargs="?", help="Audio file to transcribe. Omit with --status/--health.")
+    parser.add_argument("--server", default=DEFAULT_SERVER, help=f"Base URL of the service (default: {DEFAULT_SERVER}).")
+    parser.add_argument("--server-path", action="store_true", help="Send the file path instead of uploading the file (the server must be started with --audio-root covering it).")
+    parser.add_argument("--options", default="{}", help='Job options as JSON, e.g. \'{"vad": true, "num_speakers": 2}\'.')
+    parser.add_argument("--format", default="txt", help='Format of the fetched result (txt, srt, vtt, json or jsonl). It is added to the job\'s "formats" option automatically.')
+    parser.add_argument("--no-wait", action="store_true", help="Print the job ID and return without waiting for the result.")
+    parser.add_argument("--status", default=None, metavar="JOB_ID", help="Print the status of a job.")
+    parser.add_argument("--health", action="store_true", help="Print the service status (queue length, loaded models).")
+    parser.add_argument("-o", "--output", default=None, help="Save the transcript to this file instead of printing it.")
+    parser.add_argument("--poll-sec", type=float, default=DEFAULT_POLL_SEC, help=f"Polling interval in seconds (default: {DEFAULT_POLL_SEC}).")
+    parser.add_argument("--timeout", type=float, default=None, help="Give up waiting after this many seconds.")
+    args = parser.parse_args()
+
+    client = TranscriptionClient(args.server)
+    try:
+        if args.health:
+            print(json.dumps(client.health(), ensure_ascii=False, indent=2))
+            sys.exit(0)
+        if args.status:
+            print(json.dumps(client.status(args.status), ensure_ascii=False, indent=2))
+            sys.exit(0)
+        if not args.audio_file:
+            parser.error("audio_file is required unless --status or --health is given.")
+        if not os.path.exists(args.audio_file):
+            print(f"Error: {args.audio_file} not found.")
+            sys.exit(1)
+
+        options = json.loads(args.options)
+        if args.format != "txt":
+            options['formats'] = list(dict.fromkeys(options.get('formats', []) + [args.format]))
+        job = client.submit_path(args.audio_file, options) if args.server_path else client.upload(args.audio_file, options)
+        print(f"Submitted job {job['id']} ({job['status']}).")
+        if args.no_wait:
+            sys.exit(0)
+        job = client.wait(job['id'], poll_sec=args.poll_sec, timeout=args.timeout)
+        if job['status'] != "done":
+            print(f"Job {job['id']} {job['status']}: {job['message']}")
+            sys.exit(1)
+        transcript = client.result(job['id'], args.format)
+        metrics = job.get('metrics') or {}
+        print(f"Job {job['id']} finished in {metrics.get('wall_sec')}s (RTF {metrics.get('rtf')}).")
+        if args.output:
+            with open(args.output, "w", encoding="utf8") as f:
+                f.write(transcript)
+            print(f"Transcript saved to {args.output}")
+        else:
+            print(transcript)
+    except HTTPError as e:
+        print(f"Error: {e.code} {e.read().decode('utf-8', errors='replace')}")
+        sys.exit(1)
+    except OSError as e:
+        print(f"Error: cannot reach the transcription service at {args.server}: {e}")
+        sys.exit(1)
@@ -1,20 +1,29 @@
 # -*- coding: utf-8 -*-
-import whisper
-from resemblyzer import VoiceEncoder, preprocess_wav
-from sklearn.cluster import DBSCAN
 # from pydub import AudioSegment # ffmpeg方式では不要
 import numpy as np
-import torch
 import os
+import shutil
 import subprocess # 追加
-import re # 追加
 import sys # 追加
 import time # 追加
-
-# GPUが利用可能なら設定
-device = "cuda" if torch.cuda.is_available() else "cpu"
-whisper_model = whisper.load_model("large", device=device)
-encoder = VoiceEncoder(device=device)
+import argparse
+from audio_io import (SAMPLE_RATE, ffmpeg_available, decode_audio_parallel, split_decode_ranges,
+                      DEFAULT_DECODE_WORKERS, MIN_DECODE_RANGE_SEC)
+from speaker_embedding import embed_segments_batched, DEFAULT_EMBEDDING_BATCH_SIZE
+from streaming import stream_transcribe_and_embed, DEFAULT_WINDOW_SEC, DEFAULT_OVERLAP_SEC
+from segment_table import SegmentTable
+from transcript_writers import TranscriptWriters, write_segments, parse_formats, OUTPUT_FORMATS, DEFAULT_FORMATS
+from clustering import cluster_embeddings, add_clustering_arguments, clustering_options_from_args
+from vad import transcribe_speech_only, DEFAULT_PAD_SEC
+import instrumentation
+from instrumentation import PipelineProfiler, default_metrics_path, STAGES
+from model_manager import (get_whisper_model, get_voice_encoder, set_torch_threads, add_whisper_arguments,
+                           DEFAULT_WHISPER_MODEL, DEFAULT_COMPUTE_TYPE)
+
+# モデルはimport時ではなく、最初に使う時点で読み込む (--help や入力エラーではすぐに終了できるように)
+# ローカルWhisperのモデルサイズと計算精度 (--whisper-model / --compute-type で変更)
+whisper_model_name = DEFAULT_WHISPER_MODEL
+whisper_compute_type = DEFAULT_COMPUTE_TYPE
 
 def get_audio_duration(file_path):
     """ffprobeを使って音声ファイルの総再生時間を取得する"""
@@ -39,9 +48,12 @@ def get_audio_duration(file_path):
         print(f"Error parsing duration from ffprobe output: {result.stdout}")
         return None
 
-def convert_mp3_to_wav_with_progress(mp3_path, wav_path):
+def decode_mp3_with_progress(mp3_path, workers=DEFAULT_DECODE_WORKERS):
     """
-    ffmpegを使ってMP3ファイルをWAVに変換し、進捗を表示する (スロットリング付き)
+    ffmpegを使ってMP3ファイルを16kHzモノラルの float32 配列にメモリ上でデコードし、進捗を表示する (スロットリング付き)。
+    一時WAVは作らず、ffmpegのstdoutから生PCM (s16le) を直接読み込む。
+    workers が 2 以上なら、ffprobe で調べた長さで時間区間に分け、区間ごとのffmpegを並列に実行する (audio_io.decode_audio_parallel)。
+    進捗は全プロセス合計の処理済み秒数で、ffmpegの -progress の key=value 出力から読む。
     """
     try:
         total_duration = get_audio_duration(mp3_path)
@@ -51,180 +63,193 @@ def convert_mp3_to_wav_with_progress(mp3_path, wav_path):
     if total_duration is None:
         print("Could not get total duration, proceeding without progress percentage.")
 
-    cmd = [
-        "ffmpeg", "-i", mp3_path,
-        "-vn", "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1",
-        wav_path, "-y", "-loglevel", "error",
-        "-progress", "-", "-nostats"
-    ]
-
-    print(f"Converting {mp3_path} to {wav_path} using ffmpeg...")
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
-
-    current_time_sec = 0.0
+    n_ranges = len(split_decode_ranges(total_duration, workers))
+    print(f"Decoding {mp3_path} in memory using ffmpeg" + (f" ({n_ranges} parallel ranges)..." if n_ranges > 1 else "..."))
     last_update_time = time.time()
     update_interval = 0.2 # 更新間隔（秒）
 
-    while True:
-        line = process.stderr.readline()
-        if not line and process.poll() is not None:
-            break
-        if not line:
-            continue
-
-        new_time_sec = current_time_sec # デフォルトは前の値
-        match_time_ms = re.search(r"out_time_ms=(\d+)", line)
-        if match_time_ms:
-            new_time_sec = int(match_time_ms.group(1)) / 1_000_000.0
+    def show_progress(current_time_sec):
+        # スロットリング: 一定時間が経過した場合のみ表示を更新 (呼び出しはデコード側でロック済み)
+        nonlocal last_update_time
+        current_render_time = time.time()
+        if current_render_time - last_update_time <= update_interval:
+            return
+        if total_duration and total_duration > 0:
+            progress = min(100.0, (current_time_sec / total_duration) * 100)
+            print(f"\rConverting: {min(current_time_sec, total_duration):.2f}s / {total_duration:.2f}s ({progress:.1f}%)  ", end="")
         else:
-            match_time = re.search(r"time=(\d{2}):(\d{2}):(\d{2})\.(\d+)", line)
-            if match_time:
-                hours, minutes, seconds, ms_part = map(int, match_time.groups())
-                ms = ms_part / (10**(len(str(ms_part))))
-                new_time_sec = hours * 3600 + minutes * 60 + seconds + ms
+            print(f"\rConverting: {current_time_sec:.2f}s processed  ", end="")
+        last_update_time = current_render_time
 
-        # 値が更新された場合のみcurrent_time_secを更新
-        if new_time_sec > current_time_sec:
-             current_time_sec = new_time_sec
-
-        # スロットリング: 一定時間が経過した場合のみ表示を更新
-        current_render_time = time.time()
-        if current_render_time - last_update_time > update_interval:
-            if total_duration and total_duration > 0:
-                progress = min(100.0, (current_time_sec / total_duration) * 100)
-                print(f"\rConverting: {current_time_sec:.2f}s / {total_duration:.2f}s ({progress:.1f}%)  ", end="")
-            else:
-                print(f"\rConverting: {current_time_sec:.2f}s processed  ", end="")
-            last_update_time = current_render_time
+    try:
+        samples = decode_audio_parallel(mp3_path, total_duration, workers=workers, on_progress=show_progress)
+    except RuntimeError as e:
+        print(f"\nError during conversion. {e}")
+        raise
 
-    # ループ終了後、最終的な進捗を表示
+    # 最終的な進捗を表示
     if total_duration and total_duration > 0:
-         final_progress = min(100.0, (current_time_sec / total_duration) * 100)
-         # 最終時刻がtotal_durationを超える場合があるため、100%表示も保証
-         if current_time_sec >= total_duration:
-             final_progress = 100.0
          print(f"\rConverting: {total_duration:.2f}s / {total_duration:.2f}s (100.0%)  ", end="")
     else:
-         print(f"\rConverting: {current_time_sec:.2f}s processed  ", end="")
+         print(f"\rConverting: {len(samples) / SAMPLE_RATE:.2f}s processed  ", end="")
     print() # 改行
+    print(f"Successfully decoded {mp3_path} ({len(samples) / SAMPLE_RATE:.2f}s)")
+    return samples
 
-    process.wait()
-    stdout_output, stderr_output = process.communicate() # 残りの出力を取得
 
-    if process.returncode == 0:
-        print(f"Successfully converted {mp3_path} to {wav_path}")
-    else:
-        print(f"\nError during conversion. ffmpeg exited with code {process.returncode}")
-        if stdout_output:
-             print("--- ffmpeg stdout ---")
-             print(stdout_output)
-             print("---------------------\n")
-        # stderrは進捗情報も混ざるので参考程度に表示
-        # print("--- ffmpeg stderr (remaining) ---")
-        # print(stderr_output)
-        # print("-------------------------------\n")
-        raise RuntimeError(f"ffmpeg conversion failed with code {process.returncode}")
-
-
-def transcribe_with_speaker_diarization(wav_path, output_path="transcript.txt"):
-    # Whisperで文字起こし（結果はJSON形式）
+def transcribe_with_speaker_diarization(audio, output_path="transcript.txt", embedding_batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                                        clustering_options=None, vad_options=None, formats=DEFAULT_FORMATS, audio_file=None):
+    # Whisperで文字起こし（結果はJSON形式）。audio はデコード済みの16kHz float32配列
+    whisper_model = get_whisper_model(whisper_model_name, compute_type=whisper_compute_type)
     print("Running transcription with Whisper... (This may take some time)")
-    result = whisper_model.transcribe(wav_path)
-    segments = result.get("segments", [])
+    started = time.time()
+    with instrumentation.stage("transcribe") as record:
+        if vad_options is not None:
+            # 発話区間だけを文字起こしする (セグメントの時刻は元の音声基準に戻される)
+            result, _ = transcribe_speech_only(whisper_model, audio, vad_options)
+        else:
+            result = whisper_model.transcribe(audio)
+        record['segments'] = len(result.get("segments", []))
+    elapsed = time.time() - started
+    segments = SegmentTable.from_segments(result.get("segments", []))
     print(f"Whisper finished. Detected {len(segments)} segments.") # 追加：セグメント数表示
+    audio_sec = len(audio) / SAMPLE_RATE
+    if audio_sec > 0:
+        print(f"Whisper took {elapsed:.1f}s for {audio_sec:.1f}s of audio (RTF {elapsed / audio_sec:.3f}).")
+
+    # Whisperと同じ配列をpreprocessして使う（16kHzなのでリサンプリングは行われない）
+    encoder = get_voice_encoder()
+    from resemblyzer import preprocess_wav
+    with instrumentation.stage("embed"):
+        wav = preprocess_wav(audio, source_sr=SAMPLE_RATE)
+
+    print(f"Extracting speaker embeddings for each segment (batch size {embedding_batch_size})...")
+    # 各セグメントの部分発話ウィンドウをまとめてバッチでResemblyzerに通す
+    # 16kHzに合わせたサンプル数の範囲 (全セグメント分を配列演算でまとめて求める)
+    spans = segments.sample_spans()
+
+    def show_progress(done, total):
+        # セグメントごとの進捗表示
+        progress_percent = (done / total) * 100 if total > 0 else 0
+        print(f"\rProcessing embedding: Segment {done}/{total} ({progress_percent:.1f}%) ", end="")
 
-    # 音声全体をpreprocessしてwav配列（16kHz）として読み込み
-    wav = preprocess_wav(wav_path)
+    with instrumentation.stage("embed", segments=len(spans)):
+        speaker_embeddings = embed_segments_batched(encoder, wav, spans, batch_size=embedding_batch_size, progress_callback=show_progress)
+    print() # 改行
 
-    speaker_embeddings = []
-    segment_timestamps = []
+    cluster_and_write_transcript(segments, speaker_embeddings, output_path, clustering_options, formats=formats, audio_file=audio_file)
 
-    print("Extracting speaker embeddings for each segment...")
-    # 各セグメントごとにResemblyzerで特徴量抽出
-    total_segments = len(segments)
-    for i, segment in enumerate(segments):
-        # セグメントごとの進捗表示
-        progress_percent = ((i + 1) / total_segments) * 100 if total_segments > 0 else 0
-        print(f"\rProcessing embedding: Segment {i+1}/{total_segments} ({progress_percent:.1f}%) ", end="")
-        start = segment.get("start", 0)
-        end = segment.get("end", 0)
-        # 16kHzに合わせたサンプル数でスライス
-        segment_wav = wav[int(start * 16000):int(end * 16000)]
-        # Embeddingの取得
-        embedding = encoder.embed_utterance(segment_wav)
-        speaker_embeddings.append(embedding)
-        segment_timestamps.append((start, end))
-    print() # 改行
 
-    # クラスタリング：DBSCANを利用して話者分離
+def cluster_and_write_transcript(segments, speaker_embeddings, output_path, clustering_options=None, formats=DEFAULT_FORMATS, audio_file=None):
+    """
+    埋め込みをクラスタリングし、話者区別付きの文字起こし結果 (segments は SegmentTable) をファイルに書き込む。
+    clustering_options は clustering.cluster_embeddings にそのまま渡す。
+    formats の各形式 (txt 以外は output_path の拡張子を置き換えたパス) へ、セグメントを1件ずつ同時に書き出す。
+    """
     print("Clustering speaker embeddings...")
     embeddings = np.array(speaker_embeddings)
-    clustering = DBSCAN(eps=0.5, min_samples=2).fit(embeddings)
-    labels = clustering.labels_
+    if len(embeddings) == 0:
+        print("No speaker embeddings to cluster.")
+        labels = np.full(len(segments), -1, dtype=np.int64)
+    else:
+        with instrumentation.stage("cluster", segments=len(embeddings)):
+            labels = cluster_embeddings(embeddings, **(clustering_options or {}))
     num_speakers = len(set(label for label in labels if label != -1))
     print(f"Clustering finished. Found {num_speakers} distinct speakers.")
 
-    # 話者区別付きの文字起こし結果をフォーマット
-    output_lines = []
-    for i, segment in enumerate(segments):
-        start = segment.get("start", 0)
-        text = segment.get("text", "").strip()
-        label = labels[i] if labels[i] != -1 else "Unknown"
-        # タイムスタンプを分:秒形式に変換
-        minute = int(start // 60)
-        second = int(start % 60)
-        timestamp = f"{minute}:{second:02}"
-        output_lines.append(f"@Speaker_{label} [{timestamp}]\n{text}\n")
-
-    formatted_transcription = "\n".join(output_lines)
-    with open(output_path, "w", encoding="utf8") as f:
-        f.write(formatted_transcription)
-    print(f"Transcription with speaker diarization saved to {output_path}")
+    # 話者区別付きの文字起こし結果を、全形式へ1件ずつ書き出す (全体の文字列はメモリ上に作らない)
+    segments.labels = labels
+    with instrumentation.stage("write", segments=len(segments)), \
+            TranscriptWriters(output_path, formats, audio_file=audio_file) as writers:
+        write_segments(writers, segments)
+    for path in writers.paths.values():
+        print(f"Transcription with speaker diarization saved to {path}")
 
 if __name__ == "__main__":
-    # import sys # 既に上でimport済み
-    if len(sys.argv) < 2:
-        print("Usage: python transcription.py <path/to/audio.mp3>") # スクリプト名を修正
-        sys.exit(1)
-
-    mp3_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Transcribe audio file with local Whisper and speaker diarization (with progress output).")
+    parser.add_argument("audio_file", help="Path to the audio file (MP3 format)")
+    parser.add_argument("--stream", action="store_true", help="Decode, transcribe and embed the audio in fixed-length overlapping windows to keep memory flat for very long recordings.")
+    parser.add_argument("--window-sec", type=float, default=DEFAULT_WINDOW_SEC, help=f"Window length in seconds for --stream (default: {DEFAULT_WINDOW_SEC}).")
+    parser.add_argument("--overlap-sec", type=float, default=DEFAULT_OVERLAP_SEC, help=f"Overlap between consecutive windows in seconds for --stream (default: {DEFAULT_OVERLAP_SEC}).")
+    parser.add_argument("--decode-workers", type=int, default=DEFAULT_DECODE_WORKERS, help=f"Split the audio into this many time ranges and decode them with parallel ffmpeg processes into one buffer (default: {DEFAULT_DECODE_WORKERS}). Ranges are at least {MIN_DECODE_RANGE_SEC:.0f}s long.")
+    parser.add_argument("--embedding-batch-size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE, help=f"Number of partial-utterance windows per VoiceEncoder forward pass (default: {DEFAULT_EMBEDDING_BATCH_SIZE}).")
+    add_whisper_arguments(parser)
+    parser.add_argument("--vad", action="store_true", help="Detect speech with a lightweight energy/spectral VAD and send only the (padded) speech regions to Whisper. Prints the speech ratio and how much audio was skipped.")
+    parser.add_argument("--vad-pad-sec", type=float, default=DEFAULT_PAD_SEC, help=f"Padding added before and after each speech region for --vad (default: {DEFAULT_PAD_SEC}).")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Number of torch intra-op threads for local inference (default: torch's choice, usually the number of physical cores).")
+    add_clustering_arguments(parser)
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS), help=f"Comma-separated output formats written in one pass: {', '.join(OUTPUT_FORMATS)} (default: {','.join(DEFAULT_FORMATS)}), e.g. 'txt,srt' writes transcript.txt and transcript.srt.")
+    parser.add_argument("--metrics", default=None, help="Path of the per-stage metrics JSON (wall time, CPU time, peak RSS, real-time factor and segments/s). Defaults to 'transcript.txt.metrics.json'.")
+    parser.add_argument("--no-metrics", action="store_true", help="Do not write the metrics JSON.")
+    parser.add_argument("--profile", default=None, help="Run cProfile and save the stats (pstats format) to this path.")
+    parser.add_argument("--profile-stage", action="append", choices=STAGES, default=None, help="With --profile, profile only this stage (can be repeated).")
+    args = parser.parse_args()
+
+    mp3_file = args.audio_file
     if not os.path.exists(mp3_file):
         print(f"Error: {mp3_file} not found.")
         sys.exit(1)
-
-    # 一時的なwavファイルのパス
-    wav_file = "temp_audio.wav"
-    output_file = "transcript.txt" # 出力ファイル名を変数に
-
     try:
-        # ffmpegベースの変換関数を呼び出す
-        convert_mp3_to_wav_with_progress(mp3_path=mp3_file, wav_path=wav_file)
-        # 変換成功後、文字起こし実行
-        transcribe_with_speaker_diarization(wav_path=wav_file, output_path=output_file)
-    except FileNotFoundError:
-        # get_audio_duration内などでffprobe/ffmpegが見つからない場合
-        print("\nError: ffmpeg (and ffprobe) is required but not found.")
+        formats = parse_formats(args.formats)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not ffmpeg_available() or shutil.which("ffprobe") is None:
+        # モデルを読み込む前に確認して、すぐにエラー終了する
+        print("Error: ffmpeg (and ffprobe) is required but not found.")
         print("Please install ffmpeg and ensure it's in your system's PATH.")
         sys.exit(1)
-    except RuntimeError as e:
-         # ffmpeg変換失敗など
-         print(f"\nAn error occurred during processing: {e}")
-         sys.exit(1)
-    except Exception as e:
-        # その他の予期せぬエラー
-        print(f"\nAn unexpected error occurred: {e}")
-        # 必要であればスタックトレースも表示
-        # import traceback
-        # traceback.print_exc()
-        sys.exit(1)
-    finally:
-        # 処理が成功しても失敗しても一時ファイルを削除する
-        if os.path.exists(wav_file):
-            try:
-                print(f"Removing temporary file: {wav_file}")
-                os.remove(wav_file)
-            except OSError as e:
-                # ファイル削除失敗は致命的ではない場合もあるので警告に留める
-                print(f"Warning: Could not remove temporary file {wav_file}: {e}")
 
+    output_file = "transcript.txt" # 出力ファイル名を変数に
+    whisper_model_name = args.whisper_model
+    whisper_compute_type = args.compute_type
+    vad_options = {'pad_sec': args.vad_pad_sec} if args.vad else None
+    print(f"Using {set_torch_threads(args.torch_threads)} torch threads.")
+
+    profiler = PipelineProfiler(mp3_file, profile_path=args.profile, profile_stages=args.profile_stage)
+    with instrumentation.profiling(profiler):
+        try:
+            if args.stream:
+                # 一時WAVを作らず、ffmpegの出力をウィンドウ単位で文字起こし・埋め込み計算する
+                total_duration = get_audio_duration(mp3_file)
+                segments = stream_transcribe_and_embed(
+                    mp3_file, get_whisper_model(whisper_model_name, compute_type=whisper_compute_type), get_voice_encoder(),
+                    window_sec=args.window_sec, overlap_sec=args.overlap_sec,
+                    embedding_batch_size=args.embedding_batch_size, total_duration=total_duration, vad_options=vad_options
+                )
+                cluster_and_write_transcript(segments, segments.embeddings, output_file, clustering_options_from_args(args),
+                                             formats=formats, audio_file=mp3_file)
+            else:
+                # ffmpegでメモリ上にデコード (一時WAVは作らない)
+                with instrumentation.stage("decode"):
+                    audio = decode_mp3_with_progress(mp3_path=mp3_file, workers=args.decode_workers)
+                instrumentation.set_audio_duration(len(audio) / SAMPLE_RATE)
+                # デコード成功後、同じ配列で文字起こしと話者分離を実行
+                transcribe_with_speaker_diarization(
+                    audio=audio, output_path=output_file, embedding_batch_size=args.embedding_batch_size,
+                    clustering_options=clustering_options_from_args(args), vad_options=vad_options,
+                    formats=formats, audio_file=mp3_file
+                )
+        except FileNotFoundError:
+            # get_audio_duration内などでffprobe/ffmpegが見つからない場合
+            print("\nError: ffmpeg (and ffprobe) is required but not found.")
+            print("Please install ffmpeg and ensure it's in your system's PATH.")
+            sys.exit(1)
+        except RuntimeError as e:
+             # ffmpeg変換失敗など
+             print(f"\nAn error occurred during processing: {e}")
+             sys.exit(1)
+        except Exception as e:
+            # その他の予期せぬエラー
+            print(f"\nAn unexpected error occurred: {e}")
+            # 必要であればスタックトレースも表示
+            # import traceback
+            # traceback.print_exc()
+            sys.exit(1)
+
+    profiler.finish()
+    print("Pipeline stages:")
+    profiler.print_summary()
+    if not args.no_metrics:
+        profiler.write_json(args.metrics or default_metrics_path(output_file))
     print("Processing complete.")
\ No newline at end of file
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import queue
+import shutil
+import signal
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from audio_io import ffmpeg_available
+from vad import DEFAULT_PAD_SEC
+from model_manager import set_torch_threads, add_whisper_arguments, loaded_models
+from result_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_MB
+from speaker_registry import DEFAULT_REGISTRY_DIR, DEFAULT_MATCH_THRESHOLD
+from clustering import CLUSTERING_METHODS
+from transcript_writers import parse_formats, transcript_paths, CONTENT_TYPES, DEFAULT_FORMATS
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CONCURRENCY = 1
+# 待ち行列に入れられるジョブ数。これを超えた投入は 429 で断り、クライアントに後で再送してもらう
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_MAX_UPLOAD_MB = 1024
+# 完了したジョブ (とその結果ファイル) を残しておく件数。古いものから削除する
+DEFAULT_KEEP_JOBS = 200
+DEFAULT_JOBS_DIR = os.path.join("out", "jobs")
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# HTTP で指定できるジョブのオプションと型。process_audio_file の引数に変換する
+JOB_OPTIONS = {
+    'use_openai': bool,
+    'openai_chunked': bool,
+    'pipelined': bool,
+    'stream': bool,
+    'window_sec': float,
+    'overlap_sec': float,
+    'embedding_batch_size': int,
+    'vad': bool,
+    'clustering': str,
+    'num_speakers': int,
+    'cluster_threshold': float,
+    'formats': list,
+    'speaker_turns': bool,
+}
+
+
+def job_options_to_kwargs(options):
+    """
+    HTTP で受け取ったジョブのオプション (JSON) を検証し、process_audio_file のキーワード引数に変換する。
+    不正なオプションは ValueError にする。
+    """
+    kwargs = {}
+    clustering_options = {}
+    for name, value in (options or {}).items():
+        expected = JOB_OPTIONS.get(name)
+        if expected is None:
+            raise ValueError(f"Unknown option: {name} (supported: {', '.join(sorted(JOB_OPTIONS))})")
+        if expected is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            raise ValueError(f"Option {name} must be of type {expected.__name__}.")
+        if name == 'vad':
+            kwargs['vad_options'] = {'pad_sec': DEFAULT_PAD_SEC} if value else None
+        elif name == 'clustering':
+            if value not in CLUSTERING_METHODS:
+                raise ValueError(f"Unknown clustering method: {value} (choose from {', '.join(CLUSTERING_METHODS)})")
+            clustering_options['method'] = value
+        elif name == 'num_speakers':
+            clustering_options['num_speakers'] = value
+        elif name == 'cluster_threshold':
+            clustering_options['threshold'] = value
+        elif name == 'speaker_turns':
+            kwargs['turn_options'] = {} if value else None
+        elif name == 'formats':
+            # txt は結果の取得 (/result) に使うので常に書き出す
+            kwargs['formats'] = parse_formats(",".join(["txt"] + [str(format_name) for format_name in value]))
+        else:
+            kwargs[name] = value
+    if kwargs.get('stream') and kwargs.get('use_openai'):
+        raise ValueError("stream is only supported with local Whisper transcription.")
+    if kwargs.get('stream') and kwargs.get('turn_options') is not None:
+        raise ValueError("speaker_turns is not supported with stream.")
+    if clustering_options:
+        kwargs['clustering_options'] = clustering_options
+    return kwargs
+
+
+class Job:
+    """1件の文字起こしジョブ。状態は queued → running → done / failed (または cancelled) と遷移する"""
+
+    def __init__(self, job_id, audio_path, job_dir, kwargs, options, delete_audio):
+        self.id = job_id
+        self.audio_path = audio_path
+        self.job_dir = job_dir
+        self.kwargs = kwargs
+        self.options = options
+        # アップロードされた音声は完了後に削除する (パス指定のジョブは元のファイルを残す)
+        self.delete_audio = delete_audio
+        self.output_file = os.path.join(job_dir, "transcript.txt")
+        self.metrics_file = os.path.join(job_dir, "metrics.json")
+        self.status = "queued"
+        self.message = ""
+        self.metrics = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self, queue_position=None):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'audio_file': os.path.basename(self.audio_path),
+            'options': self.options,
+            'message': self.message,
+            'queue_position': queue_position,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'metrics': self.metrics,
+            'result_url': f"/jobs/{self.id}/result" if self.status == "done" else None,
+        }
+
+
+def resolve_audio_path(audio_path, audio_root):
+    """
+    JSON で指定されたサーバー上の音声ファイルのパスを、audio_root 以下の実在するファイルの絶対パスにする
+    (相対パスは audio_root からのパス)。audio_root が None (パス指定を許可しない) か、
+    シンボリックリンクを解決して audio_root の外を指す場合は PermissionError、ファイルが無い場合は ValueError
+    """
+    if audio_root is None:
+        raise PermissionError("Jobs with audio_path are disabled on this server (start it with --audio-root DIR to allow them).")
+    root = os.path.realpath(audio_root)
+    path = os.path.realpath(os.path.join(root, audio_path))
+    if os.path.commonpath([root, path]) != root:
+        raise PermissionError(f"audio_path must be under the server's --audio-root: {audio_path}")
+    if not os.path.isfile(path):
+        raise ValueError(f"audio_path not found on the server: {audio_path}")
+    return path
+
+
+class QueueFull(Exception):
+    """待ち行列が一杯でジョブを受け付けられない"""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full.")
+        self.retry_after = retry_after
+
+
+class TranscriptionService:
+    """
+    モデルを読み込んだまま常駐し、ジョブを待ち行列から concurrency 個のワーカースレッドで順に処理する。
+
+    待ち行列の長さ (開始前で取り消されていないジョブの数) は max_queue までで、一杯のときは投入を断る
+    (呼び出し側は Retry-After の秒数後に再送する)。
+    ジョブごとの作業ディレクトリ (jobs_dir/[ジョブID]/) に音声・文字起こし結果・計測結果を置き、
+    完了したジョブは keep_jobs 件を超えたら古いものから削除する。
+    """
+
+    def __init__(self, jobs_dir=DEFAULT_JOBS_DIR, concurrency=DEFAULT_CONCURRENCY, max_queue=DEFAULT_MAX_QUEUE,
+                 keep_jobs=DEFAULT_KEEP_JOBS):
+        self.jobs_dir = jobs_dir
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.keep_jobs = keep_jobs
+        self.jobs = {}
+        # 取り消されたジョブも取り出されるまで残るので、待ち行列の長さは Queue ではなく _queued で数える
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        # 完了したジョブの処理時間 (Retry-After の見積もり用)
+        self._recent_seconds = []
+        self._workers = []
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def start(self):
+        for index in range(self.concurrency):
+            worker = threading.Thread(target=self._worker_loop, name=f"transcription-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """待ち行列の残りを処理せずにワーカーを止める (実行中のジョブは終わるまで待つ)"""
+        with self._lock:
+            for job in self.jobs.values():
+                if job.status == "queued":
+                    job.status = "cancelled"
+                    job.message = "Service stopped before the job started."
+            self._queued = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def new_job_dir(self):
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        return job_id, job_dir
+
+    def submit(self, job_id, job_dir, audio_path, options=None, delete_audio=False):
+        """ジョブを待ち行列に入れる。オプションが不正なら ValueError、待ち行列が一杯なら QueueFull"""
+        kwargs = job_options_to_kwargs(options)
+        job = Job(job_id, audio_path, job_dir, kwargs, options or {}, delete_audio)
+        with self._lock:
+            full = self._queued >= self.max_queue
+            if not full:
+                self.jobs[job_id] = job
+                self._queued += 1
+                waiting = self._queued
+        if full:
+            raise QueueFull(self.estimate_wait())
+        self._queue.put(job)
+        print(f"Job {job_id} queued: {audio_path} ({waiting} waiting).")
+        return job
+
+    def is_full(self):
+        with self._lock:
+            return self._queued >= self.max_queue
+
+    def estimate_wait(self):
+        """待ち行列に空きができるまでのおおよその秒数 (最近のジョブの平均処理時間 / 同時実行数)"""
+        with self._lock:
+            average = sum(self._recent_seconds) / len(self._recent_seconds) if self._recent_seconds else 60.0
+        return max(1, int(average / self.concurrency))
+
+    def queue_position(self, job):
+        with self._lock:
+            queued = sorted(
+                (other for other in self.jobs.values() if other.status == "queued"), key=lambda other: other.submitted_at
+            )
+        for position, other in enumerate(queued):
+            if other is job:
+                return position
+        return None
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """まだ始まっていないジョブを取り消す。取り消せたら True"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                return False
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            # 取り消したジョブは待ち行列の長さに数えない (Queue からはワーカーが取り出したときに読み捨てる)
+            self._queued -= 1
+        if job.delete_audio and os.path.exists(job.audio_path):
+            os.remove(job.audio_path)
+        print(f"Job {job.id} cancelled.")
+        self._evict_finished()
+        return True
+
+    def health(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            running = self._running
+            queued = self._queued
+        return {
+            'status': "ok",
+            'concurrency': self.concurrency,
+            'running': running,
+            'queued': queued,
+            'max_queue': self.max_queue,
+            'jobs': counts,
+            'models': ["/".join(key) for key in loaded_models()],
+        }
+
+    def _worker_loop(self):
+        import transcription
+
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.status != "queued": # 取り消し済み
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                self._queued -= 1
+                self._running += 1
+            print(f"Job {job.id} started: {job.audio_path}")
+            try:
+                status = transcription.process_audio_file(
+                    job.audio_path, job.output_file, metrics_file=job.metrics_file, **job.kwargs
+                )
+            except Exception as e:
+                status = {'status': 'error', 'message': str(e)}
+            with self._lock:
+                job.finished_at = time.time()
+                job.status = "done" if status['status'] == 'ok' else "failed"
+                job.message = status.get('message', '')
+                job.metrics = status.get('metrics')
+                self._running -= 1
+                self._recent_seconds = (self._recent_seconds + [job.finished_at - job.started_at])[-20:]
+            if job.delete_audio and os.path.exists(job.audio_path):
+                os.remove(job.audio_path)
+            print(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s.")
+            self._evict_finished()
+
+    def _evict_finished(self):
+        with self._lock:
+            finished = sorted(
+                (job for job in self.jobs.values() if job.status in ("done", "failed", "cancelled")),
+                key=lambda job: job.finished_at or 0
+            )
+            evicted = finished[:max(0, len(finished) - self.keep_jobs)]
+            for job in evicted:
+                del self.jobs[job.id]
+        for job in evicted:
+            shutil.rmtree(job.job_dir, ignore_errors=True)
+
+
+class TranscriptionRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST   /jobs                音声をアップロード (本文が音声、?filename=...&options={JSON}) するか、
+                                JSON {"audio_path": "...", "options": {...}} でサーバー上のファイルを指定してジョブを投入する
+                                (パス指定は audio_root 以下のファイルだけ。audio_root が None なら 403)
+    GET    /jobs/<id>           ジョブの状態
+    GET    /jobs/<id>/result    文字起こし結果 (既定は text/plain。?format=srt などでジョブの formats に指定した形式)
+    GET    /jobs/<id>/metrics   ステージごとの計測結果 (JSON)
+    DELETE /jobs/<id>           開始前のジョブを取り消す
+    GET    /health              待ち行列と読み込み済みモデルの状態
+    """
+
+    server_version = "local-transcriber"
+    service = None
+    max_upload_bytes = DEFAULT_MAX_UPLOAD_MB * 1024 * 1024
+    audio_root = None
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path, content_type):
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_from_path(self, parts):
+        job = self.service.get(parts[1]) if len(parts) >= 2 else None
+        if job is None:
+            self._send_json(404, {'error': "Job not found."})
+        return job
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["health"]:
+            self._send_json(200, self.service.health())
+        elif parts[0] == "jobs" and len(parts) == 2:
+            job = self._job_from_path(parts)
+            if job is not None:
+                self._send_json(200, job.to_dict(self.service.queue_position(job)))
+        elif parts[0] == "jobs" and len(parts) == 3 and parts[2] in ("result", "metrics"):
+            job = self._job_from_path(parts)
+            if job is None:
+                return
+            if parts[2] == "result":
+                format_name = parse_qs(urlparse(self.path).query).get('format', ["txt"])[0]
+                formats = job.kwargs.get('formats', DEFAULT_FORMATS)
+                if format_name not in formats:
+                    self._send_json(400, {'error': f"Format {format_name} was not requested for this job (available: {', '.join(formats)})."})
+                    return
+                path, content_type = transcript_paths(job.output_file, formats)[format_name], CONTENT_TYPES[format_name]
+            else:
+                path, content_type = job.metrics_file, "application/json; charset=utf-8"
+            if job.status not in ("done", "failed") or not os.path.exists(path):
+                self._send_json(409, {'error': f"Job is {job.status}; no {parts[2]} yet.", 'status': job.status})
+            else:
+                self._send_file(path, content_type)
+        else:
+            self._send_json(404, {'error': "Not found."})
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[0] != "jobs" or len(parts) != 2:
+            self._send_json(404, {'error': "Not found."})
+            return
+        job = self._job_from_path(parts)
+        if job is None:
+            return
+        if self.service.cancel(job.id):
+            self._send_json(200, job.to_dict())
+        else:
+            self._send_json(409, {'error': f"Job is {job.status} and can no longer be cancelled.", 'status': job.status})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(404, {'error': "Not found."})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.max_upload_bytes:
+            self._send_json(413, {'error': f"Upload exceeds {self.max_upload_bytes // (1024 * 1024)} MB."})
+            self.close_connection = True
+            return
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        if self.service.is_full():
+            # 待ち行列が一杯なら、アップロードされた本文は保存せずに読み捨てて断る
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+            retry_after = self.service.estimate_wait()
+            self._send_json(429, {'error': "Job queue is full.", 'retry_after': retry_after}, headers={'Retry-After': str(retry_after)})
+            return
+        job_id, job_dir = self.service.new_job_dir()
+        try:
+            if content_type == "application/json":
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict) or not isinstance(request.get('audio_path'), str):
+                    raise ValueError("Expected a JSON object with an audio_path string.")
+                audio_path = resolve_audio_path(request['audio_path'], self.audio_root)
+                options = request.get('options') or {}
+                delete_audio = False
+            else:
+                # 本文をそのまま音声ファイルとして少しずつ保存する (大きなファイルでもメモリを使わない)
+                query = parse_qs(url.query)
+                filename = os.path.basename(query.get('filename', ["audio.mp3"])[0]) or "audio.mp3"
+                options = json.loads(query.get('options', ["{}"])[0])
+                audio_path = os.path.join(job_dir, filename)
+                remaining = length
+                with open(audio_path, "wb") as f:
+                    while remaining > 0:
+                        chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                if remaining > 0 or length == 0:
+                    raise ValueError("Upload was empty or incomplete.")
+                delete_audio = True
+            if not isinstance(options, dict):
+                raise ValueError("options must be a JSON object.")
+            job = self.service.submit(job_id, job_dir, audio_path, options=options, delete_audio=delete_audio)
+        except QueueFull as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self._send_json(429, {'error': str(e), 'retry_after': e.retry_after}, headers={'Retry-After': str(e.retry_after)})
+            return
+        except PermissionError as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self._send_json(403, {'error': str(e)})
+            return
+        except ValueError as e: # json.JSONDecodeError も ValueError
+            shutil.rmtree(job_dir, ignore_errors=True)
+            self._send_json(400, {'error': str(e)})
+            return
+        self._send_json(202, job.to_dict(self.service.queue_position(job)), headers={'Location': f"/jobs/{job.id}"})
+
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, max_upload_mb=DEFAULT_MAX_UPLOAD_MB, audio_root=None):
+    """
+    service を使う HTTP サーバーを作る (serve_forever() で開始する)。
+    audio_root を指定した場合だけ、その下のファイルをパスで指定したジョブを受け付ける
+    """
+    handler = type("Handler", (TranscriptionRequestHandler,), {
+        'service': service, 'max_upload_bytes': int(max_upload_mb * 1024 * 1024), 'audio_root': audio_root,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local transcription worker service that keeps the models loaded and accepts jobs over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}; only local clients can connect).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help=f"Number of jobs processed at the same time (default: {DEFAULT_CONCURRENCY}). Jobs share the loaded models, so local Whisper transcription and speaker embedding run one job at a time; only decoding, OpenAI requests, clustering and writing overlap.")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help=f"Maximum number of waiting jobs; further submissions get HTTP 429 with Retry-After (default: {DEFAULT_MAX_QUEUE}).")
+    parser.add_argument("--max-upload-mb", type=float, default=DEFAULT_MAX_UPLOAD_MB, help=f"Maximum upload size in MB (default: {DEFAULT_MAX_UPLOAD_MB}).")
+    parser.add_argument("--jobs-dir", default=DEFAULT_JOBS_DIR, help=f"Directory for uploaded audio, transcripts and metrics of each job (default: {DEFAULT_JOBS_DIR}).")
+    parser.add_argument("--audio-root", default=None, help="Accept JSON jobs with an audio_path, but only for files under this directory (default: such jobs are rejected and audio must be uploaded).")
+    parser.add_argument("--keep-jobs", type=int, default=DEFAULT_KEEP_JOBS, help=f"Number of finished jobs whose results are kept (default: {DEFAULT_KEEP_JOBS}).")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Torch intra-op threads (default: CPU count / concurrency).")
+    parser.add_argument("--no-local-whisper", action="store_true", help="Do not load local Whisper at startup (for services that only run use_openai jobs).")
+    add_whisper_arguments(parser)
+    parser.add_argument("--speaker-registry", nargs="?", const=DEFAULT_REGISTRY_DIR, default=None, help=f"Name clusters that match enrolled speakers instead of writing Speaker_N (default registry: {DEFAULT_REGISTRY_DIR}).")
+    parser.add_argument("--match-threshold", type=float, default=DEFAULT_MATCH_THRESHOLD, help=f"Minimum cosine similarity for --speaker-registry matches (default: {DEFAULT_MATCH_THRESHOLD}).")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the on-disk result cache.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"Directory of the result cache (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_CACHE_MAX_MB, help=f"Maximum size of the result cache in MB (default: {DEFAULT_CACHE_MAX_MB}).")
+    args = parser.parse_args()
+
+    if args.concurrency < 1 or args.max_queue < 1:
+        print("Error: --concurrency and --max-queue must be >= 1.")
+        sys.exit(1)
+    if not ffmpeg_available():
+        print("Error: ffmpeg is required but not found. Please install ffmpeg and ensure it's in your system's PATH.")
+        sys.exit(1)
+
+    import transcription
+
+    # 同時に実行するジョブ数 × スレッド数がコア数を超えないようにする
+    print(f"Using {set_torch_threads(args.torch_threads or max(1, (os.cpu_count() or 1) // args.concurrency))} torch threads.")
+    transcription.whisper_model_name = args.whisper_model
+    transcription.whisper_compute_type = args.compute_type
+    if not args.no_cache:
+        transcription.result_cache = transcription.ResultCache(cache_dir=args.cache_dir, max_mb=args.cache_max_mb)
+    if args.speaker_registry:
+        transcription.speaker_registry = transcription.SpeakerRegistry(args.speaker_registry)
+        transcription.match_threshold = args.match_threshold
+    # 最初のジョブを待たせないよう、起動時にモデルを読み込んでおく
+    transcription.initialize_local_models(require_whisper=not args.no_local_whisper, require_encoder=True)
+
+    service = TranscriptionService(
+        jobs_dir=args.jobs_dir, concurrency=args.concurrency, max_queue=args.max_queue, keep_jobs=args.keep_jobs
+    )
+    service.start()
+    server = create_server(service, host=args.host, port=args.port, max_upload_mb=args.max_upload_mb, audio_root=args.audio_root)
+    print(f"Transcription service listening on http://{args.host}:{args.port} "
+          f"(concurrency {args.concurrency}, queue {args.max_queue}). Press Ctrl+C to stop.")
+    # SIGTERM (systemd などからの停止) でも Ctrl+C と同じく、実行中のジョブを終えてから止める
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown, daemon=True).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("\nStopping transcription service...")
+        server.server_close()
+        service.stop()
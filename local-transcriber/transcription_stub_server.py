@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import argparse
+import email
+import io
+import json
+import random
+import threading
+import time
+import wave
+from email import policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8767
+# 応答に含めるダミーのセグメントの長さ (秒)
+SEGMENT_SEC = 5.0
+DEFAULT_RETRY_AFTER = 1
+
+
+def parse_multipart(content_type, body):
+    """multipart/form-data の本文を {フィールド名: (ファイル名, バイト列)} の辞書にする (ファイル以外はファイル名が None)"""
+    message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body, policy=policy.HTTP)
+    if not message.is_multipart():
+        raise ValueError("Expected a multipart/form-data request.")
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name is not None:
+            fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return fields
+
+
+def wav_duration(data):
+    """WAVのバイト列から長さ (秒) を求める"""
+    with wave.open(io.BytesIO(data), "rb") as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+
+def stub_transcription(file_name, duration):
+    """長さから決まる verbose_json を作る (SEGMENT_SEC ごとに、ファイル名と番号を書いたセグメントを並べる)"""
+    segments = []
+    start = 0.0
+    while start < duration:
+        end = min(start + SEGMENT_SEC, duration)
+        segments.append({'id': len(segments), 'start': round(start, 3), 'end': round(end, 3),
+                         'text': f" {file_name} segment {len(segments) + 1}."})
+        start = end
+    return {
+        'task': "transcribe",
+        'language': "english",
+        'duration': round(duration, 3),
+        'text': "".join(segment['text'] for segment in segments).strip(),
+        'segments': segments,
+    }
+
+
+class StubTranscriptionRequestHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI 互換の文字起こし API のスタブ (openai_chunked.py の再試行・バックオフ・同時実行数の確認用)。
+    POST /v1/audio/transcriptions   アップロードされたWAVの長さからダミーの verbose_json を返す (delay 秒待ってから返す)
+    GET  /v1/models                 モデル一覧 (1件)
+
+    エラーの注入:
+        fail_first         ファイル名ごとに、最初の fail_first 回は fail_status (429 か 503) を返す (再試行で必ず成功する)
+        rate_limit_rate    その後の各リクエストを、この確率で 429 (Retry-After 付き) にする
+        unavailable_rate   同様に、この確率で 503 にする
+    """
+
+    server_version = "local-transcriber-transcription-stub"
+    delay = 0.0
+    fail_first = 0
+    fail_status = 429
+    rate_limit_rate = 0.0
+    unavailable_rate = 0.0
+    retry_after = DEFAULT_RETRY_AFTER
+    rng = random.Random()
+    requests = 0
+    in_flight = 0
+    max_in_flight = 0
+    attempts = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, code, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _injected_error(self, file_name):
+        """注入するエラーの (ステータス, メッセージ) を決める (注入しない場合は None)"""
+        cls = type(self)
+        with self.lock:
+            attempt = cls.attempts.get(file_name, 0) + 1
+            cls.attempts[file_name] = attempt
+            draw = cls.rng.random()
+        if attempt <= self.fail_first:
+            if self.fail_status == 503:
+                return 503, f"Service unavailable (injected, attempt {attempt}/{self.fail_first})."
+            return 429, f"Rate limit reached (injected, attempt {attempt}/{self.fail_first})."
+        if draw < self.rate_limit_rate:
+            return 429, "Rate limit reached (injected)."
+        if draw < self.rate_limit_rate + self.unavailable_rate:
+            return 503, "Service unavailable (injected)."
+        return None
+
+    def do_GET(self):
+        if urlparse(self.path).path.rstrip("/") == "/v1/models":
+            self._send_json(200, {'object': "list", 'data': [{'id': "whisper-1", 'object': "model", 'owned_by': "local"}]})
+        else:
+            self._send_json(404, {'error': {'message': "Not found."}})
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/v1/audio/transcriptions":
+            self._send_json(404, {'error': {'message': "Not found."}})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            fields = parse_multipart(self.headers.get("Content-Type", ""), body)
+            file_name, data = fields['file']
+            duration = wav_duration(data)
+        except (ValueError, KeyError, EOFError, wave.Error):
+            self._send_json(400, {'error': {'message': "Expected a multipart upload with a WAV 'file' field."}})
+            return
+
+        cls = type(self)
+        with self.lock:
+            cls.requests += 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            in_flight, max_in_flight = cls.in_flight, cls.max_in_flight
+        print(f"Upload {file_name}: {duration:.1f}s of audio ({in_flight} in flight, max {max_in_flight}).")
+        try:
+            time.sleep(self.delay)
+            error = self._injected_error(file_name)
+        finally:
+            # 応答を送る前に数え終える (クライアントが応答を受け取ってすぐ次を送っても、同時実行数を多く数えない)
+            with self.lock:
+                cls.in_flight -= 1
+        if error is not None:
+            code, message = error
+            headers = {'Retry-After': str(self.retry_after)} if code == 429 else None
+            error_type = "rate_limit_exceeded" if code == 429 else "server_error"
+            self._send_json(code, {'error': {'message': message, 'type': error_type}}, headers=headers)
+            return
+        self._send_json(200, stub_transcription(file_name, duration))
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, delay=0.0, fail_first=0, fail_status=429, rate_limit_rate=0.0,
+                unavailable_rate=0.0, retry_after=DEFAULT_RETRY_AFTER, seed=None):
+    """
+    スタブサーバーを作る (port=0 なら空いているポートを使う)。カウンターはサーバーごとのハンドラークラス
+    (server.RequestHandlerClass の requests / max_in_flight / attempts) に集計される。
+    """
+    handler = type("Handler", (StubTranscriptionRequestHandler,), {
+        'delay': delay,
+        'fail_first': fail_first,
+        'fail_status': fail_status,
+        'rate_limit_rate': rate_limit_rate,
+        'unavailable_rate': unavailable_rate,
+        'retry_after': retry_after,
+        'rng': random.Random(seed),
+        'attempts': {},
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible audio transcription endpoint for testing --openai-chunked (retries, backoff and concurrency) without an API key.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT}).")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before each response, so that concurrent uploads overlap (default: 0).")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N uploads of each chunk with --fail-status, so every chunk goes through N retries (default: 0).")
+    parser.add_argument("--fail-status", type=int, choices=(429, 503), default=429, help="Status returned by --fail-first (default: 429).")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probability of answering any other upload with 429 (default: 0).")
+    parser.add_argument("--unavailable-rate", type=float, default=0.0, help="Probability of answering any other upload with 503 (default: 0).")
+    parser.add_argument("--retry-after", type=int, default=DEFAULT_RETRY_AFTER, help=f"Retry-After seconds sent with injected 429 responses (default: {DEFAULT_RETRY_AFTER}).")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the injected errors, to make a run reproducible.")
+    args = parser.parse_args()
+    if args.rate_limit_rate + args.unavailable_rate > 1:
+        parser.error("--rate-limit-rate and --unavailable-rate must add up to at most 1.")
+
+    server = make_server(args.host, args.port, delay=args.delay, fail_first=args.fail_first, fail_status=args.fail_status,
+                         rate_limit_rate=args.rate_limit_rate, unavailable_rate=args.unavailable_rate,
+                         retry_after=args.retry_after, seed=args.seed)
+    handler = server.RequestHandlerClass
+    print(f"Stub transcription endpoint listening on http://{args.host}:{args.port}/v1. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{handler.requests} requests, at most {handler.max_in_flight} in flight.")
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from audio_io import SAMPLE_RATE
+
+# フレーム長 (秒)。Whisper / Resemblyzer と同じ16kHzの配列をそのまま使う
+FRAME_SEC = 0.03
+# ノイズフロア (フレームエネルギーの下位パーセンタイル) からこれ以上大きいフレームを発話候補とする
+DEFAULT_ENERGY_MARGIN_DB = 12.0
+# これより小さいフレームはノイズフロアに関係なく無音とみなす
+DEFAULT_MIN_ENERGY_DB = -55.0
+# スペクトル平坦度がこれ以上のフレーム (定常ノイズ、空調音など) は発話とみなさない
+DEFAULT_MAX_FLATNESS = 0.5
+DEFAULT_MIN_SPEECH_SEC = 0.25
+DEFAULT_MIN_SILENCE_SEC = 0.6
+# 発話区間の前後に付ける余白 (秒)。語頭・語尾の子音を切らないため
+DEFAULT_PAD_SEC = 0.3
+# スペクトル計算を一度に行うフレーム数 (長時間の録音でもメモリを抑える)
+BLOCK_FRAMES = 8192
+
+
+def frame_features(samples, frame_sec=FRAME_SEC):
+    """
+    重なりなしのフレームごとにエネルギー (dBFS) とスペクトル平坦度 (0~1) を計算する。
+    平坦度は パワースペクトルの幾何平均 / 算術平均 で、白色雑音に近いほど1、声や音楽のように
+    倍音構造を持つ音ほど0に近くなる。
+    """
+    frame_len = int(frame_sec * SAMPLE_RATE)
+    n_frames = len(samples) // frame_len
+    energy_db = np.empty(n_frames)
+    flatness = np.empty(n_frames)
+    window = np.hanning(frame_len)
+    for block_start in range(0, n_frames, BLOCK_FRAMES):
+        block_end = min(block_start + BLOCK_FRAMES, n_frames)
+        frames = samples[block_start * frame_len:block_end * frame_len].reshape(-1, frame_len).astype(np.float64)
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        energy_db[block_start:block_end] = 20 * np.log10(np.maximum(rms, 1e-10))
+        power = np.square(np.abs(np.fft.rfft(frames * window, axis=1))) + 1e-12
+        flatness[block_start:block_end] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+    return energy_db, flatness
+
+
+def _runs(mask):
+    """bool配列の True が連続する区間を [(開始, 終了), ...] (終了は含まない) で返す"""
+    padded = np.concatenate([[False], mask, [False]])
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def detect_speech_regions(samples, energy_margin_db=DEFAULT_ENERGY_MARGIN_DB, min_energy_db=DEFAULT_MIN_ENERGY_DB,
+                          max_flatness=DEFAULT_MAX_FLATNESS, min_speech_sec=DEFAULT_MIN_SPEECH_SEC,
+                          min_silence_sec=DEFAULT_MIN_SILENCE_SEC, pad_sec=DEFAULT_PAD_SEC, frame_sec=FRAME_SEC):
+    """
+    エネルギーとスペクトル平坦度による簡易VADで発話区間を検出する。
+    min_silence_sec より短い無音は発話に含め、min_speech_sec より短い発話は捨て、前後に pad_sec の余白を付ける。
+    戻り値: [(start_sec, end_sec), ...] (時間順、重なりなし)
+    """
+    energy_db, flatness = frame_features(samples, frame_sec)
+    if len(energy_db) == 0:
+        return []
+    # 録音ごとにノイズフロアが違うので、しきい値はエネルギー分布の下位10%を基準に決める
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(min_energy_db, noise_floor + energy_margin_db)
+    speech = (energy_db >= threshold) & (flatness < max_flatness)
+
+    # 短い無音の穴を埋めてから、短すぎる発話を捨てる
+    min_silence_frames = int(round(min_silence_sec / frame_sec))
+    for start, end in _runs(~speech):
+        if start > 0 and end < len(speech) and end - start < min_silence_frames:
+            speech[start:end] = True
+    min_speech_frames = int(round(min_speech_sec / frame_sec))
+    total_sec = len(samples) / SAMPLE_RATE
+    regions = []
+    for start, end in _runs(speech):
+        if end - start < min_speech_frames:
+            continue
+        region_start = max(0.0, start * frame_sec - pad_sec)
+        region_end = min(total_sec, end * frame_sec + pad_sec)
+        if regions and region_start <= regions[-1][1]:
+            # 余白を付けて重なった区間はつなげる
+            regions[-1] = (regions[-1][0], region_end)
+        else:
+            regions.append((region_start, region_end))
+    return regions
+
+
+class SpeechTimeline:
+    """
+    発話区間だけをつなげた短い音声と、元の音声のタイムラインとの対応表。
+    つなげた音声上の時刻を to_original で元の時刻に戻す。
+    """
+
+    def __init__(self, regions):
+        self.regions = [(float(start), float(end)) for start, end in regions]
+        lengths = np.array([end - start for start, end in self.regions], dtype=np.float64)
+        self.original_starts = np.array([start for start, _ in self.regions], dtype=np.float64)
+        self.compact_starts = np.concatenate([[0.0], np.cumsum(lengths)[:-1]]) if len(lengths) else np.zeros(0)
+        self.speech_sec = float(lengths.sum())
+
+    def extract(self, samples):
+        """samples から発話区間だけを取り出してつなげた配列を返す"""
+        if not self.regions:
+            return np.zeros(0, dtype=samples.dtype)
+        return np.concatenate([
+            samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)] for start, end in self.regions
+        ])
+
+    def to_original(self, compact_sec):
+        """つなげた音声上の時刻 (秒、スカラーまたは配列) を元の音声の時刻に変換する"""
+        compact_sec = np.asarray(compact_sec, dtype=np.float64)
+        index = np.clip(np.searchsorted(self.compact_starts, compact_sec, side="right") - 1, 0, len(self.compact_starts) - 1)
+        return self.original_starts[index] + (compact_sec - self.compact_starts[index])
+
+
+def transcribe_speech_only(whisper_model, samples, vad_options=None, **transcribe_kwargs):
+    """
+    VADで検出した発話区間だけをWhisperで文字起こしし、セグメントの時刻を元の音声のタイムラインに戻す。
+    区間ごとに呼ぶのではなくつなげて1回で文字起こしするので、前後の文脈も保たれる。
+    戻り値: (Whisperの結果 (segments の時刻は元の音声基準), 統計情報の辞書)
+    """
+    total_sec = len(samples) / SAMPLE_RATE
+    regions = detect_speech_regions(samples, **(vad_options or {}))
+    timeline = SpeechTimeline(regions)
+    stats = {
+        'total_sec': round(total_sec, 2),
+        'speech_sec': round(timeline.speech_sec, 2),
+        'speech_ratio': round(timeline.speech_sec / total_sec, 4) if total_sec > 0 else 0.0,
+        'regions': len(regions),
+    }
+    print(f"VAD: {len(regions)} speech regions, {timeline.speech_sec:.1f}s of {total_sec:.1f}s "
+          f"({stats['speech_ratio'] * 100:.1f}% speech); skipping {total_sec - timeline.speech_sec:.1f}s "
+          f"({(1 - stats['speech_ratio']) * 100:.1f}% less audio for Whisper and speaker embedding).")
+    if not regions:
+        return {'text': '', 'segments': [], 'language': None}, stats
+
+    result = whisper_model.transcribe(timeline.extract(samples), **transcribe_kwargs)
+    for segment in result.get("segments", []):
+        # 終了時刻が区間の継ぎ目ちょうどの場合に次の区間へずれないよう、終了は少し手前で変換する
+        segment['start'] = float(timeline.to_original(segment.get('start', 0)))
+        end = float(segment.get('end', 0))
+        segment['end'] = float(timeline.to_original(max(end - 1e-6, 0.0))) + 1e-6
+        for word in segment.get('words', []) or []:
+            word['start'] = float(timeline.to_original(word.get('start', 0)))
+            word['end'] = float(timeline.to_original(max(word.get('end', 0) - 1e-6, 0.0))) + 1e-6
+    return result, stats